@@ -0,0 +1,389 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict, namedtuple
+
+# Distributions whose versions are recorded with every result set
+PACKAGES = ("mig_utils", "ssh2-python", "fs", "fs.sshfs", "paramiko", "six")
+
+# Relative change of the median that is always tolerated, per metric,
+# e.g. 0.1 tolerates a factor 1.1 either way.
+# The tail latency is noisier than the rest on a shared machine
+DEFAULT_TOLERANCES = OrderedDict(
+    [("throughput", 0.10), ("p50_seconds", 0.10), ("p99_seconds", 0.25)]
+)
+
+# Metric -> whether higher is better
+METRICS = OrderedDict(
+    [("throughput", True), ("p50_seconds", False), ("p99_seconds", False)]
+)
+
+# Scale of the median absolute deviation to a standard deviation
+_MAD_SCALE = 1.4826
+
+
+def _version(package):
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        import pkg_resources
+
+        try:
+            return pkg_resources.get_distribution(package).version
+        except pkg_resources.DistributionNotFound:
+            return None
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return None
+
+
+def _cpu():
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except (IOError, OSError):
+        pass
+    return platform.processor() or platform.machine()
+
+
+def _commit():
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def environment():
+    """
+    :return: dict of the machine, Python and package versions that a result
+    set was measured with
+    """
+    return OrderedDict(
+        [
+            ("python", platform.python_version()),
+            ("implementation", platform.python_implementation()),
+            ("platform", platform.platform()),
+            ("cpu", _cpu()),
+            ("cpu_count", os.cpu_count()),
+            ("packages", OrderedDict((name, _version(name)) for name in PACKAGES)),
+            ("commit", _commit()),
+        ]
+    )
+
+
+class ResultStore:
+    def __init__(self, directory):
+        """
+        A directory of result sets, one JSON document per run of the suite,
+        named after the time it was created and the commit it measured
+        :param directory: path of the directory, it is created if missing
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def names(self):
+        """
+        :return: the names of the stored result sets, oldest first
+        """
+        return sorted(
+            name[: -len(".json")]
+            for name in os.listdir(self.directory)
+            if name.endswith(".json")
+        )
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".json")
+
+    def save(self, document, name=None):
+        """
+        :param document: result set of the suite
+        :param name: optional name, defaults to the creation time followed by
+        the short commit of the environment
+        :return: the name that it was stored under
+        """
+        if name is None:
+            created = datetime.datetime.strptime(
+                document["created"], "%Y-%m-%dT%H:%M:%S.%fZ"
+            )
+            name = created.strftime("%Y%m%dT%H%M%S")
+            commit = document.get("environment", {}).get("commit")
+            if commit:
+                name += "-" + commit[:8]
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                json.dump(document, tmp_file, indent=2)
+                tmp_file.write("\n")
+            os.rename(tmp_path, self.path(name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return name
+
+    def load(self, name):
+        """
+        :param name: name of a stored result set, "latest" for the newest,
+        or the path of a result file
+        :return: the result set
+        """
+        if name == "latest":
+            names = self.names()
+            if not names:
+                raise ValueError("{} holds no results".format(self.directory))
+            name = names[-1]
+        path = name if os.path.isfile(name) else self.path(name)
+        with open(path) as result_file:
+            return json.load(result_file, object_pairs_hook=OrderedDict)
+
+
+Change = namedtuple("Change", "key metric unit baseline current change limit status")
+
+
+def _value(summary, metric):
+    if metric == "throughput":
+        if summary["bytes"]:
+            return summary["throughput_bytes_per_second"]
+        return summary["operations_per_second"]
+    return summary[metric]
+
+
+def _median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def _log_spread(logs):
+    """
+    :param logs: logarithms of the values of the runs
+    :return: robust estimate of their standard deviation, 0 for a single run
+    """
+    if len(logs) < 2:
+        return 0.0
+    median = _median(logs)
+    return _MAD_SCALE * _median([abs(log - median) for log in logs])
+
+
+def _key(result):
+    return (result["backend"], result["workload"], result["operation"])
+
+
+def compare(baseline, current, tolerances=None, sigmas=3.0):
+    """Compare the medians of the runs of each operation in two result sets.
+    A change only counts when it is beyond both the tolerance of the metric
+    and sigmas times the run to run noise of the two sets, so a noisy
+    operation has to move further before it is reported. Both are measured
+    on the ratio of the values, so that halving and doubling count the same.
+    :param baseline: result set to compare against
+    :param current: result set to compare
+    :param tolerances: optional dict of metric -> relative change that is
+    always tolerated, defaults to DEFAULT_TOLERANCES
+    :param sigmas: number of standard deviations of the noise that a change
+    has to exceed
+    :return: list of Change, with the limit as the factor that the values
+    may change by and the status "regressed", "improved",
+    "unchanged", "new" or "missing"
+    """
+    limits = OrderedDict(DEFAULT_TOLERANCES)
+    limits.update(tolerances or {})
+    before = OrderedDict((_key(result), result) for result in baseline["results"])
+    changes = []
+    for result in current["results"]:
+        key = _key(result)
+        base = before.pop(key, None)
+        if base is None:
+            changes.append(Change(key, None, None, None, None, None, None, "new"))
+            continue
+        for metric, higher_is_better in METRICS.items():
+            unit = "s"
+            if metric == "throughput":
+                unit = "B/s" if result["bytes"] else "op/s"
+            base_values = [_value(run, metric) for run in base.get("runs", [base])]
+            values = [_value(run, metric) for run in result.get("runs", [result])]
+            if min(base_values + values) <= 0:
+                continue
+            base_logs = [math.log(value) for value in base_values]
+            logs = [math.log(value) for value in values]
+            ratio = _median(logs) - _median(base_logs)
+            noise = math.hypot(_log_spread(base_logs), _log_spread(logs))
+            limit = max(math.log1p(limits[metric]), sigmas * noise)
+            worse = -ratio if higher_is_better else ratio
+            if worse > limit:
+                status = "regressed"
+            elif -worse > limit:
+                status = "improved"
+            else:
+                status = "unchanged"
+            base_median, median = _median(base_values), _median(values)
+            change = median / base_median - 1.0
+            limit = math.exp(limit)
+            changes.append(
+                Change(key, metric, unit, base_median, median, change, limit, status)
+            )
+    for key in before:
+        changes.append(Change(key, None, None, None, None, None, None, "missing"))
+    return changes
+
+
+def regressions(changes):
+    return [change for change in changes if change.status == "regressed"]
+
+
+def _format_value(value, unit):
+    if unit == "B/s":
+        return "{:.2f} MB/s".format(value / 1e6)
+    if unit == "s":
+        return "{:.3f} ms".format(value * 1e3)
+    return "{:.1f} op/s".format(value)
+
+
+def _environment_lines(baseline, current):
+    lines = []
+    before = baseline.get("environment", {})
+    after = current.get("environment", {})
+    for field in ("python", "implementation", "platform", "cpu", "cpu_count"):
+        if before.get(field) != after.get(field):
+            lines.append(
+                "  {}: {} -> {}".format(field, before.get(field), after.get(field))
+            )
+    packages = before.get("packages", {})
+    for name, version in after.get("packages", {}).items():
+        if packages.get(name) != version:
+            lines.append("  {}: {} -> {}".format(name, packages.get(name), version))
+    if baseline.get("config") != current.get("config"):
+        lines.append("  the suite was run with a different config")
+    return lines
+
+
+def format_diff(baseline, current, changes, verbose=False):
+    """
+    :param verbose: whether to list the unchanged metrics as well
+    :return: str that lists the changes and any differences between
+    the environments of the two result sets
+    """
+    lines = []
+    environment_lines = _environment_lines(baseline, current)
+    if environment_lines:
+        lines.append("The environments differ, the comparison may not hold:")
+        lines.extend(environment_lines)
+    for change in changes:
+        name = "/".join(change.key)
+        if change.metric is None:
+            lines.append("{:<9} {}".format(change.status, name))
+        elif verbose or change.status != "unchanged":
+            lines.append(
+                "{:<9} {} {}: {} -> {} ({:+.1%}, tolerated x{:.2f})".format(
+                    change.status,
+                    name,
+                    change.metric,
+                    _format_value(change.baseline, change.unit),
+                    _format_value(change.current, change.unit),
+                    change.change,
+                    change.limit,
+                )
+            )
+    found = regressions(changes)
+    if found:
+        lines.append("{} regression(s)".format(len(found)))
+    else:
+        lines.append("No regressions")
+    return "\n".join(lines) + "\n"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="List and compare the stored results of suite.py"
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    listing = commands.add_parser("list", help="list the stored result sets")
+    listing.add_argument("directory")
+    comparing = commands.add_parser(
+        "compare",
+        help="compare two result sets, exits with 1 if the second regressed",
+    )
+    comparing.add_argument("baseline", help="name, 'latest' or path of a result")
+    comparing.add_argument("current", help="name, 'latest' or path of a result")
+    comparing.add_argument(
+        "--directory", default=".", help="directory that the names are stored in"
+    )
+    add_compare_arguments(comparing)
+    return parser.parse_args(argv)
+
+
+def add_compare_arguments(parser):
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCES["throughput"],
+        help="relative change of the throughput and median latency that is "
+        "always tolerated",
+    )
+    parser.add_argument(
+        "--tail-tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCES["p99_seconds"],
+        help="relative change of the p99 latency that is always tolerated",
+    )
+    parser.add_argument(
+        "--sigmas",
+        type=float,
+        default=3.0,
+        help="standard deviations of the run to run noise that a change "
+        "has to exceed",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="list the unchanged metrics too"
+    )
+
+
+def tolerances(args):
+    return {
+        "throughput": args.tolerance,
+        "p50_seconds": args.tolerance,
+        "p99_seconds": args.tail_tolerance,
+    }
+
+
+def report(baseline, current, args, output=sys.stderr):
+    """Write the diff of two result sets
+    :return: True if the current results regressed
+    """
+    changes = compare(baseline, current, tolerances(args), args.sigmas)
+    output.write(format_diff(baseline, current, changes, args.verbose))
+    return bool(regressions(changes))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "list":
+        store = ResultStore(args.directory)
+        for name in store.names():
+            sys.stdout.write(name + "\n")
+        return 0
+    store = ResultStore(args.directory)
+    regressed = report(
+        store.load(args.baseline), store.load(args.current), args, sys.stdout
+    )
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
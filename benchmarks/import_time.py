@@ -0,0 +1,83 @@
+import argparse
+import json
+import subprocess
+import sys
+from collections import OrderedDict
+from suite import summarize
+
+# Statements that are timed, each in a fresh interpreter
+STATEMENTS = OrderedDict(
+    [
+        ("import", "import mig.io"),
+        ("sftp", "import mig.io; mig.io.SFTPStore"),
+        ("sshfs", "import mig.io; mig.io.SSHFSStore"),
+        ("both", "import mig.io; mig.io.SFTPStore; mig.io.SSHFSStore"),
+    ]
+)
+
+_TIMER = """
+import sys
+import time
+# A None entry makes the import raise ImportError
+sys.modules.update(dict.fromkeys({hidden!r}))
+_start = time.perf_counter()
+{statement}
+print(time.perf_counter() - _start)
+"""
+
+
+def time_statement(statement, repeat, hidden=()):
+    """
+    :param statement: Python source that is timed
+    :param repeat: number of interpreters that it is timed in
+    :param hidden: names of modules that fail to import, as if they weren't
+    installed
+    :return: list of seconds, one per interpreter
+    """
+    source = _TIMER.format(hidden=list(hidden), statement=statement)
+    return [
+        float(subprocess.check_output([sys.executable, "-c", source]))
+        for _ in range(repeat)
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the time that importing mig.io and its backends "
+        "takes in a fresh interpreter"
+    )
+    parser.add_argument(
+        "--statements", nargs="+", choices=list(STATEMENTS), default=list(STATEMENTS)
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--hide",
+        nargs="+",
+        default=[],
+        help="modules to hide, e.g. fsspec to measure without the optional "
+        "dependencies",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for name in args.statements:
+        samples = [
+            (seconds, 0)
+            for seconds in time_statement(STATEMENTS[name], args.repeat, args.hide)
+        ]
+        result = OrderedDict(
+            [("statement", STATEMENTS[name]), ("hidden", list(args.hide))]
+        )
+        summary = summarize(samples)
+        for field in ("count", "mean_seconds", "p50_seconds", "p99_seconds"):
+            result[field] = summary[field]
+        results.append(result)
+    sys.stdout.write(json.dumps(results, indent=2) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    main()
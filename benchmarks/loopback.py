@@ -0,0 +1,256 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import paramiko
+from paramiko import (
+    AUTH_FAILED,
+    AUTH_SUCCESSFUL,
+    OPEN_SUCCEEDED,
+    SFTP_OK,
+    SFTPAttributes,
+    SFTPHandle,
+    SFTPServer,
+    SFTPServerInterface,
+)
+
+
+def _errno(err):
+    return SFTPServer.convert_errno(err.errno)
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as err:
+            return _errno(err)
+
+    def chattr(self, attr):
+        try:
+            SFTPServer.set_file_attr(self.filename, attr)
+        except OSError as err:
+            return _errno(err)
+        return SFTP_OK
+
+
+class _Files(SFTPServerInterface):
+    def __init__(self, server, root, *args, **kwargs):
+        """
+        Serves the files below root, the sftp paths are relative to it
+        :param server: the paramiko ServerInterface of the session
+        :param root: local directory that is served
+        """
+        super(_Files, self).__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def list_folder(self, path):
+        path = self._local(path)
+        try:
+            entries = []
+            for name in os.listdir(path):
+                attrs = SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+                attrs.filename = name
+                entries.append(attrs)
+            return entries
+        except OSError as err:
+            return _errno(err)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as err:
+            return _errno(err)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        path = self._local(path)
+        try:
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as err:
+            return _errno(err)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as err:
+            return _errno(err)
+        return SFTP_OK
+
+    def remove(self, path):
+        return self._call(os.remove, self._local(path))
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, self._local(oldpath), self._local(newpath))
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, self._local(path))
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, self._local(path))
+
+    def chattr(self, path, attr):
+        return self._call(SFTPServer.set_file_attr, self._local(path), attr)
+
+
+class _Auth(paramiko.ServerInterface):
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.username, self.password):
+            return AUTH_SUCCESSFUL
+        return AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+
+def listen(port=0):
+    """
+    :param port: port to listen on, defaults to a free port
+    :return: socket that listens on 127.0.0.1
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", port))
+    sock.listen(128)
+    return sock
+
+
+def run_until_stdin_closes(sock, handle):
+    """Accept connections on sock in a thread until stdin is closed,
+    the port is written to stdout for the ChildServer that started the process
+    :param handle: callable handle(client) that serves an accepted socket,
+    it must not block
+    :return: None
+    """
+
+    def accept():
+        while True:
+            client, _ = sock.accept()
+            handle(client)
+
+    threading.Thread(target=accept, daemon=True).start()
+    sys.stdout.write("{}\n".format(sock.getsockname()[1]))
+    sys.stdout.flush()
+    sys.stdin.read()
+
+
+def serve(root, username, password, port=0):
+    """Serve root over sftp until stdin is closed
+    :return: None
+    """
+    key = paramiko.RSAKey.generate(2048)
+
+    def handle(client):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(key)
+        transport.set_subsystem_handler("sftp", SFTPServer, _Files, root)
+        transport.start_server(server=_Auth(username, password))
+
+    run_until_stdin_closes(listen(port), handle)
+
+
+class ChildServer:
+    def __init__(self, script, arguments, port=0):
+        """
+        A server on 127.0.0.1 that runs in a child process, since ssh2 holds
+        the GIL while it waits for a reply and would starve a server thread
+        of the benchmarking process. It is started by start() or by
+        entering it with with, and stopped by closing the stdin of the child.
+        :param script: path of the script that is run, it is passed the
+        arguments followed by the port and must call run_until_stdin_closes
+        :param arguments: list of str arguments of the script
+        :param port: port to listen on, defaults to a free port
+        """
+        self._script = script
+        self._arguments = list(arguments)
+        self.host, self.port = "127.0.0.1", port
+        self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self._process = subprocess.Popen(
+            [sys.executable, self._script] + self._arguments + [str(self.port)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        line = self._process.stdout.readline()
+        if not line:
+            self._process.wait()
+            self._process = None
+            raise RuntimeError("{} failed to start".format(self._script))
+        self.port = int(line)
+
+    def stop(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+
+
+class LoopbackServer(ChildServer):
+    def __init__(self, root=None, username="bench", password="bench", port=0):
+        """
+        A local SFTP server that stands in for a share, it serves a directory
+        on 127.0.0.1 so the stores can be measured without a network or
+        an account.
+        :param root: directory that is served, defaults to a temporary
+        directory that is removed on stop()
+        :param username: username that the stores authenticate with
+        :param password: password that the stores authenticate with
+        :param port: port to listen on, defaults to a free port
+        """
+        self.username = username
+        self.password = password
+        self._own_root = root is None
+        self.root = tempfile.mkdtemp(prefix="mig_bench") if root is None else root
+        super(LoopbackServer, self).__init__(
+            os.path.abspath(__file__), [self.root, username, password], port=port
+        )
+
+    def local_path(self, path):
+        """
+        :param path: path on the server, relative to root
+        :return: the local path that the server serves it from,
+        e.g. to prepare the files of a workload without a transfer
+        """
+        return os.path.join(self.root, path)
+
+    def stop(self):
+        super(LoopbackServer, self).stop()
+        if self._own_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]))
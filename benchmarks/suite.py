@@ -0,0 +1,386 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import time
+from collections import OrderedDict
+from mig.io import SFTPStore, SSHFSStore
+import history
+from loopback import LoopbackServer
+from wan import WANProxy
+
+_clock = getattr(time, "perf_counter", time.time)
+
+BACKENDS = ("sftp", "sshfs")
+
+
+class Recorder:
+    def __init__(self):
+        """
+        The latency and size of every timed operation of a workload
+        """
+        # operation -> list of (seconds, bytes)
+        self.samples = OrderedDict()
+
+    def call(self, operation, func, *args, **kwargs):
+        """Time func(*args)
+        :param operation: name that the call is recorded under
+        :param nbytes: optional keyword, bytes that the call transfers,
+        defaults to the length of the result if it has one
+        :return: the result of func
+        """
+        nbytes = kwargs.pop("nbytes", None)
+        start = _clock()
+        result = func(*args, **kwargs)
+        seconds = _clock() - start
+        if nbytes is None:
+            nbytes = len(result) if hasattr(result, "__len__") else 0
+        self.samples.setdefault(operation, []).append((seconds, nbytes))
+        return result
+
+
+def _percentile(ordered, q):
+    # Nearest rank
+    return ordered[max(int(math.ceil(q * len(ordered))) - 1, 0)]
+
+
+def summarize(samples):
+    """
+    :param samples: list of (seconds, bytes) of one operation
+    :return: dict of the count, bytes, throughput and latency percentiles
+    """
+    latencies = sorted(seconds for seconds, _ in samples)
+    seconds = sum(latencies)
+    nbytes = sum(size for _, size in samples)
+    return OrderedDict(
+        [
+            ("count", len(samples)),
+            ("bytes", nbytes),
+            ("seconds", seconds),
+            ("throughput_bytes_per_second", nbytes / seconds if seconds else 0.0),
+            ("operations_per_second", len(samples) / seconds if seconds else 0.0),
+            ("mean_seconds", seconds / len(samples)),
+            ("p50_seconds", _percentile(latencies, 0.5)),
+            ("p99_seconds", _percentile(latencies, 0.99)),
+        ]
+    )
+
+
+def _payload(rng, size):
+    """
+    :return: size bytes of a random 1 MiB block repeated,
+    libssh2 doesn't compress so the repetition doesn't help the transfer
+    """
+    block = bytes(bytearray(rng.getrandbits(8) for _ in range(min(size, 1 << 20))))
+    return (block * (size // len(block) + 1))[:size] if size else b""
+
+
+def _scaled(value, scale):
+    return max(int(value * scale), 1)
+
+
+def small_files(store, server, recorder, rng, scale):
+    """Write, read back and remove many small files"""
+    count, size = _scaled(200, scale), 4096
+    store.mkdir("small_files")
+    paths = ["small_files/{}".format(index) for index in range(count)]
+    data = _payload(rng, size)
+    for path in paths:
+        recorder.call("write", _write, store, path, data, nbytes=size)
+    for path in paths:
+        recorder.call("read", store.read_binary, path)
+    for path in paths:
+        recorder.call("remove", store.remove, path, nbytes=0)
+
+
+def sequential(store, server, recorder, rng, scale):
+    """Write and read back a large file"""
+    size = _scaled(64 << 20, scale)
+    store.mkdir("sequential")
+    data = _payload(rng, size)
+    recorder.call("write", _write, store, "sequential/large", data, nbytes=size)
+    recorder.call("read", store.read_binary, "sequential/large")
+
+
+def ranged_reads(store, server, recorder, rng, scale):
+    """Read small ranges at random offsets of a large file"""
+    size, reads, length = _scaled(32 << 20, scale), _scaled(300, scale), 4096
+    os.mkdir(server.local_path("ranged_reads"))
+    with open(server.local_path("ranged_reads/large"), "wb") as local_file:
+        local_file.write(_payload(rng, size))
+    offsets = [rng.randrange(0, size - length) for _ in range(reads)]
+    handle = store.open("ranged_reads/large", "rb")
+    try:
+        for offset in offsets:
+            recorder.call("read", _read_range, handle, offset, length)
+    finally:
+        handle.close()
+    if hasattr(store, "readv"):
+        ranges = [(offset, length) for offset in offsets]
+        recorder.call(
+            "readv",
+            store.readv,
+            "ranged_reads/large",
+            ranges,
+            nbytes=length * len(ranges),
+        )
+
+
+def listing(store, server, recorder, rng, scale):
+    """List a large directory, with and without the file attributes"""
+    entries, repeats = _scaled(1000, scale), _scaled(20, scale)
+    os.mkdir(server.local_path("listing"))
+    for index in range(entries):
+        open(server.local_path("listing/{}".format(index)), "wb").close()
+    for _ in range(repeats):
+        recorder.call("list", store.list, "listing", nbytes=0)
+        recorder.call("list_attr", store.list_attr, "listing", nbytes=0)
+
+
+def metadata(store, server, recorder, rng, scale):
+    """Check many existing and missing paths and create and remove directories"""
+    count = _scaled(500, scale)
+    os.mkdir(server.local_path("metadata"))
+    for index in range(0, count, 2):
+        open(server.local_path("metadata/{}".format(index)), "wb").close()
+    paths = ["metadata/{}".format(index) for index in range(count)]
+    rng.shuffle(paths)
+    for path in paths:
+        recorder.call("exists", store.exists, path, nbytes=0)
+    for index in range(_scaled(100, scale)):
+        path = "metadata/dir{}".format(index)
+        recorder.call("mkdir", store.mkdir, path, nbytes=0)
+        recorder.call("rmdir", store.rmdir, path, nbytes=0)
+
+
+WORKLOADS = OrderedDict(
+    [
+        ("small_files", small_files),
+        ("sequential", sequential),
+        ("ranged_reads", ranged_reads),
+        ("listing", listing),
+        ("metadata", metadata),
+    ]
+)
+
+
+def _write(store, path, data):
+    with store.open(path, "wb") as remote_file:
+        remote_file.write(data)
+
+
+def _read_range(handle, offset, length):
+    handle.seek(offset)
+    return handle.read(length)
+
+
+def connect(backend, host, port, username, password):
+    """
+    :param backend: "sftp" for SFTPStore or "sshfs" for SSHFSStore
+    :return: store connected to the server at host and port
+    """
+    if backend == "sftp":
+        return SFTPStore(host, username, password, port=port)
+    if backend == "sshfs":
+        return SSHFSStore("@{}:{}/".format(host, port), username, password)
+    raise ValueError("unknown backend {}".format(backend))
+
+
+def run_suite(
+    server,
+    backends=BACKENDS,
+    workloads=tuple(WORKLOADS),
+    scale=1.0,
+    repeat=1,
+    seed=0,
+    address=None,
+):
+    """Run the workloads against each backend
+    Every run of a workload gets a fresh store and an empty directory,
+    the samples of the repeated runs are summarized together and per run.
+    :param server: the LoopbackServer
+    :param backends: names of the backends to measure, see connect
+    :param workloads: names of the workloads to run, see WORKLOADS
+    :param scale: factor that the file sizes and counts are scaled by
+    :param repeat: number of runs of each workload
+    :param seed: seed of the generated data and access patterns
+    :param address: optional (host, port) that the stores connect to instead
+    of the server, e.g. a proxy in front of it
+    :return: list of result dicts
+    """
+    host, port = address or (server.host, server.port)
+    results = []
+    for backend in backends:
+        for name in workloads:
+            recorders = []
+            for run in range(repeat):
+                recorder = Recorder()
+                rng = random.Random("{}-{}".format(seed, run))
+                store = connect(backend, host, port, server.username, server.password)
+                try:
+                    WORKLOADS[name](store, server, recorder, rng, scale)
+                finally:
+                    store.close()
+                    shutil.rmtree(server.local_path(name), ignore_errors=True)
+                recorders.append(recorder)
+            for operation in recorders[0].samples:
+                runs = [recorder.samples[operation] for recorder in recorders]
+                result = OrderedDict(
+                    [
+                        ("backend", backend),
+                        ("workload", name),
+                        ("operation", operation),
+                    ]
+                )
+                result.update(summarize([sample for run in runs for sample in run]))
+                # Per run, for the spread that a comparison allows for
+                result["runs"] = [summarize(samples) for samples in runs]
+                results.append(result)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the mig.io stores against a local SFTP server"
+    )
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument(
+        "--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS)
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="factor that the file sizes and counts are scaled by",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", help="file to write the JSON results to, defaults to stdout"
+    )
+    results = parser.add_argument_group(
+        "history", "keep the results and compare them against a baseline"
+    )
+    results.add_argument(
+        "--results-dir", help="directory that the results are stored in"
+    )
+    results.add_argument(
+        "--baseline",
+        help="name of a stored result, 'latest' or the path of a result file "
+        "to compare against, exits with 1 if the run regressed",
+    )
+    history.add_compare_arguments(results)
+    link = parser.add_argument_group(
+        "link", "emulate a wide area link between the stores and the server"
+    )
+    link.add_argument("--latency", type=float, help="round trip time in ms")
+    link.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="ms that each one way delay varies by at random",
+    )
+    link.add_argument("--bandwidth", type=float, help="Mbit/s in each direction")
+    link.add_argument(
+        "--packet-size",
+        type=int,
+        default=1448,
+        help="bytes per packet that the bandwidth is paced by",
+    )
+    return parser.parse_args(argv)
+
+
+def link_config(args):
+    """
+    :return: dict of the emulated link, or None without one
+    """
+    if args.latency is None and args.bandwidth is None:
+        return None
+    return OrderedDict(
+        [
+            ("latency_ms", args.latency or 0.0),
+            ("jitter_ms", args.jitter),
+            ("bandwidth_mbit", args.bandwidth),
+            ("packet_size", args.packet_size),
+        ]
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    link = link_config(args)
+    store = baseline = None
+    if args.results_dir:
+        store = history.ResultStore(args.results_dir)
+    if args.baseline:
+        # Before this run is stored, so latest is the previous run
+        if store is not None:
+            baseline = store.load(args.baseline)
+        else:
+            baseline = history.ResultStore(".").load(args.baseline)
+    with LoopbackServer() as server:
+        proxy = None
+        if link is not None:
+            proxy = WANProxy(
+                server.host,
+                server.port,
+                latency=link["latency_ms"] / 1000.0,
+                jitter=args.jitter / 1000.0,
+                bandwidth=args.bandwidth and args.bandwidth * 1e6 / 8,
+                packet_size=args.packet_size,
+                seed=args.seed,
+            )
+            proxy.start()
+        try:
+            results = run_suite(
+                server,
+                backends=args.backends,
+                workloads=args.workloads,
+                scale=args.scale,
+                repeat=args.repeat,
+                seed=args.seed,
+                address=proxy and (proxy.host, proxy.port),
+            )
+        finally:
+            if proxy is not None:
+                proxy.stop()
+    document = OrderedDict(
+        [
+            ("created", datetime.datetime.utcnow().isoformat() + "Z"),
+            ("environment", history.environment()),
+            (
+                "config",
+                OrderedDict(
+                    [
+                        ("backends", list(args.backends)),
+                        ("workloads", list(args.workloads)),
+                        ("scale", args.scale),
+                        ("repeat", args.repeat),
+                        ("seed", args.seed),
+                        ("link", link),
+                    ]
+                ),
+            ),
+            ("results", results),
+        ]
+    )
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+    if store is not None:
+        name = store.save(document)
+        sys.stderr.write("Stored the results as {}\n".format(name))
+    if baseline is not None and history.report(baseline, document, args):
+        sys.exit(1)
+    return document
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from loopback import ChildServer, listen, run_until_stdin_closes
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class _Link:
+    def __init__(self, delay, jitter, bandwidth, rng):
+        """
+        One direction of an emulated link
+        :param delay: one way delay in seconds
+        :param jitter: seconds that the delay varies by at random, uniformly
+        :param bandwidth: bytes per second that the link carries, None is
+        unlimited
+        :param rng: random.Random of the jitter
+        """
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self._rng = rng
+        # Time at which the link has sent everything queued so far
+        self._free = 0.0
+        # Delivery time of the last packet, TCP doesn't reorder
+        self._last = 0.0
+
+    def schedule(self, nbytes):
+        """
+        :param nbytes: size of a packet that arrives now
+        :return: the time at which the packet is delivered
+        """
+        start = max(_clock(), self._free)
+        if self.bandwidth:
+            self._free = start + float(nbytes) / self.bandwidth
+        else:
+            self._free = start
+        delay = self.delay
+        if self.jitter:
+            delay = max(delay + self._rng.uniform(-self.jitter, self.jitter), 0.0)
+        self._last = max(self._free + delay, self._last)
+        return self._last
+
+
+def _forward(source, sink, link, packet_size):
+    """Forward everything from source to sink as link delivers it,
+    until source is closed
+    :param packet_size: bytes per packet that the link paces, None forwards
+    every received chunk as one packet
+    :return: None
+    """
+    packets = deque()
+    ready = threading.Condition()
+
+    def deliver():
+        try:
+            while True:
+                with ready:
+                    while not packets:
+                        ready.wait()
+                    due, data = packets.popleft()
+                if data is None:
+                    sink.shutdown(socket.SHUT_WR)
+                    return
+                wait = due - _clock()
+                if wait > 0:
+                    time.sleep(wait)
+                sink.sendall(data)
+        except socket.error:
+            # The other side went away, stop receiving too
+            source.close()
+
+    threading.Thread(target=deliver, daemon=True).start()
+    try:
+        while True:
+            data = source.recv(65536)
+            if not data:
+                break
+            size = packet_size or len(data)
+            with ready:
+                for start in range(0, len(data), size):
+                    end = start + size
+                    packet = data[start:end]
+                    packets.append((link.schedule(len(packet)), packet))
+                ready.notify()
+    except socket.error:
+        pass
+    with ready:
+        packets.append((0.0, None))
+        ready.notify()
+
+
+def serve(
+    target_host, target_port, delay, jitter, bandwidth, packet_size, seed, port=0
+):
+    """Proxy the connections to target_host:target_port over emulated links
+    until stdin is closed
+    :return: None
+    """
+    rng = random.Random(seed)
+
+    def handle(client):
+        try:
+            upstream = socket.create_connection((target_host, target_port))
+        except socket.error:
+            client.close()
+            return
+        for sock in (client, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for source, sink in ((client, upstream), (upstream, client)):
+            link = _Link(delay, jitter, bandwidth, random.Random(rng.random()))
+            threading.Thread(
+                target=_forward, args=(source, sink, link, packet_size), daemon=True
+            ).start()
+
+    run_until_stdin_closes(listen(port), handle)
+
+
+class WANProxy(ChildServer):
+    def __init__(
+        self,
+        target_host,
+        target_port,
+        latency=0.02,
+        jitter=0.0,
+        bandwidth=None,
+        packet_size=None,
+        seed=0,
+        port=0,
+    ):
+        """
+        A TCP proxy on 127.0.0.1 that emulates a wide area link to
+        target_host:target_port, e.g. to measure a store against
+        a LoopbackServer with the round trip time of a share.
+        Each direction of a connection is delayed by half the latency,
+        varied by the jitter, and limited to the bandwidth.
+        :param latency: round trip time in seconds
+        :param jitter: seconds that each one way delay varies by at random
+        :param bandwidth: bytes per second in each direction, None is unlimited
+        :param packet_size: bytes per packet that the bandwidth is paced by,
+        None paces whole reads of up to 64 KiB, which makes the bandwidth
+        bursty
+        :param seed: seed of the jitter
+        :param port: port to listen on, defaults to a free port
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.packet_size = packet_size
+        super(WANProxy, self).__init__(
+            os.path.abspath(__file__),
+            [
+                target_host,
+                str(target_port),
+                repr(latency / 2.0),
+                repr(jitter),
+                repr(bandwidth or 0),
+                str(packet_size or 0),
+                str(seed),
+            ],
+            port=port,
+        )
+
+
+if __name__ == "__main__":
+    serve(
+        sys.argv[1],
+        int(sys.argv[2]),
+        float(sys.argv[3]),
+        float(sys.argv[4]),
+        float(sys.argv[5]) or None,
+        int(sys.argv[6]) or None,
+        int(sys.argv[7]),
+        int(sys.argv[8]),
+    )
@@ -1,6 +1,97 @@
+import importlib
 import sys
 from ._io import *
+from ._cache import *
+from ._stats import *
+from ._tiff import *
+from ._sync import *
+
+try:
+    from importlib.util import find_spec as _find_spec
+except ImportError:
+    # Python 2
+    from pkgutil import find_loader as _find_spec
+
+__all__ = [
+    "DirEntry",
+    "DataStore",
+    "FileHandle",
+    "ERDA",
+    "IDMC",
+    "BlockCache",
+    "MetadataCache",
+    "TransferStats",
+    "TIFFPage",
+    "TIFFStack",
+    "SyncResult",
+    "sync_to_share",
+    "sync_from_share",
+]
+
+# Modules that are only imported when one of their names is first used,
+# fs and ssh2 dominate the time that it takes to import mig.io, and the
+# users of one backend don't need the other
+_LAZY_MODULES = {
+    "._sshfs": ("SSHFSStore", "ERDASSHFSShare", "IDMCSSHFSShare"),
+    "._sftp": (
+        "SFTPFileHandle",
+        "SFTPRawIO",
+        "SFTPStore",
+        "ERDASftpShare",
+        "ERDAShare",
+        "IDMCSftpShare",
+        "IDMCShare",
+    ),
+    "._connection": (
+        "SFTPConnection",
+        "SharedSession",
+        "SharePoolTimeout",
+        "SharePool",
+    ),
+    "._zarr": ("ShareChunkStore",),
+}
 
 # async/await requires python 3.5
 if sys.version_info[:2] >= (3, 5):
-    from ._async_io import *
+    _LAZY_MODULES["._async_io"] = (
+        "AsyncSFTPFileHandle",
+        "AsyncSFTPStore",
+        "AsyncERDAShare",
+        "AsyncIDMCShare",
+    )
+
+# fsspec is an optional dependency, it finds the erda and idmc protocols
+# through the package's fsspec.specs entry points, so it isn't imported here
+if _find_spec("fsspec") is not None:
+    _LAZY_MODULES["._fsspec"] = (
+        "ShareFileSystem",
+        "ShareFile",
+        "ERDAFileSystem",
+        "IDMCFileSystem",
+    )
+
+_LAZY = {name: module for module, names in _LAZY_MODULES.items() for name in names}
+__all__ += [name for names in _LAZY_MODULES.values() for name in names]
+
+# Module __getattr__ requires python 3.7
+if sys.version_info[:2] >= (3, 7):
+
+    def __getattr__(name):
+        module = _LAZY.get(name)
+        if module is None:
+            raise AttributeError(
+                "module {!r} has no attribute {!r}".format(__name__, name)
+            )
+        value = getattr(importlib.import_module(module, __name__), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY))
+
+else:
+    for _module in _LAZY_MODULES:
+        _imported = importlib.import_module(_module, __name__)
+        globals().update(
+            (name, getattr(_imported, name)) for name in _LAZY_MODULES[_module]
+        )
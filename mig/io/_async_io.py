@@ -1,61 +1,560 @@
-# from ._io import SFTPStore, SFTPFileHandle
-#
-#
-# class AsyncSFTPFileHandle(SFTPFileHandle):
-#
-#     def __init__(self, fh, name, flag):
-#         super().__init__(fh, name, flag)
-#
-#     def __iter__(self):
-#         return super().__iter__()
-#
-#     def __next__(self):
-#         return super().__next__()
-#
-#     def __enter__(self):
-#         return super().__enter__()
-#
-#     def __exit__(self, exc_type, exc_val, exc_tb):
-#         super().__exit__(exc_type, exc_val, exc_tb)
-#
-#     async def close(self):
-#         await super().close()
-#
-#     async def read(self, n: int = -1):
-#         return await super().read(n)
-#
-#     async def write(self, data):
-#         await super().write(data)
-#
-#     async def seek(self, offset):
-#         await super().seek(offset)
-#
-#     async def read_binary(self, n: int = -1):
-#         return await super().read_binary(n)
-#
-#     async def tell(self):
-#         return await super().tell()
-#
-#
-# class AsyncSFTPStore(SFTPStore):
-#
-#     def __init__(self, host=None, username=None, password=None):
-#         super().__init__(host, username, password)
-#
-#     def __enter__(self):
-#         return super().__enter__()
-#
-#     def __exit__(self, exc_type, exc_val, exc_tb):
-#         super().__exit__(exc_type, exc_val, exc_tb)
-#
-#     async def open(self, path, flag='r'):
-#         return await super().open(path, flag)
-#
-#     async def list(self, path='.'):
-#         return await super().list(path)
-#
-#     async def remove(self, path):
-#         await super().remove(path)
-#
-#     async def close(self):
-#         await super().close()
+import asyncio
+import socket
+import six
+from ssh2.error_codes import LIBSSH2_ERROR_EAGAIN
+from ssh2.exceptions import SFTPProtocolError
+from ssh2.session import (
+    Session,
+    LIBSSH2_SESSION_BLOCK_INBOUND,
+    LIBSSH2_SESSION_BLOCK_OUTBOUND,
+)
+from ._connection import _SessionSocket, _is_eagain, _shutdown
+from ._io import ERDA, IDMC, _byte_view
+from ._sftp import SFTPFileHandle, SFTPStore
+
+
+class _Channel:
+    def __init__(self, sftp):
+        """
+        A sftp channel on the shared session.
+        libssh2 keeps the state of an in progress sftp operation per channel,
+        so only one call may be in progress on a channel at any time.
+        :param sftp: ssh2 SFTP instance
+        """
+        self.sftp = sftp
+        self.lock = asyncio.Lock()
+        # Number of calls that are running or waiting on the channel
+        self.load = 0
+        # Set when a call was interrupted halfway, e.g. by cancellation,
+        # as opposed to a call that the server answered with an error
+        self.broken = False
+
+
+class _AsyncOpen:
+    def __init__(self, coro):
+        """
+        Awaitable result of AsyncSFTPStore.open that can also be used
+        directly as an async context manager
+        :param coro: coroutine that returns an AsyncSFTPFileHandle
+        """
+        self._coro = coro
+        self._handle = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        self._handle = await self._coro
+        return self._handle
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._handle.close()
+
+
+class AsyncSFTPFileHandle:
+    chunk_size = SFTPFileHandle.chunk_size
+    window = SFTPFileHandle.window
+
+    def __init__(self, store, channel, fh, name, flag, chunk_size=None, window=None):
+        """
+        :param store: the AsyncSFTPStore that opened the file
+        :param channel: the channel the file was opened on
+        :param fh: Expects a non-blocking PySFTPHandle
+        :param chunk_size: size of each read request
+        :param window: number of read requests to keep outstanding
+        """
+        self.store = store
+        self.channel = channel
+        self.fh = fh
+        self.name = name
+        self.flag = flag
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        if window is not None:
+            self.window = window
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _call(self, func, *args):
+        return await self.store._call(self.channel, func, *args)
+
+    async def close(self):
+        """
+        Close the passed PySFTPHandles
+        :return: None
+        """
+        await self._call(self.fh.close)
+
+    async def read(self, n=-1):
+        """
+        :param n: amount of bytes to be read, defaults to the entire file
+        :return: the content of path, decoded to utf-8 string
+        """
+        assert "r" in self.flag
+        if "b" in self.flag:
+            return await self.read_binary(n)
+        return (await self.read_binary(n)).decode("utf-8")
+
+    async def read_binary(self, n=-1):
+        """
+        The content is read into a buffer that is copied into the bytes,
+        readinto reads into the caller's buffer without the copy.
+        :param n: amount of bytes to be read, defaults to the rest of the file
+        :return: bytes of the content within in file
+        """
+        fill_rest = n < 0
+        if fill_rest:
+            n = max((await self._call(self.fh.fstat)).filesize - self.tell(), 0)
+        data = bytearray(n)
+        filled = await self.readinto(data)
+        if filled < n:
+            del data[filled:]
+        elif fill_rest:
+            # The file grew since it was stat'ed
+            while True:
+                size, chunk = await self._call(
+                    self.fh.read, self.chunk_size * self.window
+                )
+                if size <= 0:
+                    break
+                data.extend(chunk)
+        return bytes(data)
+
+    async def readinto(self, buffer):
+        """Read directly into a preallocated buffer
+        The channel is only held for one windowed read call at a time,
+        so other operations on the channel interleave with long reads.
+        :param buffer: writable bytes-like object, e.g. a bytearray,
+        memoryview or a contiguous numpy array
+        :return: the number of bytes read, less than the size of buffer at EOF
+        """
+        view = _byte_view(buffer)
+        request_size = self.chunk_size * self.window
+        filled = 0
+        while filled < len(view):
+            size, chunk = await self._call(
+                self.fh.read, min(request_size, len(view) - filled)
+            )
+            if size <= 0:
+                break
+            end = filled + size
+            view[filled:end] = chunk
+            filled = end
+        return filled
+
+    async def write(self, data):
+        """
+        :param data: data that should be written to the file, expects binary or str
+        :return: None
+        """
+        assert "w" in self.flag or "a" in self.flag
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = _byte_view(data)
+        elif type(data) == str:
+            view = memoryview(six.b(data))
+        else:
+            view = memoryview(six.b(str(data)))
+        request_size = self.chunk_size * self.window
+        for offset in range(0, len(view), request_size):
+            end = offset + request_size
+            await self.store._write(self.channel, self.fh, view[offset:end])
+
+    async def seek(self, offset, whence=0):
+        """Seek file to a given offset
+        :param offset: amount of bytes to skip
+        :param whence: 0 = absolute, 1 = relative to the current position
+        and 2 = relative to the file's end.
+        :return: None
+        """
+        if whence == 1:
+            offset += self.tell()
+        elif whence == 2:
+            offset += (await self._call(self.fh.fstat)).filesize
+        self.fh.seek64(offset)
+
+    def tell(self):
+        """Get the current file handle offset, this requires no round trip
+        :return: int
+        """
+        return self.fh.tell64()
+
+
+class AsyncSFTPStore:
+    def __init__(self, host=None, username=None, password=None, port=22, channels=4):
+        """
+        An asyncio sftp store that drives a single non-blocking ssh2 session
+        from the event loop, the session is opened by connect() or by
+        entering the store with async with.
+        :param host: host of the sftp server
+        :param username: username to authenticate with
+        :param password: password to authenticate with
+        :param port: ssh port on host
+        :param channels: number of sftp channels that are multiplexed on the
+        session, this bounds how many operations progress at the same time
+        """
+        self._host = host
+        self._username = username
+        self._password = password
+        self._port = port
+        self._num_channels = channels
+        self._channels = []
+        self._sock = None
+        self._session = None
+        self._loop = None
+        self._read_waiter = None
+        self._write_waiter = None
+        self._progress = None
+        # Set while a call has a packet partly sent, see _finish_packet
+        self._sending = None
+        # Serializes the channel opens, libssh2 keeps their state per session
+        self._open_lock = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def connect(self):
+        """
+        Open the session and its sftp channels
+        :return: None
+        """
+        self._loop = asyncio.get_event_loop()
+        self._open_lock = asyncio.Lock()
+        self._sock = _SessionSocket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setblocking(False)
+        await self._loop.sock_connect(self._sock, (self._host, self._port))
+        # The requests of the channels leave at once, see SFTPConnection
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._session = Session()
+        self._session.set_blocking(False)
+        await self._call(None, self._session.handshake, self._sock)
+        await self._call(
+            None, self._session.userauth_password, self._username, self._password
+        )
+        await self._add_channels()
+
+    async def _add_channels(self):
+        """
+        Open sftp channels until the session has the configured number
+        :return: None
+        """
+        async with self._open_lock:
+            while len(self._channels) < self._num_channels:
+                sftp = await self._call(None, self._session.sftp_init)
+                self._channels.append(_Channel(sftp))
+
+    async def _channel(self):
+        """
+        Pick the least loaded channel, replacing channels that were
+        left halfway through an operation
+        :return: _Channel
+        """
+        broken = [channel for channel in self._channels if channel.broken]
+        if broken:
+            self._channels = [
+                channel for channel in self._channels if not channel.broken
+            ]
+            await self._close_channels(broken)
+        if broken or not self._channels:
+            # Calls that find no channel wait for the replacements
+            await self._add_channels()
+        return min(self._channels, key=lambda channel: channel.load)
+
+    async def _close_channels(self, channels):
+        """
+        Close sftp channels on the server by freeing them. libssh2 closes a
+        channel as it is freed and ssh2 doesn't repeat the close on EAGAIN,
+        which could leave the close packet partly sent, so the session is
+        blocking while they are freed, once no other call has a packet
+        partly sent.
+        :param channels: list of _Channels that are no longer used
+        :return: None
+        """
+        while self._sending is not None:
+            await asyncio.shield(self._sending)
+        sftps = []
+        for channel in channels:
+            sftps.append(channel.sftp)
+            channel.sftp = None
+        self._session.set_blocking(True)
+        try:
+            del sftps[:]
+        finally:
+            self._session.set_blocking(False)
+        # The packets of other calls may have been read meanwhile
+        self._notify_progress()
+
+    async def _call(self, channel, func, *args):
+        """
+        Call a non-blocking ssh2 function until it no longer returns EAGAIN,
+        waiting for the socket through the event loop in between
+        :param channel: _Channel to hold while calling, None for session calls
+        :param func: ssh2 function
+        :param args: arguments to func
+        :return: the result of func
+        """
+        if channel is None:
+            return await self._retry(func, *args)
+        channel.load += 1
+        try:
+            async with channel.lock:
+                try:
+                    return await self._retry(func, *args)
+                except SFTPProtocolError:
+                    # The server answered, the channel is ready for more
+                    raise
+                except BaseException:
+                    channel.broken = True
+                    raise
+        finally:
+            channel.load -= 1
+
+    async def _retry(self, func, *args):
+        while True:
+            while self._sending is not None:
+                await asyncio.shield(self._sending)
+            result = func(*args)
+            if _is_eagain(result) and (
+                self._session.block_directions() & LIBSSH2_SESSION_BLOCK_OUTBOUND
+            ):
+                result = await self._finish_packet(func, *args)
+            if not _is_eagain(result):
+                self._notify_progress()
+                return result
+            await self._wait_socket()
+
+    async def _finish_packet(self, func, *args):
+        """
+        Repeat a call that left a packet partly sent until the packet is out.
+        libssh2 sends one packet at a time and the next call on the session
+        would finish the packet in place of its own, so the other calls wait
+        and a cancellation only takes effect once the packet is sent.
+        :return: the result of the last call
+        """
+        self._sending = self._loop.create_future()
+        cancelled = False
+        try:
+            while True:
+                try:
+                    await self._wait_socket()
+                except asyncio.CancelledError:
+                    cancelled = True
+                result = func(*args)
+                if not _is_eagain(result) or not (
+                    self._session.block_directions() & LIBSSH2_SESSION_BLOCK_OUTBOUND
+                ):
+                    break
+        finally:
+            sending, self._sending = self._sending, None
+            sending.set_result(None)
+        if cancelled:
+            raise asyncio.CancelledError()
+        return result
+
+    async def _write(self, channel, fh, view):
+        """
+        Write a byte view, resuming after partial non-blocking writes
+        :param channel: _Channel that fh was opened on
+        :param fh: non-blocking PySFTPHandle
+        :param view: memoryview of the bytes to be written
+        :return: None
+        """
+        channel.load += 1
+        try:
+            async with channel.lock:
+                try:
+
+                    def write_rest():
+                        # ssh2 reports how much it wrote before EAGAIN
+                        nonlocal view
+                        rc, written = fh.write(view.tobytes())
+                        view = view[written:]
+                        return rc
+
+                    if len(view):
+                        await self._retry(write_rest)
+                except SFTPProtocolError:
+                    raise
+                except BaseException:
+                    channel.broken = True
+                    raise
+        finally:
+            channel.load -= 1
+
+    def _notify_progress(self):
+        # A finished call may have read packets that other calls are waiting
+        # for into libssh2's buffers, wake them since the socket won't
+        if self._progress is not None and not self._progress.done():
+            self._progress.set_result(None)
+        self._progress = None
+
+    async def _wait_socket(self):
+        """
+        Wait until the session's socket is ready in the direction that
+        libssh2 is blocked on, or until another call made progress
+        :return: None
+        """
+        directions = self._session.block_directions()
+        if not directions:
+            await asyncio.sleep(0)
+            return
+        if self._progress is None:
+            self._progress = self._loop.create_future()
+        waiters = [self._progress]
+        if directions & LIBSSH2_SESSION_BLOCK_INBOUND:
+            if self._read_waiter is None:
+                self._read_waiter = self._loop.create_future()
+                self._loop.add_reader(self._sock.fileno(), self._on_readable)
+            waiters.append(self._read_waiter)
+        if directions & LIBSSH2_SESSION_BLOCK_OUTBOUND:
+            if self._write_waiter is None:
+                self._write_waiter = self._loop.create_future()
+                self._loop.add_writer(self._sock.fileno(), self._on_writable)
+            waiters.append(self._write_waiter)
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+
+    def _on_readable(self):
+        self._loop.remove_reader(self._sock.fileno())
+        waiter, self._read_waiter = self._read_waiter, None
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def _on_writable(self):
+        self._loop.remove_writer(self._sock.fileno())
+        waiter, self._write_waiter = self._write_waiter, None
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def open(self, path, flag="r", **kwargs):
+        """
+        :param path: path to file on the sftp end
+        :param flag: open mode, either 'r'=read, 'w'=write, 'a'=append
+        'rb'=read binary, 'wb'=write binary or 'ab'= append binary
+        :param kwargs: passed on to the AsyncSFTPFileHandle
+        :return: awaitable AsyncSFTPFileHandle,
+        that can also be used with async with directly
+        """
+        return _AsyncOpen(self._open(path, flag, **kwargs))
+
+    async def _open(self, path, flag, **kwargs):
+        channel = await self._channel()
+        fh = await self._call(
+            channel, channel.sftp.open, six.text_type(path), *SFTPStore._open_args(flag)
+        )
+        assert fh is not None
+        return AsyncSFTPFileHandle(self, channel, fh, path, flag, **kwargs)
+
+    async def read_binary(self, path):
+        """
+        :param path: path to the file that should be read
+        :return: bytes of the content within file
+        """
+        async with self.open(path, "rb") as fh:
+            return await fh.read_binary()
+
+    async def write(self, path, data, flag="w"):
+        """
+        :param path: path to the file that should be created/written to
+        :param data: data that should be written to the file, expects binary or str
+        :param flag: write mode
+        :return: None
+        """
+        async with self.open(path, flag) as fh:
+            await fh.write(data)
+
+    async def exists(self, path):
+        """
+        :param path: the path we are checking whether it exists
+        :return: Boolean
+        """
+        channel = await self._channel()
+        try:
+            await self._call(channel, channel.sftp.stat, six.text_type(path))
+            return True
+        except SFTPProtocolError:
+            return False
+
+    async def list(self, path="."):
+        """
+        :param path: path to the directory which content should be listed
+        :return: list of str, of items in the path directory
+        """
+        channel = await self._channel()
+        fh = await self._call(channel, channel.sftp.opendir, six.text_type(path))
+        names = []
+        try:
+            while True:
+                size, name, attrs = await self._call(channel, fh._readdir, 1024)
+                if size <= 0:
+                    break
+                names.append(name.decode("utf-8"))
+        finally:
+            await self._call(channel, fh.close)
+        return names
+
+    async def mkdir(self, path, mode=755, **kwargs):
+        """
+        :param path: path to the directory that should be created
+        :return: None
+        """
+        channel = await self._channel()
+        await self._call(channel, channel.sftp.mkdir, six.text_type(path), mode)
+
+    async def rmdir(self, path):
+        """
+        :param path: path to the directory that should be removed
+        :return: None
+        """
+        channel = await self._channel()
+        await self._call(channel, channel.sftp.rmdir, six.text_type(path))
+
+    async def remove(self, path):
+        """
+        :param path: path to the file that should be removed
+        """
+        channel = await self._channel()
+        await self._call(channel, channel.sftp.unlink, six.text_type(path))
+
+    async def close(self):
+        """
+        Disconnect the session and shut down the socket, see SFTPConnection.close
+        :return: None
+        """
+        if self._session is None:
+            return
+        # Freed below once the session is disconnected
+        channels = self._channels
+        self._channels = []
+        try:
+            await self._call(None, self._session.disconnect)
+        finally:
+            if self._read_waiter is not None:
+                self._loop.remove_reader(self._sock.fileno())
+            if self._write_waiter is not None:
+                self._loop.remove_writer(self._sock.fileno())
+            _shutdown(self._sock)
+            self._session = None
+            del channels[:]
+
+
+class AsyncERDAShare(AsyncSFTPStore):
+    def __init__(self, share_link, **kwargs):
+        """
+        :param share_link:
+        This is the sharelink ID that is used to access the datastore,
+        an overview over your sharelinks can be found at
+        https://erda.dk/wsgi-bin/sharelink.py.
+        """
+        super(AsyncERDAShare, self).__init__(ERDA.url, share_link, share_link, **kwargs)
+
+
+class AsyncIDMCShare(AsyncSFTPStore):
+    def __init__(self, share_link, **kwargs):
+        super(AsyncIDMCShare, self).__init__(IDMC.url, share_link, share_link, **kwargs)
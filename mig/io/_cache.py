@@ -0,0 +1,340 @@
+import errno
+import hashlib
+import os
+import posixpath
+import six
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, eviction is then only serialized within the process
+    fcntl = None
+from ._io import _byte_view
+
+
+class BlockCache:
+    def __init__(self, directory=None, block_size=4 * 1024 * 1024, max_bytes=1024**3):
+        """
+        A persistent read-through cache of fixed size file blocks on local disk.
+        Blocks are keyed by the share, path, size and mtime of the remote file,
+        so a changed file is never served from stale blocks.
+        Blocks are written atomically and eviction is serialized through a lock
+        file, so several processes can share the same cache directory.
+        :param directory: local directory that holds the cache,
+        defaults to ~/.cache/mig_utils
+        :param block_size: size in bytes of each cached block
+        :param max_bytes: byte budget, the least recently used blocks are
+        evicted once it is exceeded
+        """
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".cache", "mig_utils")
+        self.directory = directory
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Estimate of the bytes in the cache, the directory is rescanned
+        # when it passes max_bytes since other processes also add blocks
+        self._usage = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_usage"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(share, path, size, mtime):
+        """
+        :param share: identifies the share, e.g. the host and username
+        :param path: path to the file on the share
+        :param size: size of the file in bytes
+        :param mtime: modification time of the file
+        :return: str, the cache key of the file
+        """
+        ident = "\0".join([str(share), str(path), str(size), str(mtime)])
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def _block_path(self, key, index):
+        return os.path.join(self.directory, key[:2], key, str(index))
+
+    def get(self, key, index):
+        """
+        :param key: cache key of the file
+        :param index: block number within the file
+        :return: bytes of the block or None if it isn't cached
+        """
+        path = self._block_path(key, index)
+        try:
+            with open(path, "rb") as block_file:
+                data = block_file.read()
+            # Mark the block as recently used
+            os.utime(path, None)
+        except (IOError, OSError) as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return None
+        return data
+
+    def put(self, key, index, data):
+        """
+        :param key: cache key of the file
+        :param index: block number within the file
+        :param data: bytes-like content of the block
+        :return: None
+        """
+        path = self._block_path(key, index)
+        block_dir = os.path.dirname(path)
+        if not os.path.isdir(block_dir):
+            try:
+                os.makedirs(block_dir)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        # Write next to the block and rename it into place,
+        # so readers never see a partially written block
+        fd, tmp_path = tempfile.mkstemp(dir=block_dir, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.rename(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with self._lock:
+            if self._usage is None:
+                self._usage = self._scan_usage()
+            else:
+                self._usage += len(data)
+            if self._usage > self.max_bytes:
+                self.evict()
+
+    def readinto(self, key, size, offset, buffer, fetch):
+        """
+        Fill buffer with the file content at offset, serving cached blocks
+        from disk and fetching each run of missing blocks with one ranged read
+        :param key: cache key of the file
+        :param size: size of the file in bytes
+        :param offset: file offset to read from
+        :param buffer: writable bytes-like object to fill
+        :param fetch: fetch(offset, view) that fills view with the remote
+        content at offset and returns the number of bytes read
+        :return: the number of bytes read, less than the buffer at EOF
+        """
+        view = _byte_view(buffer)
+        end = min(offset + len(view), size)
+        if end <= offset:
+            return 0
+        first, last = offset // self.block_size, (end - 1) // self.block_size
+        index = first
+        while index <= last:
+            block = self.get(key, index)
+            if block is None:
+                # Collect the run of missing blocks and fetch it at once
+                run_end = index + 1
+                while run_end <= last and not os.path.exists(
+                    self._block_path(key, run_end)
+                ):
+                    run_end += 1
+                run_start = index * self.block_size
+                run = bytearray(min(run_end * self.block_size, size) - run_start)
+                fetched = fetch(run_start, memoryview(run))
+                if fetched < len(run):
+                    # The file shrank after it was stat'ed
+                    raise IOError(
+                        "expected {} bytes at offset {} but got {}".format(
+                            len(run), run_start, fetched
+                        )
+                    )
+                run_view = memoryview(run)
+                for block_index in range(index, run_end):
+                    block_start = (block_index - index) * self.block_size
+                    block_end = block_start + self.block_size
+                    self.put(key, block_index, run_view[block_start:block_end])
+                self._copy(run_view, run_start, view, offset, end)
+                index = run_end
+            else:
+                self._copy(
+                    memoryview(block), index * self.block_size, view, offset, end
+                )
+                index += 1
+        return end - offset
+
+    @staticmethod
+    def _copy(src, src_offset, dest, dest_offset, end):
+        """Copy the overlap of src at src_offset into dest at dest_offset,
+        both offsets are file offsets and end is the last file offset to copy
+        """
+        start = max(src_offset, dest_offset)
+        stop = min(src_offset + len(src), end)
+        if stop > start:
+            src_start, src_stop = start - src_offset, stop - src_offset
+            dest_start, dest_stop = start - dest_offset, stop - dest_offset
+            dest[dest_start:dest_stop] = src[src_start:src_stop]
+
+    def _blocks(self):
+        """
+        :return: list of (mtime, size, path) for every cached block
+        """
+        blocks = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Evicted by another process
+                    continue
+                blocks.append((stat.st_mtime, stat.st_size, path))
+        return blocks
+
+    def _scan_usage(self):
+        return sum(size for _, size, _ in self._blocks())
+
+    def evict(self):
+        """
+        Remove the least recently used blocks until the cache is within
+        max_bytes
+        :return: None
+        """
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            blocks = sorted(self._blocks())
+            usage = sum(size for _, size, _ in blocks)
+            for _, size, path in blocks:
+                if usage <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError as err:
+                    if err.errno != errno.ENOENT:
+                        raise
+                usage -= size
+            self._usage = usage
+
+    def clear(self):
+        """
+        Remove every cached block
+        :return: None
+        """
+        max_bytes, self.max_bytes = self.max_bytes, 0
+        try:
+            with self._lock:
+                self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+
+class MetadataCache:
+    # Returned by get when there is no fresh entry
+    MISSING = object()
+
+    def __init__(self, ttl=30, max_entries=100000):
+        """
+        An in memory cache of stat results and directory listings of a share,
+        each entry expires ttl seconds after it was stored.
+        The stores invalidate the affected entries on their own mkdir, rmdir,
+        remove and writes, changes made by others show up once entries expire.
+        :param ttl: seconds an entry is served from the cache
+        :param max_entries: the least recently stored entries are dropped
+        beyond this many entries
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (kind, path) -> (expires, value), the most recently stored at the end
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The receiving process starts out with an empty cache
+        return {"ttl": self.ttl, "max_entries": self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @staticmethod
+    def _normalize(path):
+        return posixpath.normpath(six.text_type(path))
+
+    def get(self, kind, path):
+        """
+        :param kind: kind of entry, e.g. "stat" or "list"
+        :param path: path on the share
+        :return: the stored value or MetadataCache.MISSING
+        """
+        key = (kind, self._normalize(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return self.MISSING
+            if entry[0] < time.time():
+                del self._entries[key]
+                return self.MISSING
+            return entry[1]
+
+    def set(self, kind, path, value):
+        """
+        :param kind: kind of entry, e.g. "stat" or "list"
+        :param path: path on the share
+        :param value: value to store, None is a valid value
+        :return: None
+        """
+        key = (kind, self._normalize(path))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def exists(self, path):
+        """
+        Answer an existence check from a fresh stat or parent listing entry
+        :param path: path on the share
+        :return: Boolean or MetadataCache.MISSING
+        """
+        stat = self.get("stat", path)
+        if stat is not self.MISSING:
+            return stat is not None
+        parent, name = posixpath.split(self._normalize(path))
+        listing = self.get("list", parent or ".")
+        if listing is self.MISSING or name in ("", ".", ".."):
+            return self.MISSING
+        return name in listing
+
+    def invalidate(self, path, recursive=False):
+        """
+        Drop the entries of path and the listing of its parent directory
+        :param path: path on the share that was changed
+        :param recursive: also drop every entry below path,
+        e.g. when a directory is removed
+        :return: None
+        """
+        path = self._normalize(path)
+        parent = posixpath.dirname(path) or "."
+        with self._lock:
+            for key in [("stat", path), ("list", path), ("list", parent)]:
+                self._entries.pop(key, None)
+            if recursive:
+                prefix = path.rstrip("/") + "/"
+                for key in [key for key in self._entries if key[1].startswith(prefix)]:
+                    del self._entries[key]
+
+    def clear(self):
+        """
+        Drop every entry
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,523 @@
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from ssh2.error_codes import LIBSSH2_ERROR_EAGAIN
+from ssh2.session import (
+    LIBSSH2_SESSION_BLOCK_INBOUND,
+    LIBSSH2_SESSION_BLOCK_OUTBOUND,
+    Session,
+)
+from ssh2.sftp_handle import SFTPHandle
+from ssh2.exceptions import SSH2Error
+from ._stats import _clock
+
+# Sessions that this process inherited through fork. They share their socket
+# and ssh state with the parent process, so they are never used or closed,
+# and are kept from being freed, which would close their channels under the
+# parent.
+_inherited = []
+
+
+def _abandon(connection, *channels):
+    """Keep a session that was inherited through fork, and optionally extra
+    sftp channels on it, from being used or freed in this process
+    :param connection: SFTPConnection opened by the parent process
+    :param channels: SFTP channels, or a SharedSession,
+    of the connection's session
+    :return: None
+    """
+    _inherited.append((connection, channels))
+
+
+def _is_eagain(result):
+    """Check whether a non-blocking ssh2 call has to be repeated
+    :param result: the return value of the call, ssh2 either returns the
+    error code directly or as the first item of a tuple
+    :return: Boolean
+    """
+    if isinstance(result, tuple):
+        result = result[0]
+    return isinstance(result, int) and result == LIBSSH2_ERROR_EAGAIN
+
+
+def _after_fork():
+    # The locks may have been held by another thread at the time of the fork.
+    # The inherited pools are kept, freeing their idle sessions here would
+    # close the channels under the parent
+    _inherited.append(SharePool._shared)
+    SharePool._shared_lock = threading.Lock()
+    SharePool._shared = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class _SessionSocket(socket.socket):
+    # libssh2 writes to the socket for as long as the session or any of its
+    # channels and handles are alive, e.g. when they are freed, and the
+    # session holds on to the socket. The socket is therefore closed once
+    # the last of them is gone, a socket that was closed earlier could have
+    # its fd reused by another connection, which they would then write to.
+    def __del__(self):
+        self.close()
+
+
+def _shutdown(sock):
+    """Stop the traffic of a session's socket without closing it,
+    see _SessionSocket
+    :param sock: _SessionSocket
+    :return: None
+    """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        # Already disconnected by the other end
+        pass
+
+
+class SFTPConnection:
+    def __init__(self, host, username, password, port=22):
+        """
+        An authenticated ssh2 session with an initialized sftp channel
+        :param host: host to connect to
+        :param username: username to authenticate with
+        :param password: password to authenticate with
+        :param port: ssh port on host
+        """
+        # (phase, seconds) of the setup, until a store with stats reports it
+        self.setup_times = []
+        start = _clock()
+        self.sock = _SessionSocket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect((host, port))
+        # Small requests that are pipelined, e.g. over several channels,
+        # leave at once instead of after the acknowledgement of the first
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        start = self._lap("tcp", start)
+        self.session = Session()
+        self.session.handshake(self.sock)
+        start = self._lap("handshake", start)
+        self.session.userauth_password(username, password)
+        start = self._lap("auth", start)
+        self.session.open_session()
+        self.sftp = self.session.sftp_init()
+        self._lap("sftp_init", start)
+
+    def _lap(self, phase, start):
+        now = _clock()
+        self.setup_times.append((phase, now - start))
+        return now
+
+    def is_alive(self):
+        """
+        Check that the session still answers sftp requests
+        :return: Boolean
+        """
+        if self.sftp is None:
+            return False
+        try:
+            self.sftp.stat(".")
+            return True
+        except (SSH2Error, socket.error):
+            return False
+
+    def close(self):
+        """
+        Disconnect the session and shut down the underlying socket,
+        it is closed once the session and its handles are freed
+        :return: None
+        """
+        self.sftp = None
+        try:
+            self.session.disconnect()
+        finally:
+            _shutdown(self.sock)
+
+
+class _Lease:
+    def __init__(self, session, sftp, readv):
+        """
+        The sftp channels of a SharedSession that a thread uses,
+        they go back to the session once the thread ends
+        :param session: SharedSession
+        :param sftp: SFTP channel of the thread
+        :param readv: list of the thread's extra channels for readv
+        """
+        self.sftp = sftp
+        self.readv = readv
+        self.client = _LockedChannel(session, sftp)
+        self._free = session._free
+
+    def __del__(self):
+        self._free.append((self.sftp, self.readv))
+
+
+class _LockedChannel:
+    def __init__(self, session, channel):
+        """
+        Proxy of an SFTP channel or handle whose calls are made through
+        SharedSession.call
+        :param session: SharedSession
+        :param channel: SFTP or SFTPHandle
+        """
+        self._session = session
+        self._channel = channel
+
+    def __getattr__(self, name):
+        attr = getattr(self._channel, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = self._session.call(attr, *args, **kwargs)
+            if isinstance(result, SFTPHandle):
+                return _LockedChannel(self._session, result)
+            return result
+
+        return call
+
+    def readdir(self, buffer_maxlen=1024):
+        # ssh2's readdir ends the listing on EAGAIN in non-blocking mode
+        while True:
+            rc, name, attrs = self._session.call(self._channel._readdir, buffer_maxlen)
+            if rc <= 0:
+                return
+            yield rc, name, attrs
+
+    def write(self, buf):
+        # ssh2's write returns EAGAIN after it has sent part of buf,
+        # the call is resumed from there instead of repeated
+        written = [0]
+
+        def write_rest():
+            start = written[0]
+            rc, sent = self._channel.write(buf[start:])
+            written[0] += sent
+            return rc
+
+        return self._session.call(write_rest), written[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        # A handle that is freed open is closed by ssh2 without the lock
+        channel = self.__dict__.get("_channel")
+        if isinstance(channel, SFTPHandle) and not channel.closed:
+            try:
+                self._session.call(channel.close)
+            except Exception:
+                pass
+
+
+class SharedSession:
+    # Seconds a thread waits on the socket before it retries its call,
+    # another thread may have read the data that it waits for
+    poll_interval = 0.005
+
+    def __init__(self, connection):
+        """
+        Share one authenticated session between threads, each thread is
+        handed an sftp channel of its own on the session. The session is put
+        in non-blocking mode and every call is made under a lock, which is
+        released while a call waits on the socket, so the threads' requests
+        are in flight at once without the handshake of extra sessions.
+        :param connection: SFTPConnection
+        """
+        self.connection = connection
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        # (sftp, readv channels) of the threads that have ended
+        self._free = [(connection.sftp, [])]
+        connection.session.set_blocking(False)
+
+    def call(self, func, *args, **kwargs):
+        """Call an ssh2 function of the session's channels under the lock,
+        until it no longer returns LIBSSH2_ERROR_EAGAIN
+        :return: the result of func
+        """
+        session = self.connection.session
+        while True:
+            with self.lock:
+                while True:
+                    result = func(*args, **kwargs)
+                    if not _is_eagain(result):
+                        return result
+                    directions = session.block_directions()
+                    if not directions & LIBSSH2_SESSION_BLOCK_OUTBOUND:
+                        break
+                    # libssh2 sends a single packet at a time, a packet that
+                    # is partly sent has to be finished by the same call
+                    self.wait(directions)
+            self.wait(directions)
+
+    def wait(self, directions=None):
+        """Wait until the socket is ready in the direction that libssh2 is
+        blocked on, or poll_interval has passed
+        :param directions: the session's block_directions(),
+        read from the session by default
+        :return: None
+        """
+        if directions is None:
+            directions = self.connection.session.block_directions()
+        sock = self.connection.sock
+        readers = [sock] if directions & LIBSSH2_SESSION_BLOCK_INBOUND else []
+        writers = [sock] if directions & LIBSSH2_SESSION_BLOCK_OUTBOUND else []
+        if readers or writers:
+            select.select(readers, writers, [], self.poll_interval)
+
+    def lease(self):
+        """
+        :return: the _Lease of the calling thread's channels
+        """
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            try:
+                sftp, readv = self._free.pop()
+            except IndexError:
+                sftp, readv = self.call(self.connection.session.sftp_init), []
+            lease = self._local.lease = _Lease(self, sftp, readv)
+        return lease
+
+    def channel(self):
+        """
+        :return: the calling thread's sftp channel, whose calls are thread safe
+        """
+        return self.lease().client
+
+    def close(self):
+        """
+        Put the session back in blocking mode and drop it and the channels,
+        so that they are freed along with the store's connection
+        :return: None
+        """
+        if self.connection is None:
+            return
+        with self.lock:
+            self.connection.session.set_blocking(True)
+        self.connection = None
+        self._local = threading.local()
+        self._free = []
+
+
+class SharePoolTimeout(Exception):
+    pass
+
+
+class SharePool:
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        host,
+        username,
+        password,
+        port=22,
+        min_size=0,
+        max_size=4,
+        idle_timeout=300,
+        check_after=30,
+    ):
+        """
+        A pool of ready SFTPConnections to a single share
+        :param host: host of the share
+        :param username: username to authenticate with, the sharelink ID
+        :param password: password to authenticate with, the sharelink ID
+        :param port: ssh port on host
+        :param min_size: number of connections that are kept open,
+        they are opened when the pool is created
+        :param max_size: maximum number of open connections
+        :param idle_timeout: seconds an idle connection above min_size is kept
+        :param check_after: seconds a connection may be idle before it is
+        health checked on checkout
+        """
+        assert 0 <= min_size <= max_size
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        # (connection, time it was released) with the most recent at the end
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        # Process that the connections belong to
+        self._pid = os.getpid()
+        for _ in range(min_size):
+            self._idle.append((self._open(), time.time()))
+
+    @classmethod
+    def shared(cls, host, username, password, port=22, **kwargs):
+        """
+        Get the process wide pool for a share, keyed by host and username,
+        the pool is created on first use
+        :param host: host of the share
+        :param username: username to authenticate with, the sharelink ID
+        :param password: password to authenticate with, the sharelink ID
+        :param port: ssh port on host
+        :param kwargs: passed on to the SharePool when it is created
+        :return: SharePool
+        """
+        key = (host, port, username)
+        with cls._shared_lock:
+            pool = cls._shared.get(key)
+            if pool is None or pool._closed:
+                pool = cls(host, username, password, port=port, **kwargs)
+                cls._shared[key] = pool
+            return pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __reduce__(self):
+        # Connections can't be pickled, the receiving process
+        # gets its own shared pool for the share instead
+        return SharePool.shared, (self.host, self.username, self.password, self.port)
+
+    def _check_process(self):
+        """Start over with an empty pool in a process that was forked
+        from the one the connections were opened in
+        :return: None
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for connection, _ in self._idle:
+            _abandon(connection)
+        self._idle = deque()
+        # Connections that were checked out in the parent are abandoned
+        # by their stores instead of released
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _open(self):
+        connection = SFTPConnection(self.host, self.username, self.password, self.port)
+        self._size += 1
+        return connection
+
+    def _discard(self, connection):
+        self._size -= 1
+        try:
+            connection.close()
+        except (SSH2Error, socket.error):
+            pass
+
+    def acquire(self, timeout=None):
+        """
+        Get a ready connection, reusing an idle one when possible
+        :param timeout: seconds to wait when max_size connections are in use,
+        defaults to waiting indefinitely
+        :return: SFTPConnection
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self._check_process()
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise ValueError("pool is closed")
+                self._evict_idle()
+                if self._idle:
+                    connection, released = self._idle.pop()
+                    if (
+                        time.time() - released < self.check_after
+                        or connection.is_alive()
+                    ):
+                        return connection
+                    self._discard(connection)
+                    continue
+                if self._size < self.max_size:
+                    # Reserve the slot while the handshake is done outside the lock
+                    self._size += 1
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise SharePoolTimeout(
+                        "no connection to {} available within {} seconds".format(
+                            self.host, timeout
+                        )
+                    )
+                self._cond.wait(remaining)
+        try:
+            return SFTPConnection(self.host, self.username, self.password, self.port)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, connection, discard=False):
+        """
+        Return a connection to the pool
+        :param connection: SFTPConnection that was acquired from this pool
+        :param discard: close the connection instead, e.g. after an error
+        :return: None
+        """
+        self._check_process()
+        with self._cond:
+            if discard or self._closed:
+                self._discard(connection)
+            else:
+                self._idle.append((connection, time.time()))
+                self._evict_idle()
+            self._cond.notify()
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        Borrow a connection for the duration of a with block,
+        it is discarded instead of returned if the block raises
+        :param timeout: see acquire
+        :return: SFTPConnection
+        """
+        connection = self.acquire(timeout=timeout)
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+
+    def evict_idle(self):
+        """
+        Close connections that have been idle longer than idle_timeout
+        :return: None
+        """
+        self._check_process()
+        with self._cond:
+            self._evict_idle()
+
+    def _evict_idle(self):
+        # The least recently used connections are at the front
+        expired = time.time() - self.idle_timeout
+        while self._idle and self._size > self.min_size and self._idle[0][1] < expired:
+            connection, _ = self._idle.popleft()
+            self._discard(connection)
+
+    def close(self):
+        """
+        Close the idle connections, connections that are checked out
+        are closed when they are released
+        :return: None
+        """
+        self._check_process()
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                connection, _ = self._idle.popleft()
+                self._discard(connection)
+            self._cond.notify_all()
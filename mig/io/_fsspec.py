@@ -0,0 +1,320 @@
+import datetime
+import os
+import posixpath
+from fsspec import register_implementation
+from fsspec.spec import AbstractBufferedFile, AbstractFileSystem
+from fsspec.utils import stringify_path
+from ssh2.exceptions import SFTPProtocolError
+from ._io import _join_path
+from ._sftp import ERDAShare, IDMCShare, SFTPFileHandle
+
+
+class ShareFileSystem(AbstractFileSystem):
+    # Share class that the filesystem connects through
+    share_class = None
+    root_marker = ""
+    # Default block size of opened files, one pipelined read
+    blocksize = SFTPFileHandle.chunk_size * SFTPFileHandle.window
+
+    def __init__(
+        self,
+        share_link=None,
+        pool=None,
+        cache=None,
+        metadata=None,
+        stats=None,
+        **kwargs
+    ):
+        """
+        An fsspec filesystem over a MiG sharelink, urls are of the form
+        <protocol>://<sharelink id>/<path within the share>
+        :param share_link: sharelink ID of the share, taken from the url
+        when the filesystem is created through fsspec.open or
+        fsspec.filesystem with a url
+        :param pool: optional SharePool, see SFTPStore
+        :param cache: optional BlockCache that file reads are served through
+        :param metadata: optional MetadataCache that info and ls results
+        are served from
+        :param stats: optional TransferStats that the store's operations
+        are recorded in
+        :param kwargs: passed on to fsspec's AbstractFileSystem
+        """
+        super(ShareFileSystem, self).__init__(**kwargs)
+        if share_link is None:
+            raise ValueError("a sharelink ID is required")
+        self.share_link = share_link
+        self._store_kwargs = dict(
+            pool=pool, cache=cache, metadata=metadata, stats=stats
+        )
+        self._store = None
+
+    @property
+    def store(self):
+        """The SFTPStore of the share, connected on first use"""
+        if self._store is None:
+            self._store = self.share_class(self.share_link, **self._store_kwargs)
+        return self._store
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        if isinstance(path, list):
+            return [cls._strip_protocol(p) for p in path]
+        path = stringify_path(path)
+        prefix = "{}://".format(cls.protocol)
+        if path.startswith(prefix):
+            # The sharelink ID takes the place of the host
+            path = path.split("://", 1)[1].partition("/")[2]
+        path = path.strip("/")
+        return "" if path == "." else path
+
+    @staticmethod
+    def _get_kwargs_from_urls(path):
+        if "://" not in path:
+            return {}
+        return {"share_link": path.split("://", 1)[1].partition("/")[0]}
+
+    @staticmethod
+    def _info(name, entry):
+        return {
+            "name": name,
+            "size": entry.size,
+            "type": "directory" if entry.is_dir else "file",
+            "mtime": entry.mtime,
+            "mode": entry.mode,
+        }
+
+    def info(self, path, **kwargs):
+        path = self._strip_protocol(path)
+        try:
+            entry = self.store.stat(path or ".")
+        except SFTPProtocolError:
+            raise FileNotFoundError(path)
+        return self._info(path, entry)
+
+    def ls(self, path, detail=True, **kwargs):
+        path = self._strip_protocol(path)
+        try:
+            entries = [
+                self._info(_join_path(path, entry.name), entry)
+                for entry in self.store.list_attr(path or ".")
+            ]
+        except SFTPProtocolError:
+            # A file is listed as itself
+            info = self.info(path)
+            if info["type"] == "directory":
+                raise
+            entries = [info]
+        if detail:
+            return entries
+        return [entry["name"] for entry in entries]
+
+    def find(self, path, maxdepth=None, withdirs=False, detail=False, **kwargs):
+        """List every file below path through the store's parallel walk
+        :param workers: optional keyword, number of directories that are
+        listed at once, see DataStore.walk
+        """
+        path = self._strip_protocol(path)
+        workers = kwargs.pop("workers", 4)
+        found = {}
+        try:
+            info = self.info(path)
+        except FileNotFoundError:
+            return found if detail else []
+        if info["type"] != "directory":
+            found[path] = info
+        else:
+            if withdirs and path:
+                found[path] = info
+            root = path or "."
+            depth = 0 if root == "." else len(root) + 1
+
+            def descend(subdir):
+                return maxdepth is None or subdir[depth:].count("/") + 1 < maxdepth
+
+            for dirpath, dirnames, filenames in self.store.walk(
+                root, workers=workers, attrs=True, descend=descend
+            ):
+                for entry in filenames + (dirnames if withdirs else []):
+                    name = _join_path(dirpath, entry.name)
+                    found[name] = self._info(name, entry)
+        names = sorted(found)
+        if detail:
+            return {name: found[name] for name in names}
+        return names
+
+    def modified(self, path):
+        return datetime.datetime.fromtimestamp(
+            self.info(path)["mtime"], tz=datetime.timezone.utc
+        )
+
+    def _open(
+        self,
+        path,
+        mode="rb",
+        block_size=None,
+        autocommit=True,
+        cache_options=None,
+        **kwargs
+    ):
+        return ShareFile(
+            self,
+            self._strip_protocol(path),
+            mode=mode,
+            block_size=block_size or self.blocksize,
+            autocommit=autocommit,
+            cache_options=cache_options,
+            **kwargs
+        )
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        path = self._strip_protocol(path)
+        if start is None and end is None:
+            try:
+                return self.store.read_binary(path)
+            except SFTPProtocolError:
+                raise FileNotFoundError(path)
+        return self.cat_ranges([path], [start], [end], on_error="raise")[0]
+
+    def cat_ranges(
+        self, paths, starts, ends, max_gap=None, on_error="return", **kwargs
+    ):
+        """Read byte ranges of one or more files, the ranges of each file
+        are read at once with SFTPStore.readv
+        :param max_gap: ranges of a file that are at most this many bytes
+        apart are read as one
+        """
+        if not isinstance(paths, list):
+            raise TypeError("paths must be a list")
+        if not isinstance(starts, list):
+            starts = [starts] * len(paths)
+        if not isinstance(ends, list):
+            ends = [ends] * len(paths)
+        if len(starts) != len(paths) or len(ends) != len(paths):
+            raise ValueError("paths, starts and ends must be of the same length")
+        by_path = {}
+        for index, path in enumerate(paths):
+            by_path.setdefault(self._strip_protocol(path), []).append(index)
+
+        out = [None] * len(paths)
+        for path, indices in by_path.items():
+            try:
+                size = None
+                ranges = []
+                for index in indices:
+                    start, end = starts[index] or 0, ends[index]
+                    if end is None or start < 0 or end < 0:
+                        if size is None:
+                            size = self.info(path)["size"]
+                        end = size if end is None else end
+                        start = start + size if start < 0 else start
+                        end = end + size if end < 0 else end
+                    ranges.append((start, max(end - start, 0)))
+                views = self.store.readv(path, ranges, merge_gap=max_gap or 0)
+                for index, view in zip(indices, views):
+                    out[index] = bytes(view)
+            except Exception as err:
+                if isinstance(err, SFTPProtocolError):
+                    # As with info
+                    err = FileNotFoundError(path)
+                if on_error != "return":
+                    raise err
+                for index in indices:
+                    out[index] = err
+        return out
+
+    def pipe_file(self, path, value, mode="overwrite", **kwargs):
+        self.store.upload(value, self._strip_protocol(path))
+
+    def get_file(self, rpath, lpath, callback=None, outfile=None, **kwargs):
+        if self.isdir(rpath):
+            return super(ShareFileSystem, self).get_file(
+                rpath, lpath, callback=callback, outfile=outfile, **kwargs
+            )
+        self.store.download(self._strip_protocol(rpath), lpath)
+
+    def put_file(self, lpath, rpath, callback=None, mode="overwrite", **kwargs):
+        if os.path.isdir(lpath):
+            self.makedirs(rpath, exist_ok=True)
+            return
+        self.store.upload(lpath, self._strip_protocol(rpath))
+
+    def mkdir(self, path, create_parents=True, **kwargs):
+        path = self._strip_protocol(path)
+        if create_parents:
+            self.makedirs(path, exist_ok=True)
+        else:
+            self.store.mkdir(path)
+
+    def makedirs(self, path, exist_ok=False):
+        path = self._strip_protocol(path)
+        if self.exists(path):
+            if not exist_ok:
+                raise FileExistsError(path)
+            return
+        parent = posixpath.dirname(path)
+        if parent and not self.exists(parent):
+            self.makedirs(parent, exist_ok=True)
+        self.store.mkdir(path)
+
+    def rmdir(self, path):
+        self.store.rmdir(self._strip_protocol(path))
+
+    def _rm(self, path):
+        path = self._strip_protocol(path)
+        if self.isdir(path):
+            self.store.rmdir(path)
+        else:
+            self.store.remove(path)
+
+    def rm_file(self, path):
+        self._rm(path)
+
+    def exists(self, path, **kwargs):
+        return self.store.exists(self._strip_protocol(path) or ".")
+
+
+class ShareFile(AbstractBufferedFile):
+    _handle = None
+
+    def _fetch_range(self, start, end):
+        if self._handle is None:
+            # fsspec caches the blocks itself
+            try:
+                self._handle = self.fs.store.open(self.path, "rb", read_ahead=False)
+            except SFTPProtocolError:
+                raise FileNotFoundError(self.path)
+        self._handle.seek(start)
+        return self._handle.read_binary(end - start)
+
+    def _initiate_upload(self):
+        if "a" in self.mode:
+            self._handle = self.fs.store.open(self.path, "ab")
+        else:
+            self._handle = self.fs.store.open(self.path, "wb")
+            self._handle.truncate(0)
+
+    def _upload_chunk(self, final=False):
+        self._handle.write(self.buffer.getbuffer())
+        return True
+
+    def close(self):
+        try:
+            super(ShareFile, self).close()
+        finally:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+
+class ERDAFileSystem(ShareFileSystem):
+    protocol = "erda"
+    share_class = ERDAShare
+
+
+class IDMCFileSystem(ShareFileSystem):
+    protocol = "idmc"
+    share_class = IDMCShare
+
+
+register_implementation("erda", ERDAFileSystem, clobber=True)
+register_implementation("idmc", IDMCFileSystem, clobber=True)
@@ -1,25 +1,114 @@
-import fs
+import posixpath
 import six
-import socket
+import stat
+import threading
 from abc import ABCMeta, abstractmethod
-from fs.errors import ResourceNotFound
-from ssh2.session import Session
-from ssh2.exceptions import SFTPProtocolError
-from ssh2.sftp import (
-    LIBSSH2_FXF_READ,
-    LIBSSH2_FXF_WRITE,
-    LIBSSH2_FXF_CREAT,
-    LIBSSH2_SFTP_S_IRUSR,
-    LIBSSH2_SFTP_S_IWUSR,
-    LIBSSH2_SFTP_S_IRGRP,
-    LIBSSH2_SFTP_S_IROTH,
-    LIBSSH2_FXF_APPEND,
-)
+from collections import deque
+from fnmatch import fnmatchcase
+from six.moves import queue
+
+
+def _byte_view(buffer):
+    """Get a flat unsigned byte view of a bytes-like object
+    :param buffer: bytes-like object, e.g. a bytearray, memoryview or a
+    contiguous numpy array
+    :return: memoryview
+    """
+    view = memoryview(buffer)
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast("B")
+    return view
+
+
+def _array_bytes(array):
+    """Get a flat byte view of the data of a numpy array
+    :param array: numpy array, copied only if it isn't contiguous
+    :return: memoryview of the elements in the array's memory layout
+    """
+    import numpy as np
+
+    array = np.asanyarray(array)
+    if not (array.flags.c_contiguous or array.flags.f_contiguous):
+        array = np.ascontiguousarray(array)
+    return _byte_view(array.reshape(-1, order="A").view(np.uint8))
+
+
+class DirEntry:
+    __slots__ = ("name", "size", "mtime", "mode", "is_dir")
+
+    def __init__(self, name, size, mtime, mode):
+        """
+        An entry of a directory listing with the attributes that the server
+        returned along with it
+        :param name: name of the entry within the directory
+        :param size: size in bytes
+        :param mtime: modification time in seconds since the epoch
+        :param mode: st_mode of the entry, type and permission bits
+        """
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.is_dir = stat.S_ISDIR(mode or 0)
+
+    def __repr__(self):
+        return "DirEntry({!r}, size={}, is_dir={})".format(
+            self.name, self.size, self.is_dir
+        )
+
+
+def _join_path(dirpath, name):
+    if dirpath in ("", "."):
+        return name
+    return posixpath.join(dirpath, name)
+
+
+def _has_magic(part):
+    return any(char in part for char in "*?[")
+
+
+def _match_parts(pattern, parts, partial=False):
+    """Match path components against glob pattern components
+    :param pattern: list of pattern components, "**" matches any number
+    of components and the others are matched with fnmatch
+    :param parts: list of path components
+    :param partial: also match when parts is a directory that
+    matching paths may be below
+    :return: Boolean
+    """
+    if not pattern:
+        return not parts
+    if pattern[0] == "**":
+        return any(
+            _match_parts(pattern[1:], parts[index:], partial)
+            for index in range(len(parts) + 1)
+        )
+    if not parts:
+        return partial
+    return fnmatchcase(parts[0], pattern[0]) and _match_parts(
+        pattern[1:], parts[1:], partial
+    )
+
+
+def _restore_store(cls, base, kwargs):
+    """Recreate a pickled store, it is connected in this process
+    :param cls: class of the pickled store
+    :param base: store class whose __init__ takes kwargs
+    :param kwargs: connection parameters of the store
+    :return: store of cls
+    """
+    store = cls.__new__(cls)
+    base.__init__(store, **kwargs)
+    return store
 
 
 @six.add_metaclass(ABCMeta)
 class DataStore:
     _client = None
+    # Optional MetadataCache that exists and list results are served from
+    _metadata = None
+    # Optional TransferStats that the operations are recorded in
+    _stats = None
 
     def __init__(self, client):
         """
@@ -57,6 +146,182 @@ class DataStore:
     def close(self):
         pass
 
+    def iterdir(self, path="."):
+        """
+        :param path: path to the directory which content should be listed
+        :return: generator of DirEntry objects
+        """
+        raise NotImplementedError
+
+    def _clone(self):
+        """
+        :return: a new store connected to the same share,
+        that walk lists directories through from its worker threads
+        """
+        raise NotImplementedError
+
+    def walk(self, path=".", workers=4, attrs=False, descend=None, onerror=None):
+        """Recursively list the directories below path, like os.walk
+        Up to workers directories are listed at once, each worker thread
+        over its own connection to the share. The directories are yielded
+        as soon as they are listed, a directory before its subdirectories,
+        but otherwise in no particular order. As with os.walk the caller
+        can prune the walk by removing entries from dirnames in place.
+        :param path: directory to start from
+        :param workers: maximum number of directories that are listed at once,
+        1 lists them one at a time through this store
+        :param attrs: yield DirEntry objects instead of names
+        :param descend: optional callable that is given the path of each
+        subdirectory and returns whether it should be listed
+        :param onerror: optional callable that is given the exception when a
+        directory can't be listed, the walk then continues,
+        by default the exception is raised
+        :return: generator of (dirpath, dirnames, filenames) tuples
+        """
+        if workers <= 1:
+            listings = self._list_serial(path, onerror)
+        else:
+            listings = self._list_parallel(path, workers, onerror)
+        pending = listings.send(None)
+        try:
+            while pending is not None:
+                dirpath, entries = pending
+                dirs = [entry for entry in entries if entry.is_dir]
+                files = [entry for entry in entries if not entry.is_dir]
+                if not attrs:
+                    dirs = [entry.name for entry in dirs]
+                    files = [entry.name for entry in files]
+                yield dirpath, dirs, files
+                subdirs = []
+                for entry in dirs:
+                    name = entry.name if attrs else entry
+                    subdir = _join_path(dirpath, name)
+                    if descend is None or descend(subdir):
+                        subdirs.append(subdir)
+                pending = listings.send(subdirs)
+        finally:
+            listings.close()
+
+    def _list_serial(self, path, onerror):
+        """Coroutine that lists the directories it is sent, one at a time
+        :return: yields (dirpath, list of DirEntry) until no directories are left
+        """
+        todo = deque([path])
+        while todo:
+            dirpath = todo.popleft()
+            try:
+                entries = list(self.iterdir(dirpath))
+            except Exception as err:
+                if onerror is None:
+                    raise
+                onerror(err)
+                continue
+            todo.extend((yield dirpath, entries))
+        yield None
+
+    def _list_parallel(self, path, workers, onerror):
+        """Coroutine that lists the directories it is sent over worker threads
+        :return: yields (dirpath, list of DirEntry) in the order the listings
+        complete, until no directories are left
+        """
+        todo = queue.Queue()
+        done = queue.Queue()
+        stop = threading.Event()
+
+        def work():
+            store = None
+            try:
+                while True:
+                    dirpath = todo.get()
+                    if dirpath is None or stop.is_set():
+                        break
+                    try:
+                        if store is None:
+                            store = self._clone()
+                        done.put((dirpath, list(store.iterdir(dirpath)), None))
+                    except Exception as err:
+                        done.put((dirpath, None, err))
+            finally:
+                if store is not None:
+                    store.close()
+
+        threads = []
+        try:
+            todo.put(path)
+            outstanding = 1
+            while outstanding:
+                # Start the workers as the directories to list pile up
+                if len(threads) < min(workers, outstanding):
+                    thread = threading.Thread(target=work)
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+                    continue
+                dirpath, entries, err = done.get()
+                outstanding -= 1
+                if err is not None:
+                    if onerror is None:
+                        raise err
+                    onerror(err)
+                    continue
+                for subdir in (yield dirpath, entries):
+                    todo.put(subdir)
+                    outstanding += 1
+            yield None
+        finally:
+            stop.set()
+            for _ in threads:
+                todo.put(None)
+            for thread in threads:
+                thread.join()
+
+    def glob(self, pattern, workers=4):
+        """Find the paths that match a glob pattern, e.g. "raw/*/scan_*.tif"
+        or "**/*.h5" where "**" matches any number of directories.
+        Only the directories that matching paths can be below are listed,
+        through walk with the same parallelism.
+        :param pattern: pattern of "/" separated components that are
+        matched with fnmatch
+        :param workers: see walk
+        :return: generator of matching paths as they are found
+        """
+        parts = [part for part in pattern.split("/") if part not in ("", ".")]
+        root_parts = []
+        while parts and not _has_magic(parts[0]) and parts[0] != "**":
+            root_parts.append(parts.pop(0))
+        root = "/".join(root_parts)
+        if pattern.startswith("/"):
+            root = "/" + root
+        if not parts:
+            if self.exists(root or "."):
+                yield root
+            return
+        root = root or "."
+        depth = 0 if root == "." else len(root)
+
+        def relative(path):
+            return [part for part in path[depth:].split("/") if part]
+
+        def descend(subdir):
+            return _match_parts(parts, relative(subdir), partial=True)
+
+        for dirpath, dirnames, filenames in self.walk(
+            root, workers=workers, descend=descend
+        ):
+            for name in dirnames + filenames:
+                path = _join_path(dirpath, name)
+                if _match_parts(parts, relative(path)):
+                    yield path
+
+    def _invalidate(self, path, recursive=False):
+        """Drop the cached metadata that a change to path makes stale
+        :param path: path that was created, changed or removed
+        :param recursive: also drop the entries below path
+        :return: None
+        """
+        if self._metadata is not None:
+            self._metadata.invalidate(path, recursive=recursive)
+
 
 @six.add_metaclass(ABCMeta)
 class FileHandle:
@@ -77,307 +342,121 @@ class FileHandle:
         pass
 
 
-class SSHFSStore(DataStore):
-    def __init__(self, host=None, username=None, password=None):
-        assert host is not None
-        assert username is not None
-        assert password is not None
-        client = fs.open_fs("ssh://" + username + ":" + password + host)
-        super(SSHFSStore, self).__init__(client)
-
-    def geturl(self, path):
-        return self._client.geturl(path)
-
-    def open(self, path, flag="r"):
-        """
-        Used to get a python filehandler object
-        :param path:
-        the name of the file to be opened
-        :param flag:
-        which mode should the file be opened in
-        :return:
-        a _io.TextIOWrapper object with utf-8 encoding
-        """
-        return self._client.open(six.text_type(path), flag)
-
-    def exists(self, path):
-        """
-        :param path: the path we are checking whether it exists
-        :return: Boolean
-        """
-        return self._client.exists(six.text_type(path))
-
-    def list(self, path="."):
-        """
-        :param path:
-        file system path which items will be returned
-        :return:
-        A list of items in the path.
-        There is no distinction between files and dirs
-        """
-        return self._client._sftp.listdir(six.text_type(path))
-
-    def read(self, path):
-        """
-        :param file:
-        File to be read
-        :return:
-        a string of the content within file
-        """
-        with self._client.open(six.text_type(path)) as open_file:
-            return open_file.read()
-
-    def write(self, path, data, flag="a"):
-        """
-        :param path:
-        path to the file being written
-        :param data: data to being written
-        :param flag: write flag, defaults to append
-        :return:
-        """
-        with self.open(six.text_type(path), flag) as fh:
-            fh.write(data)
-
-    def mkdir(self, path, mode=755):
-        """
-        :param path: path to the directory that should be created
-        """
-        self._client._sftp.mkdir(six.text_type(path), mode)
-
-    def remove(self, path):
-        """
-        :param path:
-        path to the file that should be removed
-        :return:
-        Bool, whether a file was removed or not
-        """
-        try:
-            self._client.remove(six.text_type(path))
-            return True
-        except ResourceNotFound:
-            return False
-
-    def list_attr(self, path="."):
-        """
-        :param path:
-        directory path to be listed
-        :return:
-        A list of .SFTPAttributes objects
-        """
-        return self._client._sftp.listdir_attr(six.text_type(path))
-
-    def read_binary(self, path):
-        """
-        :param path:
-        File to be read
-        :return:
-        a binary of the content within file
-        """
-        with self._client.openbin(six.text_type(path)) as open_file:
-            return open_file.read()
-
-    def rmdir(self, path):
-        """
-        :param path:
-        path the dir that should be removed
-        :return:
-        Bool, whether a dir was removed or not
-        """
-        try:
-            self._client._sftp.rmdir(six.text_type(path))
-            return True
-        except ResourceNotFound:
-            return False
-
-    def close(self):
-        self._client.close()
-
-
-class SFTPFileHandle(FileHandle):
-    def __init__(self, fh, name, flag):
-        """
-        :param fh: Expects a PySFTPHandle
-        """
-        self.fh = fh
-        self.name = name
-        self.flag = flag
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return self.read()
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
-
-    def close(self):
-        """
-        Close the passed PySFTPHandles
-        :return: None
-        """
-        self.fh.close()
-
-    def read(self, n=-1):
-        """
-        :param n: amount of bytes to be read, defaults to the entire file
-        :return: the content of path, decoded to utf-8 string
-        """
-        assert "r" in self.flag
-        if "b" in self.flag:
-            return self.read_binary(n)
-        else:
-            result = self.read_binary(n).decode("utf-8")
-            return result
-
-    def write(self, data):
-        """
-        :param path: path to the file that should be created/written to
-        :param data: data that should be written to the file, expects binary or str
-        :param flag: write mode
-        :return: None
-        """
-        assert "w" in self.flag or "a" in self.flag
-        if type(data) == bytes:
-            self.fh.write(data)
-        elif type(data) == str:
-            self.fh.write(six.b(data))
-        else:
-            self.fh.write(six.b(str(data)))
-
-    def seek(self, offset, whence=0):
-        """Seek file to a given offset
-        :param offset: amount of bytes to skip
-        :param whence: defaults to 0 which means absolute file positioning
-                       other values are 1 which means seek relative to
-                       the current position and 2 means seek relative to the file's end.
-        :return: None
-        """
-        if whence == 0:
-            self.fh.seek64(offset)
-        if whence == 1:
-            # Seek relative to the current position
-            current_offset = self.fh.tell64()
-            self.fh.seek(current_offset + offset)
-        if whence == 2:
-            file_stat = self.fh.fstat()
-            # Seek relative to the file end
-            self.fh.seek(file_stat.filesize + offset)
-
-    def read_binary(self, n=-1):
-        """
-        :param n: amount of bytes to be read
-        :return: a binary string of the content within in file
-        """
-        data = []
-        if n != -1:
-            # 1, because pysftphandle returns an array -> 1 = data
-            data.append(self.fh.read(n)[1])
+def _merge_ranges(ranges, gap=0):
+    """Merge overlapping and adjacent byte ranges
+    :param ranges: list of (offset, length) tuples
+    :param gap: ranges that are at most this many bytes apart are merged too
+    :return: tuple of the merged (offset, length) runs in file order
+    and the (run index, offset within the run) of each range
+    """
+    runs = []
+    placement = [None] * len(ranges)
+    for index in sorted(range(len(ranges)), key=lambda index: ranges[index][0]):
+        offset, length = ranges[index]
+        if offset < 0 or length < 0:
+            raise ValueError("invalid range {}".format(ranges[index]))
+        if runs and offset <= runs[-1][0] + runs[-1][1] + gap:
+            run_offset, run_length = runs[-1]
+            runs[-1] = (run_offset, max(run_length, offset + length - run_offset))
         else:
-            for size, chunk in self.fh:
-                data.append(chunk)
-        return b"".join(data)
-
-    def tell(self):
-        """Get the current file handle offset
-        :return: int
-        """
-        return self.fh.tell64()
-
-
-class SFTPStore(DataStore):
-    def __init__(self, host=None, username=None, password=None):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((host, 22))
-        s = Session()
-        s.handshake(sock)
-        s.userauth_password(username, password)
-        s.open_session()
-        client = s.sftp_init()
-        super(SFTPStore, self).__init__(client=client)
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
-
-    def open(self, path, flag="r"):
-        """
-        :param path: path to file on the sftp end
-        :param flag: open mode, either 'r'=read, 'w'=write, 'a'=append
-        'rb'=read binary, 'wb'=write binary or 'ab'= append binary
-        :return: SFTPHandle, https://github.com/ParallelSSH/ssh2-python
-        /blob/master/ssh2/sftp_handle.pyx
-        """
-        if flag == "r" or flag == "rb":
-            fh = self._client.open(
-                six.text_type(path), LIBSSH2_FXF_READ, LIBSSH2_SFTP_S_IWUSR
-            )
-        else:
-            w_flags = None
-            if flag == "w" or flag == "wb":
-                w_flags = LIBSSH2_FXF_CREAT | LIBSSH2_FXF_WRITE
-            elif flag == "a" or flag == "ab":
-                w_flags = LIBSSH2_FXF_CREAT | LIBSSH2_FXF_WRITE | LIBSSH2_FXF_APPEND
-            mode = (
-                LIBSSH2_SFTP_S_IRUSR
-                | LIBSSH2_SFTP_S_IWUSR
-                | LIBSSH2_SFTP_S_IRGRP
-                | LIBSSH2_SFTP_S_IROTH
-            )
-            fh = self._client.open(six.text_type(path), w_flags, mode)
-        assert fh is not None
-        handle = SFTPFileHandle(fh, path, flag)
-        return handle
-
-    def exists(self, path):
-        """
-        :param path: the path we are checking whether it exists
-        :return: Boolean
-        """
-        # There is no direct way to check if it exists
-        # See if we can stat the designated path instead
+            runs.append((offset, length))
+        placement[index] = (len(runs) - 1, offset - runs[-1][0])
+    return runs, placement
+
+
+def _read_vectored(ranges, buffer, merge_gap, piece_size, read_requests):
+    """Read byte ranges through their merged runs
+    :param ranges: list of (offset, length) tuples
+    :param buffer: writable bytes-like object that the runs are read into
+    back to back, or None to allocate one
+    :param merge_gap: see _merge_ranges
+    :param piece_size: runs are split into requests of at most this size,
+    None to read each run as a single request
+    :param read_requests: callable that reads a list of (offset, view)
+    requests and returns the number of bytes read into each view
+    :return: list of memoryviews of the ranges in the order of ranges
+    """
+    runs, placement = _merge_ranges(ranges, merge_gap)
+    total = sum(length for _, length in runs)
+    if buffer is None:
+        buffer = bytearray(total)
+    view = _byte_view(buffer)
+    if len(view) < total:
+        raise ValueError(
+            "buffer of {} bytes is too small for {} bytes".format(len(view), total)
+        )
+    run_views, requests, request_runs = [], [], []
+    position = 0
+    for offset, length in runs:
+        end = position + length
+        run_view = view[position:end]
+        run_views.append(run_view)
+        step = piece_size or length
+        for start in range(0, length, step):
+            stop = min(start + step, length)
+            requests.append((offset + start, run_view[start:stop]))
+            request_runs.append(len(run_views) - 1)
+        position = end
+    # Each run is complete up to its first short request, e.g. at EOF
+    available = [length for _, length in runs]
+    complete = [True] * len(runs)
+    for run, (offset, request_view), filled in zip(
+        request_runs, requests, read_requests(requests)
+    ):
+        if not complete[run]:
+            continue
+        if filled < len(request_view):
+            available[run] = offset - runs[run][0] + filled
+            complete[run] = False
+    views = []
+    for (run, start), (_, length) in zip(placement, ranges):
+        end = min(start + length, available[run])
+        start = min(start, end)
+        views.append(run_views[run][start:end])
+    return views
+
+
+def _split_ranges(size, parts, min_size):
+    """Split size bytes into at most parts contiguous (offset, length) ranges
+    :param size: total amount of bytes
+    :param parts: maximum number of ranges
+    :param min_size: smallest range worth its own connection
+    :return: list of (offset, length) tuples
+    """
+    if size <= 0:
+        return [(0, 0)]
+    parts = max(1, min(parts, size // max(min_size, 1)))
+    length = -(-size // parts)
+    return [(offset, min(length, size - offset)) for offset in range(0, size, length)]
+
+
+def _run_parallel(func, args_list):
+    """Run func once per args tuple, each in its own thread
+    :param func: callable to run
+    :param args_list: list of argument tuples
+    :return: list of the results in args_list order,
+    the first raised exception is reraised in the calling thread
+    """
+    results = [None] * len(args_list)
+    errors = []
+
+    def run(index, args):
         try:
-            self._client.stat(six.text_type(path))
-            return True
-        except SFTPProtocolError:
-            return False
-        return False
-
-    def list(self, path="."):
-        """
-        :param path: path to the directory which content should be listed
-        :return: list of str, of items in the path directory
-        """
-        with self._client.opendir(six.text_type(path)) as fh:
-            return [name.decode("utf-8") for size, name, attrs in fh.readdir()]
-
-    def mkdir(self, path, mode=755, **kwargs):
-        """
-        :param path: path to the directory that should be created
-        :return: Boolean
-        """
-        self._client.mkdir(six.text_type(path), mode)
-
-    def rmdir(self, path):
-        """
-        :param path: path to the directory that should be removed
-        :return: None
-        """
-        self._client.rmdir(six.text_type(path))
-
-    def remove(self, path):
-        """
-        :param path: path to the file that should be removed
-        """
-        self._client.unlink(six.text_type(path))
-
-    def close(self):
-        self._client = None
+            results[index] = func(*args)
+        except Exception as err:
+            errors.append(err)
+
+    threads = [
+        threading.Thread(target=run, args=(index, args))
+        for index, args in enumerate(args_list)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
 
 
 class ERDA:
@@ -388,62 +467,6 @@ class IDMC:
     url = "io.idmc.dk"
 
 
-class ERDASftpShare(SFTPStore):
-    def __init__(self, username=None, password=None):
-        super(ERDASftpShare, self).__init__(ERDA.url, username, password)
-
-
-# TODO -> cleanup duplication
-class ERDASSHFSShare(SSHFSStore):
-    def __init__(self, share_link):
-        """
-        :param share_link:
-        This is the sharelink ID that is used to access the datastore,
-        an overview over your sharelinks can be found at
-        https://erda.dk/wsgi-bin/sharelink.py.
-        """
-        host = "@" + ERDA.url + "/"
-        super(ERDASSHFSShare, self).__init__(
-            host=host, username=share_link, password=share_link
-        )
-
-
-class ERDAShare(ERDASftpShare):
-    def __init__(self, share_link):
-        """
-        :param share_link:
-        This is the sharelink ID that is used to access the datastore,
-        an overview over your sharelinks can be found at
-        https://erda.dk/wsgi-bin/sharelink.py.
-        """
-        super(ERDAShare, self).__init__(share_link, share_link)
-
-
-# TODO -> cleanup duplication
-class IDMCSSHFSShare(SSHFSStore):
-    def __init__(self, share_link):
-        """
-        :param share_link:
-        This is the sharelink ID that is used to access the datastore,
-        an overview over your sharelinks can be found at,
-        https://erda.dk/wsgi-bin/sharelink.py.
-        """
-        host = "@" + IDMC.url + "/"
-        super(IDMCSSHFSShare, self).__init__(
-            host=host, username=share_link, password=share_link
-        )
-
-
-class IDMCSftpShare(SFTPStore):
-    def __init__(self, username=None, password=None):
-        super(IDMCSftpShare, self).__init__(IDMC.url, username, password)
-
-
-class IDMCShare(IDMCSftpShare):
-    def __init__(self, share_link):
-        super(IDMCShare, self).__init__(share_link, share_link)
-
-
 # class ErdaHome(DataStore):
 #     _target = ERDA.url
 #
@@ -0,0 +1,1579 @@
+import io
+import os
+import posixpath
+import select
+import six
+import struct
+import sys
+import threading
+from collections import deque
+from ssh2.error_codes import LIBSSH2_ERROR_EAGAIN
+from ssh2.exceptions import ChannelFailure, SFTPProtocolError
+from ssh2.session import LIBSSH2_SESSION_BLOCK_INBOUND, LIBSSH2_SESSION_BLOCK_OUTBOUND
+from ssh2.sftp import (
+    LIBSSH2_FXF_READ,
+    LIBSSH2_FXF_WRITE,
+    LIBSSH2_FXF_CREAT,
+    LIBSSH2_FXF_TRUNC,
+    LIBSSH2_SFTP_S_IRUSR,
+    LIBSSH2_SFTP_S_IWUSR,
+    LIBSSH2_SFTP_S_IRGRP,
+    LIBSSH2_SFTP_S_IROTH,
+    LIBSSH2_FXF_APPEND,
+    LIBSSH2_SFTP_ATTR_ACMODTIME,
+    LIBSSH2_SFTP_ATTR_SIZE,
+)
+from ssh2.sftp_handle import SFTPAttributes
+from ._connection import (
+    SFTPConnection,
+    SharedSession,
+    SharePool,
+    _abandon,
+    _inherited,
+    _is_eagain,
+)
+from ._io import (
+    ERDA,
+    IDMC,
+    DataStore,
+    DirEntry,
+    FileHandle,
+    _array_bytes,
+    _byte_view,
+    _merge_ranges,
+    _read_vectored,
+    _restore_store,
+    _run_parallel,
+    _split_ranges,
+)
+from ._stats import _clock, _result_size, _timed
+
+# SFTP status of a path that doesn't exist, ssh2.sftp doesn't export it
+LIBSSH2_FX_NO_SUCH_FILE = 2
+
+
+class SFTPFileHandle(FileHandle):
+    # Size in bytes of each SFTP read request
+    chunk_size = 32768
+    # Number of read requests that are kept in flight at increasing offsets
+    window = 64
+    # Optional BlockCache that reads are served through
+    _cache = None
+    # Optional callable that is called once the handle is closed
+    _on_close = None
+    # BufferedReader that readline and line iteration are served from
+    _lines = None
+    closed = False
+    # Buffer small sequential reads ahead of the current offset
+    read_ahead = True
+    # SFTPStore.readv of the store that opened the handle
+    _readv = None
+    # TransferStats of the store that opened the handle
+    _stats = None
+
+    def __init__(self, fh, name, flag, chunk_size=None, window=None, read_ahead=None):
+        """
+        :param fh: Expects a PySFTPHandle
+        :param chunk_size: size of each read request, defaults to
+        SFTPFileHandle.chunk_size
+        :param window: number of read requests to keep outstanding,
+        defaults to SFTPFileHandle.window
+        :param read_ahead: whether small sequential reads are served from
+        a read-ahead buffer, defaults to SFTPFileHandle.read_ahead
+        """
+        self.fh = fh
+        self.name = name
+        self.flag = flag
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        if window is not None:
+            self.window = window
+        if read_ahead is not None:
+            self.read_ahead = read_ahead
+        # Data that was read ahead of the current offset, the handle offset
+        # is at the end of it, and the position of the next unread byte
+        self._ahead = bytearray()
+        self._ahead_pos = 0
+        # Size of the next read-ahead, 0 until sequential reads are detected
+        self._ahead_size = 0
+        self._sequential = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+
+        return line
+
+    # Python 2
+    next = __next__
+
+    def readable(self):
+        return "r" in self.flag
+
+    def writable(self):
+        return "w" in self.flag or "a" in self.flag
+
+    def seekable(self):
+        return True
+
+    def readline(self, size=-1):
+        """
+        Lines are read through a buffer of window * chunk_size bytes,
+        a following read, seek or tell continues right after the line
+        :param size: maximum amount of bytes to be read
+        :return: the next line including its line ending,
+        decoded to a utf-8 string unless the handle is binary
+        """
+        assert "r" in self.flag
+        if self._lines is None:
+            self._lines = io.BufferedReader(
+                SFTPRawIO(self, close_handle=False),
+                buffer_size=self.chunk_size * self.window,
+            )
+        line = self._lines.readline(size)
+        if "b" in self.flag:
+            return line
+        return line.decode("utf-8")
+
+    def readlines(self):
+        """
+        :return: list of the remaining lines in the file
+        """
+        return list(self)
+
+    def _sync_lines(self):
+        """Drop the line buffer and move the handle to the end of the last line
+        that was returned, so it can be read from directly again
+        :return: None
+        """
+        if self._lines is not None:
+            offset = self._lines.tell()
+            self._lines = None
+            self._seek(offset)
+
+    def stream(self, buffering=-1):
+        """Wrap the handle in the standard io stack, so it can be given to
+        consumers that expect a file object, e.g. PIL, numpy.load, csv
+        The stream reads and writes through the handle as it is consumed,
+        closing the stream closes the handle.
+        :param buffering: 0 for an unbuffered binary SFTPRawIO, otherwise the
+        size of the buffer, defaults to window * chunk_size bytes
+        :return: SFTPRawIO, io.BufferedReader or io.BufferedWriter for binary
+        handles and an utf-8 io.TextIOWrapper for text handles
+        """
+        self._sync_lines()
+        raw = SFTPRawIO(self)
+        if buffering == 0:
+            if "b" not in self.flag:
+                raise ValueError("text streams can't be unbuffered")
+            return raw
+        if buffering < 0:
+            buffering = self.chunk_size * self.window
+        if self.readable():
+            stream = io.BufferedReader(raw, buffer_size=buffering)
+        else:
+            stream = io.BufferedWriter(raw, buffer_size=buffering)
+        if "b" in self.flag:
+            return stream
+        return io.TextIOWrapper(stream, encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Close the passed PySFTPHandles
+        :return: None
+        """
+        if self.closed:
+            return
+        self._lines = None
+        self.closed = True
+        self.fh.close()
+        if self._on_close is not None:
+            self._on_close()
+
+    def read(self, n=-1):
+        """
+        :param n: amount of bytes to be read, defaults to the entire file
+        :return: the content of path, decoded to utf-8 string
+        """
+        assert "r" in self.flag
+        if "b" in self.flag:
+            return self.read_binary(n)
+        else:
+            result = self.read_binary(n).decode("utf-8")
+            return result
+
+    @_timed("file.write", _result_size)
+    def write(self, data):
+        """
+        :param path: path to the file that should be created/written to
+        :param data: data that should be written to the file, expects binary or str
+        :param flag: write mode
+        :return: the number of bytes written
+        """
+        assert "w" in self.flag or "a" in self.flag
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return self._write_pipelined(_byte_view(data))
+        elif type(data) == str:
+            data = six.b(data)
+        else:
+            data = six.b(str(data))
+        self.fh.write(data)
+        return len(data)
+
+    def truncate(self, size=None):
+        """
+        :param size: size in bytes to cut or extend the file to,
+        defaults to the current position
+        :return: the new size
+        """
+        if size is None:
+            size = self.tell()
+        attrs = SFTPAttributes()
+        attrs.flags = LIBSSH2_SFTP_ATTR_SIZE
+        attrs.filesize = size
+        self.fh.fsetstat(attrs)
+        return size
+
+    def _write_pipelined(self, view):
+        """Write a byte view as a sequence of window sized writes
+        libssh2 splits each write call into chunk_size requests that are all
+        sent before their acknowledgements are awaited, so writing
+        window * chunk_size bytes at a time keeps that many writes in flight
+        while bounding how much of the payload is copied at once.
+        :param view: memoryview of the bytes to be written
+        :return: the number of bytes written
+        """
+        request_size = self.chunk_size * self.window
+        for offset in range(0, len(view), request_size):
+            end = offset + request_size
+            self.fh.write(view[offset:end].tobytes())
+        return len(view)
+
+    def seek(self, offset, whence=0):
+        """Seek file to a given offset
+        :param offset: amount of bytes to skip
+        :param whence: defaults to 0 which means absolute file positioning
+                       other values are 1 which means seek relative to
+                       the current position and 2 means seek relative to the file's end.
+        :return: the new absolute offset
+        """
+        self._sync_lines()
+        return self._seek(offset, whence)
+
+    def _seek(self, offset, whence=0):
+        if whence == 1:
+            # Seek relative to the current position
+            offset += self._tell()
+        if whence == 2:
+            file_stat = self.fh.fstat()
+            # Seek relative to the file end
+            offset += file_stat.filesize
+        if offset == self._tell():
+            return offset
+        ahead_end = self.fh.tell64()
+        ahead_start = ahead_end - len(self._ahead)
+        if ahead_start <= offset <= ahead_end and self._ahead:
+            # Short seeks within the read-ahead data keep it
+            self._ahead_pos = offset - ahead_start
+            return offset
+        # Seeking discards the requests that libssh2 has in flight as well
+        self._ahead = bytearray()
+        self._ahead_pos = 0
+        self._ahead_size //= 2
+        if self._ahead_size < self.chunk_size:
+            self._ahead_size = 0
+        self._sequential = False
+        self.fh.seek64(offset)
+        return offset
+
+    def _tell(self):
+        """Get the offset of the next byte to be read, which is behind
+        the handle offset by the unread read-ahead data
+        :return: int
+        """
+        return self.fh.tell64() - (len(self._ahead) - self._ahead_pos)
+
+    @_timed("file.read", _result_size)
+    def read_binary(self, n=-1):
+        """
+        The content is read into a buffer that is copied into the bytes,
+        readinto reads into the caller's buffer without the copy.
+        :param n: amount of bytes to be read, defaults to the rest of the file
+        :return: bytes of the content within in file
+        """
+        self._sync_lines()
+        fill_rest = n < 0
+        if fill_rest:
+            # Size the buffer up front instead of growing it
+            n = self._remaining()
+        data = bytearray(n)
+        filled = self._readinto(data)
+        if filled < n:
+            del data[filled:]
+        elif fill_rest:
+            # The file grew since it was stat'ed
+            start = self._ahead_pos
+            data.extend(self._ahead[start:])
+            self._ahead, self._ahead_pos = bytearray(), 0
+            for chunk in self._read_pipelined():
+                data.extend(chunk)
+        return bytes(data)
+
+    @_timed("file.read", _result_size)
+    def readinto(self, buffer):
+        """Read directly into a preallocated buffer
+        :param buffer: writable bytes-like object, e.g. a bytearray,
+        memoryview or a contiguous numpy array
+        :return: the number of bytes read, less than the size of buffer at EOF
+        """
+        self._sync_lines()
+        return self._readinto(buffer)
+
+    def _readinto(self, buffer):
+        view = _byte_view(buffer)
+        if self._cache is None:
+            return self._read_ahead_into(view)
+        offset = self.fh.tell64()
+        filled = self._cache.readinto(
+            self._cache_key, self._cache_size, offset, view, self._fetch
+        )
+        self.fh.seek64(offset + filled)
+        return filled
+
+    def _read_ahead_into(self, view):
+        """Fill view, serving small sequential reads from read-ahead data
+        Once a read continues where the previous one ended, the following
+        small reads refill a read-ahead buffer that doubles in size up to
+        window * chunk_size while the reads stay sequential and halves on
+        every seek away from it. libssh2 keeps requests for the data after
+        each refill in flight, so the next refill is mostly already local.
+        Reads of at least the read-ahead size go straight into view.
+        :param view: writable memoryview
+        :return: the number of bytes read
+        """
+        filled = self._take_into(view)
+        rest = view[filled:]
+        if not rest:
+            return filled
+        # The read-ahead data is used up
+        self._ahead, self._ahead_pos = bytearray(), 0
+        max_size = self.chunk_size * self.window
+        if self.read_ahead and self._sequential and len(rest) < max_size:
+            self._ahead_size = min(max(self._ahead_size * 2, self.chunk_size), max_size)
+        if not self.read_ahead or len(rest) >= self._ahead_size:
+            filled += self._fill(rest)
+        else:
+            ahead = bytearray(self._ahead_size)
+            size = self._fill(memoryview(ahead))
+            del ahead[size:]
+            self._ahead, self._ahead_pos = ahead, 0
+            filled += self._take_into(rest)
+        self._sequential = True
+        return filled
+
+    def _take_into(self, view):
+        """Copy unread read-ahead data into view
+        :param view: writable memoryview
+        :return: the number of bytes copied
+        """
+        size = min(len(view), len(self._ahead) - self._ahead_pos)
+        if size > 0:
+            start, end = self._ahead_pos, self._ahead_pos + size
+            view[:size] = self._ahead[start:end]
+            self._ahead_pos = end
+        return max(size, 0)
+
+    def readv(self, ranges, buffer=None, merge_gap=0):
+        """Read many byte ranges of the file at once, see SFTPStore.readv
+        Handles that were opened through a SFTPStore read the ranges
+        concurrently, others and those that read through a cache
+        read them one after the other.
+        The offset of the handle is left unchanged.
+        :param ranges: list of (offset, length) tuples
+        :param buffer: optional writable bytes-like object that the merged
+        ranges are read into back to back
+        :param merge_gap: ranges that are at most this many bytes apart
+        are read as one
+        :return: list of memoryviews of the ranges in the order of ranges
+        """
+        if self._readv is not None and self._cache is None:
+            return self._readv(self.name, ranges, buffer=buffer, merge_gap=merge_gap)
+
+        def read_requests(requests):
+            offset = self.tell()
+            try:
+                filled = []
+                for request_offset, view in requests:
+                    self.seek(request_offset)
+                    filled.append(self.readinto(view))
+                return filled
+            finally:
+                self.seek(offset)
+
+        return _read_vectored(ranges, buffer, merge_gap, None, read_requests)
+
+    def _fill(self, view):
+        filled = 0
+        for chunk in self._read_pipelined(len(view)):
+            end = filled + len(chunk)
+            view[filled:end] = chunk
+            filled = end
+        return filled
+
+    def _fetch(self, offset, view):
+        self.fh.seek64(offset)
+        return self._fill(view)
+
+    def _use_cache(self, cache, key, size):
+        """Serve the reads of the handle through a BlockCache
+        :param cache: BlockCache
+        :param key: cache key of the file
+        :param size: size of the file when it was opened
+        :return: None
+        """
+        self._cache = cache
+        self._cache_key = key
+        self._cache_size = size
+
+    def _remaining(self):
+        """Get the amount of bytes between the current offset and the file end
+        :return: int
+        """
+        if self._cache is not None:
+            size = self._cache_size
+        else:
+            size = self.fh.fstat().filesize
+        return max(size - self._tell(), 0)
+
+    def _read_pipelined(self, n=-1):
+        """Read up to n bytes as a sequence of in order chunks
+        libssh2 splits each read call into chunk_size requests at increasing
+        offsets and keeps them outstanding between calls, so asking for
+        window * chunk_size bytes at a time keeps that many requests in
+        flight instead of waiting a full round trip per chunk.
+        :param n: amount of bytes to be read, defaults to the rest of the file
+        :return: generator of binary strings in file order
+        """
+        request_size = self.chunk_size * self.window
+        if n >= 0:
+            request_size = min(request_size, n)
+        if self._stats is not None:
+            # libssh2 keeps a request per chunk of the read size in flight
+            self._stats.record_depth("file.read", -(-request_size // self.chunk_size))
+        remaining = n
+        while remaining != 0:
+            if remaining > 0:
+                request_size = min(request_size, remaining)
+            # 0 -> EOF, the server may return less than was requested
+            size, chunk = self.fh.read(request_size)
+            if size <= 0:
+                break
+            if remaining > 0:
+                remaining -= size
+            yield chunk
+
+    def tell(self):
+        """Get the current file handle offset
+        :return: int
+        """
+        if self._lines is not None:
+            return self._lines.tell()
+        return self._tell()
+
+
+class SFTPRawIO(io.RawIOBase):
+    def __init__(self, handle, close_handle=True):
+        """
+        Unbuffered io.RawIOBase view of an SFTPFileHandle,
+        that io.BufferedReader and io.TextIOWrapper can be stacked on
+        :param handle: SFTPFileHandle
+        :param close_handle: close the handle when the stream is closed
+        """
+        super(SFTPRawIO, self).__init__()
+        self.handle = handle
+        self.name = handle.name
+        self.mode = handle.flag
+        self._close_handle = close_handle
+
+    def readable(self):
+        return self.handle.readable()
+
+    def writable(self):
+        return self.handle.writable()
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.handle._readinto(buffer)
+
+    def write(self, data):
+        return self.handle.write(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.handle._seek(offset, whence)
+
+    def tell(self):
+        return self.handle._tell()
+
+    def close(self):
+        if not self.closed and self._close_handle:
+            self.handle.close()
+        super(SFTPRawIO, self).close()
+
+
+class SFTPStore(DataStore):
+    # Smallest byte range that is transferred over its own connection
+    min_range_size = 8 * 1024 * 1024
+    # Most sftp channels that readv reads ranges concurrently over
+    readv_channels = 16
+    # Permissions of the files that are created by the store
+    _file_mode = (
+        LIBSSH2_SFTP_S_IRUSR
+        | LIBSSH2_SFTP_S_IWUSR
+        | LIBSSH2_SFTP_S_IRGRP
+        | LIBSSH2_SFTP_S_IROTH
+    )
+
+    def __init__(
+        self,
+        host=None,
+        username=None,
+        password=None,
+        port=22,
+        pool=None,
+        cache=None,
+        metadata=None,
+        thread_safe=False,
+        stats=None,
+    ):
+        """
+        :param host: host of the sftp server
+        :param username: username to authenticate with
+        :param password: password to authenticate with
+        :param port: ssh port on host
+        :param pool: optional SharePool for the same host and username that
+        sessions are borrowed from instead of opened, or True to use the
+        process wide SharePool.shared pool
+        :param cache: optional BlockCache that file reads are served through
+        :param metadata: optional MetadataCache that exists and list results
+        are served from
+        :param thread_safe: let several threads use the store at once,
+        each over its own sftp channel of the store's session,
+        see SharedSession
+        :param stats: optional TransferStats that the operations,
+        the setup of new sessions and the readv request depth are recorded in
+        """
+        if pool is True:
+            pool = SharePool.shared(host, username, password, port=port)
+        if pool is not None and (pool.host, pool.username) != (host, username):
+            raise ValueError(
+                "pool for {}@{} can't serve {}@{}".format(
+                    pool.username, pool.host, username, host
+                )
+            )
+        self._host = host
+        self._username = username
+        self._password = password
+        self._port = port
+        self._pool = pool
+        # SharePool that keeps the extra sessions of the parallel transfers
+        # open between calls when the store has no pool, see _worker_pool
+        self._workers = None
+        self._workers_lock = threading.Lock()
+        self._cache = cache
+        self._metadata = metadata
+        self._stats = stats
+        # _ReadvChannels of the session that readv reuses
+        self._readv_sftp = []
+        # Changed with every file that the store changes, readv reopens the
+        # files that it kept open from before
+        self._readv_epoch = 0
+        # Most channels that the server opens on a session, once known
+        self._readv_limit = None
+        # Process that the session belongs to
+        self._pid = os.getpid()
+        self._connection = self._acquire()
+        # Hands out the channels of the session in thread safe mode
+        self._shared = SharedSession(self._connection) if thread_safe else None
+        super(SFTPStore, self).__init__(client=self._connection.sftp)
+
+    @property
+    def _client(self):
+        self._check_process()
+        if self._shared is not None and self._sftp is not None:
+            return self._shared.channel()
+        return self._sftp
+
+    @_client.setter
+    def _client(self, client):
+        self._sftp = client
+
+    def _check_process(self):
+        """Open a new session in a process that was forked from the one
+        the store was connected in, the inherited session shares its socket
+        and ssh state with the parent process and is left to it
+        :return: None
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        if self._connection is None:
+            # Closed
+            return
+        _abandon(self._connection, self._shared, *self._readv_sftp)
+        self._readv_sftp = []
+        self._connection = self._acquire()
+        self._sftp = self._connection.sftp
+        if self._shared is not None:
+            self._shared = SharedSession(self._connection)
+
+    def __reduce__(self):
+        # Pickled as its connection parameters, the receiving process
+        # connects on its own
+        kwargs = dict(
+            host=self._host,
+            username=self._username,
+            password=self._password,
+            port=self._port,
+            pool=self._pool,
+            cache=self._cache,
+            metadata=self._metadata,
+            thread_safe=self._shared is not None,
+            stats=self._stats,
+        )
+        return _restore_store, (self.__class__, SFTPStore, kwargs)
+
+    def _acquire(self, pool=None):
+        """
+        Get a session to the same host and share as this store,
+        borrowed from the pool if the store has one
+        :param pool: SharePool to borrow from instead of the store's pool
+        :return: SFTPConnection
+        """
+        if self._stats is None:
+            return self._connect(pool)
+        start = _clock()
+        connection = self._connect(pool)
+        self._stats.record("acquire", _clock() - start)
+        if connection.setup_times is not None:
+            # Reported once, by the first store with stats that gets it
+            for phase, seconds in connection.setup_times:
+                self._stats.record("connect." + phase, seconds)
+            connection.setup_times = None
+        return connection
+
+    def _connect(self, pool=None):
+        pool = self._pool if pool is None else pool
+        if pool is not None:
+            return pool.acquire()
+        return SFTPConnection(self._host, self._username, self._password, self._port)
+
+    def _release(self, connection, discard=False, pool=None):
+        """
+        Return a session that was got through _acquire
+        :param connection: SFTPConnection
+        :param discard: don't return the session to the pool, e.g. after an error
+        :param pool: SharePool that the session was borrowed from,
+        defaults to the store's pool
+        :return: None
+        """
+        pool = self._pool if pool is None else pool
+        if pool is not None:
+            pool.release(connection, discard=discard)
+        else:
+            connection.close()
+
+    def _worker_pool(self):
+        """
+        Get the pool that the sessions of read_files, write_files, download
+        and upload beyond the store's own, and those of the clones that walk
+        and sync work through, are borrowed from
+        :return: the store's SharePool, or one of its own that keeps the
+        sessions open until the store is closed if it has none
+        """
+        if self._pool is not None:
+            return self._pool
+        with self._workers_lock:
+            if self._workers is None:
+                # As many sessions as the transfers ask for
+                self._workers = SharePool(
+                    self._host,
+                    self._username,
+                    self._password,
+                    port=self._port,
+                    max_size=sys.maxsize,
+                )
+            return self._workers
+
+    def _invalidate(self, path, recursive=False):
+        # The files that readv keeps open may no longer be the ones at
+        # their paths
+        self._readv_epoch += 1
+        super(SFTPStore, self)._invalidate(path, recursive=recursive)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @_timed("open")
+    def open(self, path, flag="r", buffering=None, **kwargs):
+        """
+        :param path: path to file on the sftp end
+        :param flag: open mode, either 'r'=read, 'w'=write, 'a'=append
+        'rb'=read binary, 'wb'=write binary or 'ab'= append binary
+        :param buffering: when set, the handle is returned as a standard
+        io stream instead, see SFTPFileHandle.stream
+        :param kwargs: passed on to the SFTPFileHandle,
+        e.g. chunk_size and window to tune the pipelined reads
+        :return: SFTPFileHandle wrapping a SFTPHandle,
+        https://github.com/ParallelSSH/ssh2-python/blob/master/ssh2/sftp_handle.pyx
+        """
+        fh = self._client.open(six.text_type(path), *self._open_args(flag))
+        assert fh is not None
+        handle = SFTPFileHandle(fh, path, flag, **kwargs)
+        handle._readv = self.readv
+        handle._stats = self._stats
+        if "r" not in flag:
+            # Both the creation and the size of the file change its metadata
+            self._invalidate(path)
+            handle._on_close = lambda: self._invalidate(path)
+        if self._cache is not None and "r" in flag:
+            attrs = fh.fstat()
+            share = "{}@{}:{}".format(self._username, self._host, self._port)
+            key = self._cache.key(share, path, attrs.filesize, attrs.mtime)
+            handle._use_cache(self._cache, key, attrs.filesize)
+        if buffering is not None:
+            return handle.stream(buffering)
+        return handle
+
+    @_timed("readinto", _result_size)
+    def readinto(self, path, buffer):
+        """
+        :param path: path to the file that should be read
+        :param buffer: writable bytes-like object that the content is read into,
+        e.g. a bytearray, memoryview or a contiguous numpy array
+        :return: the number of bytes read
+        """
+        with self.open(path, "rb") as fh:
+            return fh.readinto(buffer)
+
+    @classmethod
+    def _open_args(cls, flag):
+        """
+        :param flag: open mode, see open
+        :return: tuple of the LIBSSH2_FXF_* flags and LIBSSH2_SFTP_S_* mode
+        that a file should be opened with
+        """
+        if flag == "r" or flag == "rb":
+            return LIBSSH2_FXF_READ, LIBSSH2_SFTP_S_IWUSR
+        w_flags = None
+        if flag == "w" or flag == "wb":
+            w_flags = LIBSSH2_FXF_CREAT | LIBSSH2_FXF_WRITE
+        elif flag == "a" or flag == "ab":
+            w_flags = LIBSSH2_FXF_CREAT | LIBSSH2_FXF_WRITE | LIBSSH2_FXF_APPEND
+        return w_flags, cls._file_mode
+
+    @_timed("exists")
+    def exists(self, path):
+        """
+        :param path: the path we are checking whether it exists
+        :return: Boolean
+        """
+        if self._metadata is not None:
+            cached = self._metadata.exists(path)
+            if cached is not self._metadata.MISSING:
+                return cached
+        # There is no direct way to check if it exists
+        # See if we can stat the designated path instead
+        try:
+            attrs = self._client.stat(six.text_type(path))
+        except SFTPProtocolError:
+            attrs = None
+        if self._metadata is not None:
+            # Missing paths are cached as well, as None
+            self._metadata.set("stat", path, attrs)
+        return attrs is not None
+
+    @_timed("stat")
+    def stat(self, path):
+        """
+        :param path: path to the file or directory
+        :return: DirEntry of path, raises SFTPProtocolError if it doesn't exist
+        """
+        attrs = None
+        if self._metadata is not None:
+            attrs = self._metadata.get("stat", path)
+            if attrs is self._metadata.MISSING:
+                attrs = None
+        if attrs is None:
+            attrs = self._client.stat(six.text_type(path))
+            if self._metadata is not None:
+                self._metadata.set("stat", path, attrs)
+        name = posixpath.basename(posixpath.normpath(six.text_type(path)))
+        return DirEntry(name, attrs.filesize, attrs.mtime, attrs.permissions)
+
+    @_timed("list")
+    def list(self, path="."):
+        """
+        :param path: path to the directory which content should be listed
+        :return: list of str, of items in the path directory
+        """
+        if self._metadata is not None:
+            cached = self._metadata.get("list", path)
+            if cached is not self._metadata.MISSING:
+                return list(cached)
+        with self._client.opendir(six.text_type(path)) as fh:
+            names = [name.decode("utf-8") for size, name, attrs in fh.readdir()]
+        if self._metadata is not None:
+            self._metadata.set("list", path, tuple(names))
+        return names
+
+    def iterdir(self, path="."):
+        """
+        :param path: path to the directory which content should be listed
+        :return: generator of DirEntry objects, excluding "." and "..",
+        yielded as the batches of the listing arrive from the server
+        """
+        with self._client.opendir(six.text_type(path)) as fh:
+            for size, name, attrs in fh.readdir():
+                name = name.decode("utf-8")
+                if name in (".", ".."):
+                    continue
+                yield DirEntry(name, attrs.filesize, attrs.mtime, attrs.permissions)
+
+    @_timed("list_attr")
+    def list_attr(self, path="."):
+        """
+        :param path: path to the directory which content should be listed
+        :return: list of DirEntry objects, excluding "." and ".."
+        """
+        return list(self.iterdir(path))
+
+    def _clone(self):
+        # The clones' sessions go back to the pool for the next walk or sync
+        return SFTPStore(
+            self._host,
+            self._username,
+            self._password,
+            self._port,
+            pool=self._worker_pool(),
+            cache=self._cache,
+            metadata=self._metadata,
+            stats=self._stats,
+        )
+
+    @_timed("mkdir")
+    def mkdir(self, path, mode=755, **kwargs):
+        """
+        :param path: path to the directory that should be created
+        :return: Boolean
+        """
+        self._invalidate(path)
+        self._client.mkdir(six.text_type(path), mode)
+
+    @_timed("rmdir")
+    def rmdir(self, path):
+        """
+        :param path: path to the directory that should be removed
+        :return: None
+        """
+        self._invalidate(path, recursive=True)
+        self._client.rmdir(six.text_type(path))
+
+    @_timed("remove")
+    def remove(self, path):
+        """
+        :param path: path to the file that should be removed
+        """
+        self._invalidate(path)
+        self._client.unlink(six.text_type(path))
+
+    @_timed("utime")
+    def utime(self, path, times):
+        """
+        :param path: path to the file that should be changed
+        :param times: tuple of the access and modification time,
+        in seconds since the epoch
+        :return: None
+        """
+        attrs = SFTPAttributes()
+        attrs.flags = LIBSSH2_SFTP_ATTR_ACMODTIME
+        attrs.atime, attrs.mtime = (int(time) for time in times)
+        self._invalidate(path)
+        self._client.setstat(six.text_type(path), attrs)
+
+    @_timed("read_binary", _result_size)
+    def read_binary(self, path, connections=1):
+        """
+        :param path: path to the file that should be read
+        The file is read into a buffer that is copied into the bytes,
+        readinto and download read into the caller's buffer without the copy.
+        :param connections: number of sessions that fetch byte ranges
+        of the file in parallel, ignored when the store has a cache
+        :return: bytes of the content within file
+        """
+        if self._cache is not None:
+            with self.open(path, "rb") as fh:
+                return fh.read_binary()
+        data = bytearray(self._client.stat(six.text_type(path)).filesize)
+        self.download(path, data, connections=connections)
+        return bytes(data)
+
+    @_timed("readv", _result_size)
+    def readv(self, path, ranges, buffer=None, merge_gap=0):
+        """Read many byte ranges of a file at once
+        Overlapping and adjacent ranges are merged and the merged ranges
+        are read concurrently over up to readv_channels sftp channels of
+        this store's session, each channel reads one range at a time.
+        The channels and the file handles on them are kept open for the
+        next call, so N small reads of a file that was read before cost
+        about N / readv_channels round trips. libssh2 opens one channel
+        of a session at a time, the first call reads over the store's
+        own channel while the others are opened.
+        :param path: path to the file on the sftp end
+        :param ranges: list of (offset, length) tuples
+        :param buffer: optional writable bytes-like object that the merged
+        ranges are read into back to back, defaults to a new bytearray
+        :param merge_gap: ranges that are at most this many bytes apart
+        are read as one
+        :return: list of memoryviews of the ranges in the order of ranges,
+        shorter than requested where a range passes the end of the file
+        """
+        request_size = SFTPFileHandle.chunk_size * SFTPFileHandle.window
+        total = sum(length for _, length in _merge_ranges(ranges, merge_gap)[0])
+        # Split long runs so that they are spread over the channels as well
+        piece_size = max(request_size, -(-total // self.readv_channels))
+        return _read_vectored(
+            ranges,
+            buffer,
+            merge_gap,
+            piece_size,
+            lambda requests: self._read_requests(path, requests),
+        )
+
+    @_timed("read_array", _result_size)
+    def read_array(self, path, dtype, shape=None, offset=0, order="C"):
+        """Read raw array data straight into a new numpy array
+        The bytes are read into the array's own buffer, concurrently over
+        the sftp channels as with readv, or through the cache if the store
+        has one, so no intermediate copies are made.
+        :param path: path to the file on the sftp end
+        :param dtype: numpy dtype of the elements
+        :param shape: shape of the array, defaults to a 1-D array of
+        the elements from offset to the end of the file
+        :param offset: file offset of the first element
+        :param order: "C" or "F", the memory layout of the elements in the file
+        :return: numpy array
+        """
+        import numpy as np
+
+        dtype = np.dtype(dtype)
+        if shape is None:
+            size = self._client.stat(six.text_type(path)).filesize
+            shape = (max(size - offset, 0) // dtype.itemsize,)
+        elif isinstance(shape, six.integer_types):
+            shape = (shape,)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        data = np.empty(nbytes, dtype=np.uint8)
+        if self._cache is not None:
+            with self.open(path, "rb") as fh:
+                fh.seek(offset)
+                read = 0
+                while read < nbytes:
+                    size = fh.readinto(data[read:])
+                    if not size:
+                        break
+                    read += size
+        elif nbytes:
+            read = len(self.readv(path, [(offset, nbytes)], buffer=data)[0])
+        else:
+            read = 0
+        if read < nbytes:
+            raise IOError(
+                "expected {} bytes at offset {} of {} but got {}".format(
+                    nbytes, offset, path, read
+                )
+            )
+        return data.view(dtype).reshape(shape, order=order)
+
+    @_timed("write_array", _result_size)
+    def write_array(self, path, array, connections=1):
+        """Write the raw data of a numpy array to a file
+        The data is sent from the array's own buffer,
+        only an array that isn't contiguous is copied first.
+        :param path: path to the file on the sftp end, it is truncated first
+        :param array: numpy array, its elements are written in the array's
+        memory layout, i.e. Fortran order for a Fortran contiguous array
+        :param connections: number of sessions that write byte ranges
+        of the file in parallel
+        :return: the number of bytes written
+        """
+        return self._write_buffer(path, _array_bytes(array), connections=connections)
+
+    @_timed("read_npy", _result_size)
+    def read_npy(self, path):
+        """Read a .npy file straight into a new numpy array, see read_array
+        :param path: path to the .npy file on the sftp end
+        :return: numpy array
+        """
+        from numpy.lib import format as npy_format
+
+        with self.open(path, "rb") as fh:
+            # magic, version and the length of the header
+            prefix = fh.read(12)
+            header = io.BytesIO(prefix)
+            version = npy_format.read_magic(header)
+            if version == (1, 0):
+                length_size = 2
+                read_header = npy_format.read_array_header_1_0
+            else:
+                length_size = 4
+                read_header = npy_format.read_array_header_2_0
+            length_end = 8 + length_size
+            (length,) = struct.unpack(
+                "<H" if length_size == 2 else "<I", prefix[8:length_end]
+            )
+            offset = length_end + length
+            header = io.BytesIO(prefix + fh.read(offset - len(prefix)))
+        npy_format.read_magic(header)
+        shape, fortran_order, dtype = read_header(header)
+        if dtype.hasobject:
+            raise ValueError("{} holds Python objects".format(path))
+        return self.read_array(
+            path, dtype, shape, offset=offset, order="F" if fortran_order else "C"
+        )
+
+    @_timed("write_npy", _result_size)
+    def write_npy(self, path, array, connections=1):
+        """Write a numpy array as a .npy file, see write_array
+        :param path: path to the .npy file on the sftp end
+        :param array: numpy array
+        :param connections: number of sessions that write byte ranges
+        of the file in parallel
+        :return: the number of bytes written
+        """
+        import numpy as np
+        from numpy.lib import format as npy_format
+
+        array = np.asanyarray(array)
+        if array.dtype.hasobject:
+            raise ValueError("arrays of Python objects can't be written")
+        data = _array_bytes(array)
+        header = io.BytesIO()
+        header_data = npy_format.header_data_from_array_1_0(array)
+        try:
+            npy_format.write_array_header_1_0(header, header_data)
+        except ValueError:
+            # Too many dimensions or fields for a version 1.0 header
+            header = io.BytesIO()
+            npy_format.write_array_header_2_0(header, header_data)
+        return self._write_buffer(
+            path, data, header=header.getvalue(), connections=connections
+        )
+
+    @_timed("read_files", _result_size)
+    def read_files(self, paths, connections=4):
+        """Read many whole files at once, e.g. the chunks of an array
+        The files are spread over up to connections sessions, the first is
+        this store's and the others are borrowed from the pool if the store
+        has one, otherwise the store keeps them open for the next call.
+        :param paths: list of paths to files on the sftp end
+        :param connections: maximum number of sessions that read at once
+        :return: list of the bytes of each path, None where a file doesn't exist
+        """
+
+        def read(client, path):
+            try:
+                fh = client.open(
+                    six.text_type(path), LIBSSH2_FXF_READ, LIBSSH2_SFTP_S_IRUSR
+                )
+            except SFTPProtocolError:
+                if client.last_error() != LIBSSH2_FX_NO_SUCH_FILE:
+                    raise
+                return None
+            with SFTPFileHandle(fh, path, "rb") as handle:
+                return handle.read_binary()
+
+        return self._map_items(read, paths, connections)
+
+    @_timed("write_files", _result_size)
+    def write_files(self, items, connections=4):
+        """Write many whole files at once, see read_files
+        The parent directories must exist.
+        :param items: list of (path, data) tuples, data is a bytes-like object
+        :param connections: maximum number of sessions that write at once
+        :return: list of the number of bytes written per item
+        """
+        flags = LIBSSH2_FXF_CREAT | LIBSSH2_FXF_WRITE | LIBSSH2_FXF_TRUNC
+
+        def write(client, item):
+            path, data = item
+            fh = client.open(six.text_type(path), flags, self._file_mode)
+            with SFTPFileHandle(fh, path, "wb") as handle:
+                return handle._write_pipelined(_byte_view(data))
+
+        try:
+            return self._map_items(write, items, connections)
+        finally:
+            for path, _ in items:
+                self._invalidate(path)
+
+    def _map_items(self, func, items, connections):
+        """Call func(client, item) for every item over up to connections
+        sessions, each session takes the next item once it is done with one.
+        The sessions beyond the store's own are borrowed from _worker_pool.
+        :param func: callable to run for each item
+        :param items: list of items
+        :param connections: maximum number of sessions
+        :return: list of the func results in items order
+        """
+        results = [None] * len(items)
+        pending = deque(range(len(items)))
+        pool = self._worker_pool()
+
+        def drain(client):
+            while True:
+                try:
+                    index = pending.popleft()
+                except IndexError:
+                    return
+                try:
+                    results[index] = func(client, items[index])
+                except BaseException:
+                    # Stop the other sessions as well
+                    pending.clear()
+                    raise
+
+        def run(index):
+            if index == 0:
+                return drain(self._client)
+            connection = self._acquire(pool)
+            try:
+                drain(connection.sftp)
+            except BaseException:
+                self._release(connection, discard=True, pool=pool)
+                raise
+            self._release(connection, pool=pool)
+
+        _run_parallel(run, [(index,) for index in range(min(connections, len(items)))])
+        return results
+
+    def _read_requests(self, path, requests):
+        """Read (offset, view) requests concurrently over several sftp channels
+        libssh2 keeps the state of an in progress sftp operation per channel,
+        so each channel reads one request at a time, while the session is
+        driven in non-blocking mode across them. The channels and the file
+        handles on them are kept for the next call.
+        :param path: path to the file on the sftp end
+        :param requests: list of (offset, view) tuples
+        :return: list of the number of bytes read into each view
+        """
+        self._check_process()
+        shared = self._shared
+        if shared is None:
+            channels = self._readv_sftp
+            sftp = self._sftp
+            # Only this thread uses the session
+            lock = threading.Lock()
+        else:
+            # The calling thread's channels, the session stays non-blocking
+            lease = shared.lease()
+            channels = lease.readv
+            sftp = lease.sftp
+            lock = shared.lock
+        if not channels:
+            # The store's own channel reads while the others are opened
+            channels.append(_ReadvChannel(sftp))
+        path = six.text_type(path)
+        epoch = self._readv_epoch
+        filled = [0] * len(requests)
+        pending = deque(range(len(requests)))
+        request_size = SFTPFileHandle.chunk_size * SFTPFileHandle.window
+        count = min(len(requests), self.readv_channels)
+        if self._readv_limit is not None:
+            count = min(count, self._readv_limit)
+        workers = [_RequestWorker() for _ in range(count)]
+        for worker, channel in zip(workers, channels):
+            worker.channel = channel
+        session = self._connection.session
+        wait = self._wait_socket if shared is None else shared.wait
+
+        def attempt(func, *args):
+            # libssh2 sends a single packet at a time, a call that leaves
+            # a packet partly sent is repeated before another channel is used
+            while True:
+                result = func(*args)
+                if not _is_eagain(result):
+                    return result
+                if not session.block_directions() & LIBSSH2_SESSION_BLOCK_OUTBOUND:
+                    return result
+                wait()
+
+        def step(worker):
+            # Make the worker's next call, False if it has to be repeated
+            channel = worker.channel
+            if channel is None:
+                try:
+                    result = attempt(session.sftp_init)
+                except ChannelFailure:
+                    # The server doesn't open more channels on a session
+                    self._readv_limit = len(channels)
+                    worker.done = True
+                    return True
+                if _is_eagain(result):
+                    return False
+                worker.channel = _ReadvChannel(result)
+                channels.append(worker.channel)
+            elif channel.fh is not None and (channel.path, channel.epoch) != (
+                path,
+                epoch,
+            ):
+                # Open on another file, or on one that has changed since
+                if _is_eagain(attempt(channel.fh.close)):
+                    return False
+                channel.fh = None
+            elif channel.fh is None:
+                result = attempt(channel.sftp.open, path, *self._open_args("rb"))
+                if _is_eagain(result):
+                    return False
+                channel.fh, channel.path, channel.epoch = result, path, epoch
+            elif worker.request is None:
+                worker.request = pending.popleft()
+                channel.fh.seek64(requests[worker.request][0])
+            else:
+                index = worker.request
+                offset = filled[index]
+                rest = requests[index][1][offset:]
+                size, chunk = attempt(channel.fh.read, min(len(rest), request_size))
+                if size == LIBSSH2_ERROR_EAGAIN:
+                    return False
+                if size > 0:
+                    rest[:size] = chunk
+                    filled[index] += size
+                if size <= 0 or size == len(rest):
+                    # Done or EOF
+                    worker.request = None
+            return True
+
+        def drive(finishing=False):
+            # Most requests that were in flight at once
+            depth = 0
+            while not all(worker.done for worker in workers):
+                progress = False
+                # Channels are opened one at a time, libssh2 keeps the
+                # state of a channel open per session
+                opening = any(
+                    worker.busy and worker.channel is None for worker in workers
+                )
+                opened = sum(worker.channel is not None for worker in workers)
+                with lock:
+                    for worker in workers:
+                        if worker.done:
+                            continue
+                        if not worker.busy and (
+                            finishing or (worker.request is None and not pending)
+                        ):
+                            # The other workers have taken the remaining requests
+                            worker.done = progress = True
+                            continue
+                        if worker.channel is None and not worker.busy:
+                            # Another channel takes a few round trips to open,
+                            # the open ones may take the remaining requests first
+                            if opening or len(pending) <= opened:
+                                continue
+                            opening = True
+                        try:
+                            worker.busy = not step(worker)
+                        except Exception:
+                            if not finishing:
+                                raise
+                            worker.busy = False
+                        progress = progress or not worker.busy
+                if self._stats is not None:
+                    active = sum(worker.request is not None for worker in workers)
+                    depth = max(depth, active)
+                if not progress:
+                    wait()
+            return depth
+
+        if shared is None:
+            session.set_blocking(False)
+        try:
+            depth = drive()
+        except BaseException:
+            # Finish the calls that are halfway, libssh2 would resume them
+            # on the next call over the same channel
+            pending.clear()
+            try:
+                drive(finishing=True)
+            except BaseException:
+                del channels[:]
+            raise
+        finally:
+            if shared is None:
+                session.set_blocking(True)
+        if self._stats is not None:
+            self._stats.record_depth("readv", depth)
+        return filled
+
+    def _wait_socket(self):
+        """Wait until the session's socket is ready in the direction that
+        libssh2 is blocked on
+        :return: None
+        """
+        directions = self._connection.session.block_directions()
+        sock = self._connection.sock
+        readers = [sock] if directions & LIBSSH2_SESSION_BLOCK_INBOUND else []
+        writers = [sock] if directions & LIBSSH2_SESSION_BLOCK_OUTBOUND else []
+        if readers or writers:
+            select.select(readers, writers, [])
+
+    @_timed("download", _result_size)
+    def download(self, path, dest, connections=1):
+        """
+        :param path: path to the file on the sftp end
+        :param dest: local file path or a writable bytes-like object,
+        e.g. a bytearray, memoryview or a contiguous numpy array
+        :param connections: number of sessions that fetch byte ranges
+        of the file in parallel, the first range reuses this store's session
+        :return: the number of bytes downloaded
+        """
+        size = self._client.stat(six.text_type(path)).filesize
+        ranges = _split_ranges(size, connections, self.min_range_size)
+        if isinstance(dest, six.string_types):
+            with open(dest, "wb") as dest_file:
+                dest_file.truncate(size)
+            fetch = self._fetch_range_to_file
+        else:
+            dest = _byte_view(dest)
+            if len(dest) < size:
+                raise ValueError(
+                    "buffer of {} bytes is too small for {} bytes".format(
+                        len(dest), size
+                    )
+                )
+            fetch = self._fetch_range_to_buffer
+
+        return sum(
+            self._map_ranges(
+                lambda client, offset, length: fetch(
+                    client, path, offset, length, dest
+                ),
+                ranges,
+            )
+        )
+
+    @_timed("upload", _result_size)
+    def upload(self, src, path, connections=1):
+        """
+        :param src: local file path or a bytes-like object,
+        e.g. bytes, a bytearray, memoryview or a contiguous numpy array
+        :param path: path to the file on the sftp end, it is truncated first
+        :param connections: number of sessions that write byte ranges
+        of the file in parallel, the first range reuses this store's session
+        :return: the number of bytes uploaded
+        """
+        if isinstance(src, six.string_types):
+            return self._write_buffer(path, src, connections=connections)
+        return self._write_buffer(path, _byte_view(src), connections=connections)
+
+    def _write_buffer(self, path, src, header=b"", connections=1):
+        """Create or truncate a file and write header followed by src
+        :param path: path to the file on the sftp end
+        :param src: local file path or a flat byte memoryview
+        :param header: bytes written ahead of src
+        :param connections: number of sessions that write byte ranges
+        of src in parallel
+        :return: the number of bytes written
+        """
+        if isinstance(src, six.string_types):
+            size = os.path.getsize(src)
+            send = self._send_range_from_file
+        else:
+            size = len(src)
+            send = self._send_range_from_buffer
+        # Create or truncate the file before the ranges are written into it
+        fh = self._client.open(
+            six.text_type(path),
+            LIBSSH2_FXF_CREAT | LIBSSH2_FXF_WRITE | LIBSSH2_FXF_TRUNC,
+            self._file_mode,
+        )
+        with SFTPFileHandle(fh, path, "wb") as handle:
+            if header:
+                handle._write_pipelined(_byte_view(header))
+        ranges = _split_ranges(size, connections, self.min_range_size)
+        try:
+            return len(header) + sum(
+                self._map_ranges(
+                    lambda client, offset, length: send(
+                        client, path, offset, length, src, len(header)
+                    ),
+                    ranges,
+                )
+            )
+        finally:
+            self._invalidate(path)
+
+    def _map_ranges(self, func, ranges):
+        """Call func(client, offset, length) for every range in parallel
+        The first range is handled over this store's session,
+        each of the others over a session of its own from _worker_pool.
+        :param func: callable to run for each range
+        :param ranges: list of (offset, length) tuples
+        :return: list of the func results in range order
+        """
+        pool = self._worker_pool() if len(ranges) > 1 else None
+
+        def run(index, offset, length):
+            if index == 0:
+                return func(self._client, offset, length)
+            connection = self._acquire(pool)
+            try:
+                result = func(connection.sftp, offset, length)
+            except BaseException:
+                self._release(connection, discard=True, pool=pool)
+                raise
+            self._release(connection, pool=pool)
+            return result
+
+        return _run_parallel(
+            run,
+            [(index, offset, length) for index, (offset, length) in enumerate(ranges)],
+        )
+
+    @staticmethod
+    def _fetch_range_to_buffer(client, path, offset, length, buffer):
+        fh = client.open(six.text_type(path), LIBSSH2_FXF_READ, LIBSSH2_SFTP_S_IRUSR)
+        with SFTPFileHandle(fh, path, "rb") as handle:
+            handle.seek(offset)
+            end = offset + length
+            return handle.readinto(buffer[offset:end])
+
+    @staticmethod
+    def _fetch_range_to_file(client, path, offset, length, dest):
+        fh = client.open(six.text_type(path), LIBSSH2_FXF_READ, LIBSSH2_SFTP_S_IRUSR)
+        fetched = 0
+        with SFTPFileHandle(fh, path, "rb") as handle, open(dest, "r+b") as dest_file:
+            handle.seek(offset)
+            dest_file.seek(offset)
+            for chunk in handle._read_pipelined(length):
+                dest_file.write(chunk)
+                fetched += len(chunk)
+        return fetched
+
+    @staticmethod
+    def _send_range_from_buffer(client, path, offset, length, buffer, base=0):
+        fh = client.open(six.text_type(path), LIBSSH2_FXF_WRITE, LIBSSH2_SFTP_S_IWUSR)
+        with SFTPFileHandle(fh, path, "wb") as handle:
+            handle.seek(base + offset)
+            end = offset + length
+            return handle._write_pipelined(buffer[offset:end])
+
+    @staticmethod
+    def _send_range_from_file(client, path, offset, length, src, base=0):
+        fh = client.open(six.text_type(path), LIBSSH2_FXF_WRITE, LIBSSH2_SFTP_S_IWUSR)
+        sent = 0
+        with SFTPFileHandle(fh, path, "wb") as handle, open(src, "rb") as src_file:
+            handle.seek(base + offset)
+            src_file.seek(offset)
+            request_size = handle.chunk_size * handle.window
+            while sent < length:
+                chunk = src_file.read(min(request_size, length - sent))
+                if not chunk:
+                    break
+                handle.fh.write(chunk)
+                sent += len(chunk)
+        return sent
+
+    def close(self):
+        self._client = None
+        if self._connection is not None:
+            if self._pid == os.getpid():
+                if self._shared is not None:
+                    self._shared.close()
+                # The kept file handles and channels are closed before the
+                # session goes back to a pool
+                self._readv_sftp = []
+                self._release(self._connection)
+            else:
+                # Inherited through fork, the session belongs to the parent
+                _abandon(self._connection, self._shared, *self._readv_sftp)
+            self._connection = None
+        self._readv_sftp = []
+        if self._workers is not None:
+            self._workers.close()
+            self._workers = None
+
+
+class _ReadvChannel:
+    __slots__ = ("sftp", "fh", "path", "epoch", "pid")
+
+    def __init__(self, sftp):
+        # An sftp channel that SFTPStore.readv reads over, and the file
+        # handle that is kept open on it between calls
+        self.sftp = sftp
+        self.fh = None
+        self.path = None
+        # SFTPStore._readv_epoch at the time that the file was opened
+        self.epoch = None
+        self.pid = os.getpid()
+
+    def __del__(self):
+        if self.pid != os.getpid():
+            # Collected in a forked process, closing the handle would wait
+            # for a reply on the parent's session
+            _inherited.append((self.sftp, self.fh))
+
+
+class _RequestWorker:
+    __slots__ = ("channel", "request", "busy", "done")
+
+    def __init__(self):
+        # State of a channel while SFTPStore._read_requests drives it
+        self.channel = None
+        self.request = None
+        # Set while a call that returned EAGAIN has to be repeated
+        self.busy = False
+        self.done = False
+
+
+class ERDASftpShare(SFTPStore):
+    def __init__(self, username=None, password=None, **kwargs):
+        super(ERDASftpShare, self).__init__(ERDA.url, username, password, **kwargs)
+
+
+class ERDAShare(ERDASftpShare):
+    def __init__(self, share_link, **kwargs):
+        """
+        :param share_link:
+        This is the sharelink ID that is used to access the datastore,
+        an overview over your sharelinks can be found at
+        https://erda.dk/wsgi-bin/sharelink.py.
+        :param kwargs:
+        passed on to SFTPStore, e.g. pool=True to borrow sessions
+        from the shared SharePool of the sharelink
+        """
+        super(ERDAShare, self).__init__(share_link, share_link, **kwargs)
+
+
+class IDMCSftpShare(SFTPStore):
+    def __init__(self, username=None, password=None, **kwargs):
+        super(IDMCSftpShare, self).__init__(IDMC.url, username, password, **kwargs)
+
+
+class IDMCShare(IDMCSftpShare):
+    def __init__(self, share_link, **kwargs):
+        super(IDMCShare, self).__init__(share_link, share_link, **kwargs)
@@ -0,0 +1,359 @@
+import fs
+import io
+import six
+from fs.errors import ResourceNotFound
+from fs.iotools import make_stream
+from ._io import ERDA, IDMC, DataStore, DirEntry, _byte_view, _restore_store
+from ._stats import _arg_size, _clock, _result_size, _timed
+
+
+class SSHFSStore(DataStore):
+    def __init__(
+        self,
+        host=None,
+        username=None,
+        password=None,
+        cache=None,
+        metadata=None,
+        stats=None,
+    ):
+        """
+        :param host: host part of the ssh url, e.g. "@io.erda.dk/"
+        :param username: username to authenticate with
+        :param password: password to authenticate with
+        :param cache: optional BlockCache that reads are served through,
+        those of read_binary, readinto and files opened for reading only
+        :param metadata: optional MetadataCache that exists and list results
+        are served from
+        :param stats: optional TransferStats that the operations
+        and the connection setup are recorded in
+        """
+        assert host is not None
+        assert username is not None
+        assert password is not None
+        start = _clock()
+        client = fs.open_fs("ssh://" + username + ":" + password + host)
+        if stats is not None:
+            stats.record("connect", _clock() - start)
+        super(SSHFSStore, self).__init__(client)
+        self._stats = stats
+        self._host = host
+        self._username = username
+        self._password = password
+        self._share = username + host
+        self._cache = cache
+        self._metadata = metadata
+
+    def __reduce__(self):
+        # Pickled as its connection parameters, the receiving process
+        # connects on its own
+        kwargs = dict(
+            host=self._host,
+            username=self._username,
+            password=self._password,
+            cache=self._cache,
+            metadata=self._metadata,
+            stats=self._stats,
+        )
+        return _restore_store, (self.__class__, SSHFSStore, kwargs)
+
+    def geturl(self, path):
+        return self._client.geturl(path)
+
+    @_timed("open")
+    def open(self, path, flag="r"):
+        """
+        Used to get a python filehandler object
+        :param path:
+        the name of the file to be opened
+        :param flag:
+        which mode should the file be opened in
+        :return:
+        a _io.TextIOWrapper object with utf-8 encoding
+        """
+        if "r" not in flag or "+" in flag:
+            self._invalidate(path)
+        elif self._cache is not None:
+            open_file = self._client.openbin(six.text_type(path))
+            key, size = self._cache_key(path)
+            reader = _CachedReader(open_file, self._cache, key, size)
+            return make_stream(path, reader, mode=flag)
+        return self._client.open(six.text_type(path), flag)
+
+    @_timed("exists")
+    def exists(self, path):
+        """
+        :param path: the path we are checking whether it exists
+        :return: Boolean
+        """
+        if self._metadata is not None:
+            cached = self._metadata.exists(path)
+            if cached is not self._metadata.MISSING:
+                return cached
+        exists = self._client.exists(six.text_type(path))
+        if self._metadata is not None:
+            self._metadata.set("stat", path, True if exists else None)
+        return exists
+
+    @_timed("list")
+    def list(self, path="."):
+        """
+        :param path:
+        file system path which items will be returned
+        :return:
+        A list of items in the path.
+        There is no distinction between files and dirs
+        """
+        if self._metadata is not None:
+            cached = self._metadata.get("list", path)
+            if cached is not self._metadata.MISSING:
+                return list(cached)
+        names = self._client._sftp.listdir(six.text_type(path))
+        if self._metadata is not None:
+            self._metadata.set("list", path, tuple(names))
+        return names
+
+    @_timed("read", _result_size)
+    def read(self, path):
+        """
+        :param file:
+        File to be read
+        :return:
+        a string of the content within file
+        """
+        with self._client.open(six.text_type(path)) as open_file:
+            return open_file.read()
+
+    @_timed("write", _arg_size(1))
+    def write(self, path, data, flag="a"):
+        """
+        :param path:
+        path to the file being written
+        :param data: data to being written
+        :param flag: write flag, defaults to append
+        :return:
+        """
+        with self.open(six.text_type(path), flag) as fh:
+            fh.write(data)
+
+    @_timed("mkdir")
+    def mkdir(self, path, mode=755):
+        """
+        :param path: path to the directory that should be created
+        """
+        self._invalidate(path)
+        self._client._sftp.mkdir(six.text_type(path), mode)
+
+    @_timed("remove")
+    def remove(self, path):
+        """
+        :param path:
+        path to the file that should be removed
+        :return:
+        Bool, whether a file was removed or not
+        """
+        self._invalidate(path)
+        try:
+            self._client.remove(six.text_type(path))
+            return True
+        except ResourceNotFound:
+            return False
+
+    @_timed("utime")
+    def utime(self, path, times):
+        """
+        :param path: path to the file that should be changed
+        :param times: tuple of the access and modification time,
+        in seconds since the epoch
+        :return: None
+        """
+        self._invalidate(path)
+        self._client._sftp.utime(six.text_type(path), times)
+
+    @_timed("list_attr")
+    def list_attr(self, path="."):
+        """
+        :param path:
+        directory path to be listed
+        :return:
+        A list of DirEntry objects, as SFTPStore.list_attr
+        """
+        return list(self.iterdir(path))
+
+    def _clone(self):
+        return SSHFSStore(
+            self._host,
+            self._username,
+            self._password,
+            cache=self._cache,
+            metadata=self._metadata,
+            stats=self._stats,
+        )
+
+    def iterdir(self, path="."):
+        """
+        :param path: directory path to be listed
+        :return: generator of DirEntry objects,
+        yielded as the listing arrives from the server
+        """
+        for attrs in self._client._sftp.listdir_iter(six.text_type(path)):
+            yield DirEntry(attrs.filename, attrs.st_size, attrs.st_mtime, attrs.st_mode)
+
+    @_timed("read_binary", _result_size)
+    def read_binary(self, path):
+        """
+        :param path:
+        File to be read
+        :return:
+        bytes of the content within file, readinto reads it into
+        the caller's buffer instead, without copying it into bytes
+        """
+        with self._client.openbin(six.text_type(path)) as open_file:
+            if self._cache is None:
+                return open_file.read()
+            key, size = self._cache_key(path)
+            data = bytearray(size)
+            filled = _CachedReader(open_file, self._cache, key, size).readinto(data)
+        del data[filled:]
+        return bytes(data)
+
+    @_timed("readinto", _result_size)
+    def readinto(self, path, buffer):
+        """
+        :param path:
+        File to be read
+        :param buffer:
+        writable bytes-like object that the content is read into,
+        e.g. a bytearray, memoryview or a contiguous numpy array
+        :return:
+        the number of bytes read
+        """
+        view = _byte_view(buffer)
+        with self._client.openbin(six.text_type(path)) as open_file:
+            if self._cache is None:
+                return _fill(open_file, view)
+            key, size = self._cache_key(path)
+            reader = _CachedReader(open_file, self._cache, key, size)
+            return reader.readinto(view)
+
+    def _cache_key(self, path):
+        """
+        :param path: path to a file
+        :return: tuple of the cache key and the size of the file
+        """
+        info = self._client.getinfo(six.text_type(path), namespaces=["details"])
+        return self._cache.key(self._share, path, info.size, info.modified), info.size
+
+    @_timed("rmdir")
+    def rmdir(self, path):
+        """
+        :param path:
+        path the dir that should be removed
+        :return:
+        Bool, whether a dir was removed or not
+        """
+        self._invalidate(path, recursive=True)
+        try:
+            self._client._sftp.rmdir(six.text_type(path))
+            return True
+        except ResourceNotFound:
+            return False
+
+    def close(self):
+        self._client.close()
+
+
+def _fill(open_file, view):
+    filled = 0
+    while filled < len(view):
+        size = open_file.readinto(view[filled:])
+        if not size:
+            break
+        filled += size
+    return filled
+
+
+class _CachedReader(io.RawIOBase):
+    def __init__(self, open_file, cache, key, size):
+        """
+        Unbuffered reader of a file that serves its content through
+        a BlockCache, the file itself is only read for missing blocks
+        :param open_file: binary file object of the file, it is closed
+        along with the reader
+        :param cache: BlockCache
+        :param key: cache key of the file
+        :param size: size of the file in bytes
+        """
+        super(_CachedReader, self).__init__()
+        self._file = open_file
+        self._cache = cache
+        self._key = key
+        self._size = size
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        filled = self._cache.readinto(
+            self._key, self._size, self._offset, buffer, self._fetch
+        )
+        self._offset += filled
+        return filled
+
+    def _fetch(self, offset, view):
+        self._file.seek(offset)
+        return _fill(self._file, view)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._offset
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._offset = offset
+        return offset
+
+    def tell(self):
+        return self._offset
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super(_CachedReader, self).close()
+
+
+# TODO -> cleanup duplication
+class ERDASSHFSShare(SSHFSStore):
+    def __init__(self, share_link, **kwargs):
+        """
+        :param share_link:
+        This is the sharelink ID that is used to access the datastore,
+        an overview over your sharelinks can be found at
+        https://erda.dk/wsgi-bin/sharelink.py.
+        :param kwargs:
+        passed on to SSHFSStore, e.g. cache, metadata or stats
+        """
+        host = "@" + ERDA.url + "/"
+        super(ERDASSHFSShare, self).__init__(
+            host=host, username=share_link, password=share_link, **kwargs
+        )
+
+
+# TODO -> cleanup duplication
+class IDMCSSHFSShare(SSHFSStore):
+    def __init__(self, share_link, **kwargs):
+        """
+        :param share_link:
+        This is the sharelink ID that is used to access the datastore,
+        an overview over your sharelinks can be found at,
+        https://erda.dk/wsgi-bin/sharelink.py.
+        :param kwargs:
+        passed on to SSHFSStore, e.g. cache, metadata or stats
+        """
+        host = "@" + IDMC.url + "/"
+        super(IDMCSSHFSShare, self).__init__(
+            host=host, username=share_link, password=share_link, **kwargs
+        )
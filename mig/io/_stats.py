@@ -0,0 +1,370 @@
+import bisect
+import functools
+import os
+import six
+import tempfile
+import threading
+import time
+
+# Monotonic clock that operations are timed with
+_clock = getattr(time, "perf_counter", time.time)
+
+# Upper bounds in seconds of the latency histogram buckets,
+# from a local cache hit to a transfer over a slow link
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _size_of(value):
+    """
+    :param value: result of an operation, e.g. a bytearray, a numpy array,
+    a number of bytes or a list of them
+    :return: the number of bytes that value holds or stands for
+    """
+    if value is None or isinstance(value, bool):
+        return 0
+    if isinstance(value, six.integer_types):
+        return value
+    if isinstance(value, (list, tuple)):
+        return sum(_size_of(item) for item in value)
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        # memoryviews and numpy arrays
+        return nbytes
+    if isinstance(value, (bytes, bytearray, six.text_type)):
+        return len(value)
+    return 0
+
+
+def _result_size(result, args):
+    return _size_of(result)
+
+
+def _arg_size(index):
+    """
+    :param index: position of the argument that holds the data
+    :return: size(result, args) that gives the size of the argument
+    """
+    return lambda result, args: _size_of(args[index]) if len(args) > index else 0
+
+
+def _timed(op, size=None):
+    """Record the calls of a store or handle method in the TransferStats
+    of the instance, if it has any
+    :param op: name of the operation
+    :param size: optional size(result, args) that gives the number of bytes
+    the call transferred, e.g. _result_size, calls transfer none by default
+    :return: decorator
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def timed(self, *args, **kwargs):
+            stats = self._stats
+            if stats is None:
+                return func(self, *args, **kwargs)
+            return stats._call(op, size, func, self, args, kwargs)
+
+        return timed
+
+    return decorate
+
+
+class _OperationStats:
+    __slots__ = ("count", "errors", "bytes", "seconds", "buckets")
+
+    def __init__(self, size):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        # Calls per histogram bucket, the last bucket is unbounded
+        self.buckets = [0] * (size + 1)
+
+
+class _DepthStats:
+    __slots__ = ("samples", "total", "max")
+
+    def __init__(self):
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+
+
+class TransferStats:
+    def __init__(self, buckets=DEFAULT_BUCKETS, sinks=None):
+        """
+        Counts, bytes and latency histograms of the operations of the stores
+        and file handles that it is passed to, e.g. SFTPStore(stats=stats).
+        Operations nest, e.g. read_npy is recorded together with the
+        open, file.read and readv calls that it is made of. The setup of
+        each new session is recorded per phase, as connect.handshake etc.
+        Stores without stats only pay a single attribute check per call.
+        :param buckets: ascending upper bounds in seconds of the latency
+        histogram buckets
+        :param sinks: optional list of callables, see add_sink
+        """
+        self.bounds = tuple(buckets)
+        self._sinks = list(sinks or [])
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def __getstate__(self):
+        # The receiving process starts out with empty stats, and without
+        # the sinks, which are often local functions
+        return {"buckets": self.bounds}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def reset(self):
+        """
+        Forget everything that was recorded
+        :return: None
+        """
+        with self._lock:
+            self._operations = {}
+            self._depths = {}
+            self._in_flight = 0
+            self._max_in_flight = 0
+
+    def add_sink(self, sink):
+        """Pass every recorded call on to sink as well
+        :param sink: callable sink(op, seconds, nbytes, error), it is called
+        from the thread that made the call
+        :return: None
+        """
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self._sinks.remove(sink)
+
+    def record(self, op, seconds, nbytes=0, error=False):
+        """
+        :param op: name of the operation
+        :param seconds: duration of the call
+        :param nbytes: number of bytes that the call transferred
+        :param error: whether the call raised
+        :return: None
+        """
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            stats = self._operations.get(op)
+            if stats is None:
+                stats = self._operations[op] = _OperationStats(len(self.bounds))
+            stats.count += 1
+            stats.bytes += nbytes
+            stats.seconds += seconds
+            stats.buckets[index] += 1
+            if error:
+                stats.errors += 1
+        for sink in self._sinks:
+            sink(op, seconds, nbytes, error)
+
+    def record_depth(self, op, depth):
+        """
+        :param op: name of the operation, e.g. "readv"
+        :param depth: number of requests that the operation had in flight
+        :return: None
+        """
+        with self._lock:
+            stats = self._depths.get(op)
+            if stats is None:
+                stats = self._depths[op] = _DepthStats()
+            stats.samples += 1
+            stats.total += depth
+            stats.max = max(stats.max, depth)
+
+    def _call(self, op, size, func, instance, args, kwargs):
+        # Only the outermost call of a thread counts as in flight
+        level = getattr(self._local, "level", 0)
+        self._local.level = level + 1
+        if level == 0:
+            with self._lock:
+                self._in_flight += 1
+                self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        start = _clock()
+        try:
+            result = func(instance, *args, **kwargs)
+        except BaseException:
+            self.record(op, _clock() - start, error=True)
+            raise
+        else:
+            seconds = _clock() - start
+            nbytes = 0 if size is None else size(result, args)
+            self.record(op, seconds, nbytes)
+            return result
+        finally:
+            self._local.level = level
+            if level == 0:
+                with self._lock:
+                    self._in_flight -= 1
+
+    @staticmethod
+    def _quantile(bounds, buckets, count, q):
+        """Estimate a quantile from a histogram by interpolating within
+        the bucket that it falls in, as Prometheus' histogram_quantile
+        :return: seconds, or None without calls
+        """
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for index, calls in enumerate(buckets):
+            if seen + calls >= rank and calls:
+                if index == len(bounds):
+                    # Beyond the last bound
+                    return bounds[-1]
+                lower = bounds[index - 1] if index else 0.0
+                return lower + (bounds[index] - lower) * (rank - seen) / calls
+            seen += calls
+        return bounds[-1]
+
+    def snapshot(self):
+        """
+        :return: dict with the recorded "operations", each a dict of count,
+        errors, bytes, seconds, p50, p99 and the histogram "buckets" as
+        (upper bound, calls) pairs, the request "depths" per operation,
+        and the current and peak number of calls "in_flight"
+        """
+        with self._lock:
+            operations = {}
+            for op, stats in self._operations.items():
+                operations[op] = {
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "bytes": stats.bytes,
+                    "seconds": stats.seconds,
+                    "p50": self._quantile(self.bounds, stats.buckets, stats.count, 0.5),
+                    "p99": self._quantile(
+                        self.bounds, stats.buckets, stats.count, 0.99
+                    ),
+                    "buckets": list(zip(self.bounds + (float("inf"),), stats.buckets)),
+                }
+            depths = {
+                op: {
+                    "samples": stats.samples,
+                    "mean": float(stats.total) / stats.samples,
+                    "max": stats.max,
+                }
+                for op, stats in self._depths.items()
+            }
+            return {
+                "operations": operations,
+                "depths": depths,
+                "in_flight": self._in_flight,
+                "max_in_flight": self._max_in_flight,
+            }
+
+    def prometheus_text(self, prefix="mig_io"):
+        """
+        :param prefix: prefix of the metric names
+        :return: str of the stats in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            name = "{}_{}".format(prefix, name)
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for suffix, labels, value in samples:
+                label_text = ",".join(
+                    '{}="{}"'.format(key, label) for key, label in labels
+                )
+                lines.append(
+                    "{}{}{{{}}} {}".format(name, suffix, label_text, repr(value))
+                    if label_text
+                    else "{}{} {}".format(name, suffix, repr(value))
+                )
+
+        operations = sorted(snapshot["operations"].items())
+        metric(
+            "operations_total",
+            "counter",
+            "Calls per operation.",
+            [("", [("op", op)], stats["count"]) for op, stats in operations],
+        )
+        metric(
+            "errors_total",
+            "counter",
+            "Calls per operation that raised.",
+            [("", [("op", op)], stats["errors"]) for op, stats in operations],
+        )
+        metric(
+            "bytes_total",
+            "counter",
+            "Bytes transferred per operation.",
+            [("", [("op", op)], stats["bytes"]) for op, stats in operations],
+        )
+        durations = []
+        for op, stats in operations:
+            calls = 0
+            for bound, count in stats["buckets"]:
+                calls += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                durations.append(("_bucket", [("op", op), ("le", le)], calls))
+            durations.append(("_sum", [("op", op)], stats["seconds"]))
+            durations.append(("_count", [("op", op)], stats["count"]))
+        metric(
+            "duration_seconds",
+            "histogram",
+            "Duration of the calls per operation.",
+            durations,
+        )
+        depths = sorted(snapshot["depths"].items())
+        metric(
+            "request_depth_max",
+            "gauge",
+            "Most requests in flight at once per operation.",
+            [("", [("op", op)], stats["max"]) for op, stats in depths],
+        )
+        metric(
+            "in_flight",
+            "gauge",
+            "Calls in progress.",
+            [("", [], snapshot["in_flight"])],
+        )
+        metric(
+            "in_flight_max",
+            "gauge",
+            "Most calls in progress at once.",
+            [("", [], snapshot["max_in_flight"])],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="mig_io"):
+        """Write prometheus_text to a file, e.g. for the textfile collector
+        of the node exporter, it is replaced atomically
+        :param path: path of the file
+        :param prefix: prefix of the metric names
+        :return: None
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                tmp_file.write(self.prometheus_text(prefix))
+            os.rename(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
@@ -0,0 +1,311 @@
+import hashlib
+import os
+import posixpath
+import shutil
+import threading
+from six.moves import queue
+from ._io import _join_path
+
+# Bytes read at a time when files are hashed or copied through handles
+_COPY_SIZE = 2 * 1024 * 1024
+
+
+class SyncResult:
+    def __init__(self, dry_run=False):
+        """
+        The outcome of a sync, paths are relative to the synced directories
+        :param dry_run: whether the changes were only planned
+        """
+        self.dry_run = dry_run
+        # Files that were, or in a dry run would be, copied
+        self.copied = []
+        # Files and directories that were, or would be, deleted
+        self.deleted = []
+        # Number of files that were already up to date
+        self.unchanged = 0
+
+    def __repr__(self):
+        return "SyncResult(copied={}, deleted={}, unchanged={}, dry_run={})".format(
+            len(self.copied), len(self.deleted), self.unchanged, self.dry_run
+        )
+
+
+class _LocalTree:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, rel):
+        return os.path.join(self.root, *rel.split("/")) if rel else self.root
+
+    def scan(self):
+        """
+        :return: tuple of a dict of relative file path -> (size, mtime)
+        and a set of the relative directory paths
+        """
+        files, dirs = {}, set()
+        if not os.path.isdir(self.root):
+            return files, dirs
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            rel_dir = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            rel_dir = "" if rel_dir == "." else rel_dir
+            for name in dirnames:
+                dirs.add(_join_path(rel_dir, name))
+            for name in filenames:
+                info = os.stat(os.path.join(dirpath, name))
+                files[_join_path(rel_dir, name)] = (info.st_size, int(info.st_mtime))
+        return files, dirs
+
+    def digest(self, store, rel):
+        digest = hashlib.sha1()
+        with open(self.path(rel), "rb") as local_file:
+            for chunk in iter(lambda: local_file.read(_COPY_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def makedirs(self, rel):
+        if not os.path.isdir(self.path(rel)):
+            os.makedirs(self.path(rel))
+
+    def remove(self, rel):
+        os.remove(self.path(rel))
+
+    def rmdir(self, rel):
+        os.rmdir(self.path(rel))
+
+
+class _ShareTree:
+    def __init__(self, store, root, workers):
+        self.store = store
+        self.root = root
+        self.workers = workers
+
+    def path(self, rel):
+        return _join_path(self.root, rel) if rel else self.root
+
+    def scan(self):
+        files, dirs = {}, set()
+        if not self.store.exists(self.root):
+            return files, dirs
+        prefix = len(self.root) + 1 if self.root not in ("", ".") else 0
+        for dirpath, dirnames, filenames in self.store.walk(
+            self.root, workers=self.workers, attrs=True
+        ):
+            rel_dir = dirpath[prefix:] if dirpath != self.root else ""
+            for entry in dirnames:
+                dirs.add(_join_path(rel_dir, entry.name))
+            for entry in filenames:
+                files[_join_path(rel_dir, entry.name)] = (entry.size, int(entry.mtime))
+        return files, dirs
+
+    def digest(self, store, rel):
+        digest = hashlib.sha1()
+        with store.open(self.path(rel), "rb") as remote_file:
+            while True:
+                chunk = remote_file.read(_COPY_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def makedirs(self, rel):
+        path = "/" if self.path(rel).startswith("/") else ""
+        for part in self.path(rel).split("/"):
+            if part in ("", "."):
+                continue
+            path = posixpath.join(path, part)
+            if not self.store.exists(path):
+                self.store.mkdir(path)
+
+    def remove(self, rel):
+        self.store.remove(self.path(rel))
+
+    def rmdir(self, rel):
+        self.store.rmdir(self.path(rel))
+
+
+def _upload(store, local_path, remote_path):
+    if hasattr(store, "upload"):
+        store.upload(local_path, remote_path)
+    else:
+        with open(local_path, "rb") as src, store.open(remote_path, "wb") as dest:
+            shutil.copyfileobj(src, dest, _COPY_SIZE)
+
+
+def _download(store, remote_path, local_path):
+    if hasattr(store, "download"):
+        store.download(remote_path, local_path)
+    else:
+        with store.open(remote_path, "rb") as src, open(local_path, "wb") as dest:
+            shutil.copyfileobj(src, dest, _COPY_SIZE)
+
+
+def _run_jobs(store, jobs, func, workers):
+    """Run func(store, job) for every job over worker threads,
+    each with its own clone of store
+    :return: None, the first error is raised once the workers are done
+    """
+    todo = queue.Queue()
+    for job in jobs:
+        todo.put(job)
+    errors = []
+
+    def work():
+        clone = None
+        try:
+            while not errors:
+                try:
+                    job = todo.get_nowait()
+                except queue.Empty:
+                    break
+                if clone is None:
+                    clone = store._clone()
+                func(clone, job)
+        except Exception as err:
+            errors.append(err)
+        finally:
+            if clone is not None:
+                clone.close()
+
+    threads = [threading.Thread(target=work) for _ in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _sync(source, dest, store, copy, delete, dry_run, checksum, workers):
+    """Copy the new and changed files of source to dest
+    :param source: _LocalTree or _ShareTree to copy from
+    :param dest: _LocalTree or _ShareTree to copy to
+    :param store: DataStore of the share side
+    :param copy: copy(store, source_path, dest_path) of a single file
+    :return: SyncResult
+    """
+    result = SyncResult(dry_run)
+    source_files, source_dirs = source.scan()
+    dest_files, dest_dirs = dest.scan()
+
+    changed, compare = [], []
+    for rel, (size, mtime) in sorted(source_files.items()):
+        if rel not in dest_files or dest_files[rel][0] != size:
+            changed.append(rel)
+        elif checksum:
+            compare.append(rel)
+        elif dest_files[rel][1] != mtime:
+            changed.append(rel)
+        else:
+            result.unchanged += 1
+
+    if compare:
+        lock = threading.Lock()
+
+        def verify(clone, rel):
+            same = source.digest(clone, rel) == dest.digest(clone, rel)
+            with lock:
+                if same:
+                    result.unchanged += 1
+                else:
+                    changed.append(rel)
+
+        _run_jobs(store, compare, verify, workers)
+        changed.sort()
+    result.copied = changed
+
+    if delete:
+        extra_files = sorted(set(dest_files) - set(source_files))
+        # Deepest directories first, so they are empty once they are removed
+        extra_dirs = sorted(dest_dirs - source_dirs, key=lambda rel: -rel.count("/"))
+        result.deleted = extra_files + extra_dirs
+    if dry_run:
+        return result
+
+    if changed:
+        dest.makedirs("")
+    for rel in sorted(source_dirs - dest_dirs, key=lambda rel: rel.count("/")):
+        dest.makedirs(rel)
+
+    def transfer(clone, rel):
+        copy(clone, source.path(rel), dest.path(rel))
+        mtime = source_files[rel][1]
+        if isinstance(dest, _LocalTree):
+            os.utime(dest.path(rel), (mtime, mtime))
+        else:
+            clone.utime(dest.path(rel), (mtime, mtime))
+
+    _run_jobs(store, changed, transfer, workers)
+
+    if delete:
+        for rel in extra_files:
+            dest.remove(rel)
+        for rel in extra_dirs:
+            dest.rmdir(rel)
+    if isinstance(dest, _ShareTree):
+        # The transfers went through clones of store, drop what it has cached
+        store._invalidate(dest.root, recursive=True)
+    return result
+
+
+def sync_to_share(
+    local_dir,
+    store,
+    remote_dir=".",
+    delete=False,
+    dry_run=False,
+    checksum=False,
+    workers=4,
+):
+    """Mirror a local directory to a directory on a share
+    Both trees are listed once, the share with a parallel walk, and only the
+    files that are new or differ in size or modification time are uploaded,
+    up to workers at a time. The uploaded files get the local modification
+    time, so a following sync finds them unchanged.
+    :param local_dir: local directory to copy from
+    :param store: DataStore of the share, e.g. an ERDAShare
+    :param remote_dir: directory on the share to copy to, it is created if needed
+    :param delete: remove the files and directories on the share
+    that are not in local_dir
+    :param dry_run: only work out what would be copied and deleted
+    :param checksum: compare the sha1 of files of equal size
+    instead of their modification time
+    :param workers: number of connections that list and transfer at once
+    :return: SyncResult
+    """
+    return _sync(
+        _LocalTree(local_dir),
+        _ShareTree(store, remote_dir, workers),
+        store,
+        _upload,
+        delete,
+        dry_run,
+        checksum,
+        workers,
+    )
+
+
+def sync_from_share(
+    store, remote_dir, local_dir, delete=False, dry_run=False, checksum=False, workers=4
+):
+    """Mirror a directory on a share to a local directory, see sync_to_share
+    :param store: DataStore of the share, e.g. an ERDAShare
+    :param remote_dir: directory on the share to copy from
+    :param local_dir: local directory to copy to, it is created if needed
+    :param delete: remove the local files and directories
+    that are not in remote_dir
+    :param dry_run: only work out what would be copied and deleted
+    :param checksum: compare the sha1 of files of equal size
+    instead of their modification time
+    :param workers: number of connections that list and transfer at once
+    :return: SyncResult
+    """
+    return _sync(
+        _ShareTree(store, remote_dir, workers),
+        _LocalTree(local_dir),
+        store,
+        _download,
+        delete,
+        dry_run,
+        checksum,
+        workers,
+    )
@@ -0,0 +1,412 @@
+import struct
+import zlib
+
+# Tags that describe the layout of the image data of a page
+_IMAGE_WIDTH = 256
+_IMAGE_LENGTH = 257
+_BITS_PER_SAMPLE = 258
+_COMPRESSION = 259
+_STRIP_OFFSETS = 273
+_SAMPLES_PER_PIXEL = 277
+_ROWS_PER_STRIP = 278
+_STRIP_BYTE_COUNTS = 279
+_PLANAR_CONFIGURATION = 284
+_PREDICTOR = 317
+_TILE_WIDTH = 322
+_SAMPLE_FORMAT = 339
+
+# TIFF field type -> (struct format, size in bytes)
+_FIELD_TYPES = {
+    1: ("B", 1),
+    2: ("s", 1),
+    3: ("H", 2),
+    4: ("I", 4),
+    5: ("II", 8),
+    6: ("b", 1),
+    7: ("B", 1),
+    8: ("h", 2),
+    9: ("i", 4),
+    10: ("ii", 8),
+    11: ("f", 4),
+    12: ("d", 8),
+    13: ("I", 4),
+    16: ("Q", 8),
+    17: ("q", 8),
+    18: ("Q", 8),
+}
+
+# SampleFormat -> numpy dtype kind
+_SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}
+
+
+def _unpack_packbits(data):
+    """Decode PackBits compressed bytes
+    :param data: compressed bytes
+    :return: bytearray
+    """
+    out = bytearray()
+    index = 0
+    while index < len(data):
+        header = data[index]
+        index += 1
+        if header < 128:
+            end = index + header + 1
+            out += data[index:end]
+            index = end
+        elif header > 128:
+            end = index + 1
+            out += data[index:end] * (257 - header)
+            index = end
+    return out
+
+
+class TIFFPage:
+    def __init__(self, tags, byteorder):
+        """
+        The layout of the image data of a single TIFF page
+        :param tags: dict of tag -> tuple of values
+        :param byteorder: "<" or ">"
+        """
+        if _TILE_WIDTH in tags:
+            raise ValueError("tiled TIFF pages are not supported")
+        if tags.get(_PLANAR_CONFIGURATION, (1,))[0] != 1:
+            raise ValueError("planar TIFF pages are not supported")
+        self.width = tags[_IMAGE_WIDTH][0]
+        self.height = tags[_IMAGE_LENGTH][0]
+        self.samples = tags.get(_SAMPLES_PER_PIXEL, (1,))[0]
+        bits = tags.get(_BITS_PER_SAMPLE, (1,))
+        if len(set(bits)) != 1 or bits[0] % 8:
+            raise ValueError("{} bits per sample are not supported".format(bits))
+        kind = _SAMPLE_KINDS[tags.get(_SAMPLE_FORMAT, (1,))[0]]
+        self.dtype = "{}{}{}".format(byteorder, kind, bits[0] // 8)
+        self.compression = tags.get(_COMPRESSION, (1,))[0]
+        if self.compression not in (1, 8, 32946, 32773):
+            raise ValueError(
+                "TIFF compression {} is not supported".format(self.compression)
+            )
+        self.predictor = tags.get(_PREDICTOR, (1,))[0]
+        if self.predictor not in (1, 2):
+            raise ValueError(
+                "TIFF predictor {} is not supported".format(self.predictor)
+            )
+        self.rows_per_strip = min(
+            tags.get(_ROWS_PER_STRIP, (self.height,))[0], self.height
+        )
+        self.strip_offsets = tags[_STRIP_OFFSETS]
+        self.strip_byte_counts = tags[_STRIP_BYTE_COUNTS]
+        self.row_bytes = self.width * self.samples * bits[0] // 8
+
+    @property
+    def shape(self):
+        if self.samples == 1:
+            return self.height, self.width
+        return self.height, self.width, self.samples
+
+    def byte_ranges(self, start, stop):
+        """Get the byte ranges that hold the rows start:stop
+        Uncompressed strips are narrowed to just the requested rows,
+        compressed strips have to be read whole.
+        :param start: first row
+        :param stop: row after the last row
+        :return: list of (offset, length, first row of the range, rows in range)
+        """
+        ranges = []
+        first, last = start // self.rows_per_strip, (stop - 1) // self.rows_per_strip
+        for strip in range(first, last + 1):
+            strip_start = strip * self.rows_per_strip
+            strip_rows = min(self.rows_per_strip, self.height - strip_start)
+            if self.compression == 1:
+                row_start = max(start, strip_start)
+                row_stop = min(stop, strip_start + strip_rows)
+                offset = self.strip_offsets[strip]
+                offset += (row_start - strip_start) * self.row_bytes
+                rows = row_stop - row_start
+                ranges.append((offset, rows * self.row_bytes, row_start, rows))
+            else:
+                ranges.append(
+                    (
+                        self.strip_offsets[strip],
+                        self.strip_byte_counts[strip],
+                        strip_start,
+                        strip_rows,
+                    )
+                )
+        return ranges
+
+    def decode(self, data, rows):
+        """
+        :param data: bytes of a range returned by byte_ranges
+        :param rows: number of rows in the range
+        :return: numpy array of the rows
+        """
+        import numpy as np
+
+        if self.compression in (8, 32946):
+            data = zlib.decompress(bytes(data))
+        elif self.compression == 32773:
+            data = _unpack_packbits(bytearray(data))
+        count = rows * self.width * self.samples
+        array = np.frombuffer(data, dtype=self.dtype, count=count)
+        array = array.reshape((rows, self.width, self.samples))
+        if self.predictor == 2:
+            # Horizontal differencing, integer samples wrap around like in C
+            array = np.cumsum(array, axis=1, dtype=array.dtype)
+        return array
+
+
+class TIFFStack:
+    # Bytes read at once while walking the IFD chain, IFDs that are stored
+    # close together, as in ImageJ stacks, are then parsed from one read
+    ifd_read_size = 64 * 1024
+    # Byte ranges closer than this are merged into a single read
+    merge_gap = 64 * 1024
+
+    def __init__(self, fh, close_handle=False):
+        """
+        Random access reader of TIFF stacks, where each page is a z slice.
+        Only the header, the IFDs of the pages that are accessed and the strips
+        that hold the requested rows are read through fh, so the amount
+        of bytes moved scales with the requested slab instead of the file.
+        Reading pages requires numpy.
+        :param fh: binary file object with seek and read(n),
+        e.g. a SFTPFileHandle opened with "rb"
+        :param close_handle: close fh when the stack is closed
+        """
+        self.fh = fh
+        self._close_handle = close_handle
+        self._block = (0, b"")
+        header = self._read(0, 16)
+        if header[:2] == b"II":
+            self.byteorder = "<"
+        elif header[:2] == b"MM":
+            self.byteorder = ">"
+        else:
+            raise ValueError("not a TIFF file")
+        version = struct.unpack(self.byteorder + "H", header[2:4])[0]
+        if version == 42:
+            self._offset_format, self._count_format, self._entry_size = "I", "H", 12
+            self._next_ifd = struct.unpack(self.byteorder + "I", header[4:8])[0]
+        elif version == 43:
+            self._offset_format, self._count_format, self._entry_size = "Q", "Q", 20
+            self._next_ifd = struct.unpack(self.byteorder + "Q", header[8:16])[0]
+        else:
+            raise ValueError("unknown TIFF version {}".format(version))
+        self._pages = []
+
+    @classmethod
+    def open(cls, store, path):
+        """
+        :param store: DataStore that holds the file
+        :param path: path to the TIFF file on the store
+        :return: TIFFStack that closes the file with the stack
+        """
+        return cls(store.open(path, "rb"), close_handle=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._close_handle:
+            self.fh.close()
+
+    def _read(self, offset, size):
+        """Read size bytes at offset, served from the last IFD read if possible
+        :return: bytes-like object of at most size bytes
+        """
+        block_offset, block = self._block
+        start = offset - block_offset
+        if start < 0 or start + size > len(block):
+            self.fh.seek(offset)
+            block = self.fh.read(max(size, self.ifd_read_size))
+            self._block = (offset, block)
+            start = 0
+        end = start + size
+        return block[start:end]
+
+    def _parse_ifd(self, offset):
+        """
+        :param offset: file offset of the IFD
+        :return: tuple of the tags dict and the offset of the next IFD
+        """
+        count_size = struct.calcsize(self._count_format)
+        offset_size = struct.calcsize(self._offset_format)
+        count = struct.unpack(
+            self.byteorder + self._count_format, self._read(offset, count_size)
+        )[0]
+        entries_size = count * self._entry_size
+        table = self._read(offset + count_size, entries_size + offset_size)
+        tags = {}
+        for index in range(count):
+            start = index * self._entry_size
+            end = start + self._entry_size
+            entry = table[start:end]
+            tag, field_type = struct.unpack(self.byteorder + "HH", entry[:4])
+            value_start = 4 + offset_size
+            value_count = struct.unpack(
+                self.byteorder + self._offset_format, entry[4:value_start]
+            )[0]
+            if field_type not in _FIELD_TYPES:
+                continue
+            value_format, value_size = _FIELD_TYPES[field_type]
+            data_size = value_count * value_size
+            data = entry[value_start:]
+            if data_size > offset_size:
+                value_offset = struct.unpack(
+                    self.byteorder + self._offset_format, data
+                )[0]
+                data = self._read(value_offset, data_size)
+            if field_type == 2:
+                tags[tag] = (bytes(data[:data_size]).rstrip(b"\0"),)
+                continue
+            tags[tag] = struct.unpack(
+                "{}{}{}".format(
+                    self.byteorder, value_count * len(value_format), value_format[0]
+                ),
+                bytes(data[:data_size]),
+            )
+        next_ifd = struct.unpack(
+            self.byteorder + self._offset_format, table[entries_size:]
+        )[0]
+        return tags, next_ifd
+
+    def page(self, index):
+        """
+        :param index: page number, the IFD chain is only walked up to it
+        :return: TIFFPage
+        """
+        while len(self._pages) <= index:
+            if not self._next_ifd:
+                raise IndexError("page {} is out of range".format(index))
+            tags, self._next_ifd = self._parse_ifd(self._next_ifd)
+            self._pages.append(TIFFPage(tags, self.byteorder))
+        return self._pages[index]
+
+    def __len__(self):
+        """
+        :return: the number of pages, walks the whole IFD chain
+        """
+        while self._next_ifd:
+            self.page(len(self._pages))
+        return len(self._pages)
+
+    @property
+    def shape(self):
+        return (len(self),) + self.page(0).shape
+
+    @property
+    def dtype(self):
+        return self.page(0).dtype
+
+    def __getitem__(self, key):
+        """Read a slab, e.g. stack[50:450, 50:450, 50:450]
+        :param key: index or slice of the pages, optionally followed
+        by the row and column index or slice
+        :return: numpy array
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        z = key[0]
+        rest = key[1:]
+        if isinstance(z, slice):
+            forward = z.step is None or z.step > 0
+            if forward and (z.start or 0) >= 0 and z.stop is not None and z.stop >= 0:
+                # Only walk the IFD chain up to the end of the slice,
+                # the pages beyond it don't change the selection
+                count = 0
+                while count < z.stop:
+                    try:
+                        self.page(count)
+                    except IndexError:
+                        break
+                    count += 1
+            else:
+                count = len(self)
+            return self.read(range(*z.indices(count)), *rest)
+        if z < 0:
+            z += len(self)
+        return self.read([z], *rest)[0]
+
+    def read(self, pages, rows=slice(None), columns=slice(None)):
+        """
+        :param pages: iterable of page numbers
+        :param rows: index or slice of the rows of each page
+        :param columns: index or slice of the columns of each page
+        :return: numpy array of shape (pages, rows, columns[, samples])
+        """
+        import numpy as np
+
+        pages = [self.page(index) for index in pages]
+        if not pages:
+            raise IndexError("no pages selected")
+        first = pages[0]
+        row_numbers = np.arange(first.height)[rows]
+        if not np.size(row_numbers):
+            raise IndexError("no rows selected")
+        start, stop = np.min(row_numbers), np.max(row_numbers) + 1
+        # (page number, range) for every byte range that has to be read
+        requests = []
+        for number, page in enumerate(pages):
+            if page.shape != first.shape or page.dtype != first.dtype:
+                raise ValueError("the pages differ in shape or type")
+            for byte_range in page.byte_ranges(start, stop):
+                requests.append((number, byte_range))
+        out = np.empty(
+            (len(pages), stop - start, first.width, first.samples), dtype=first.dtype
+        )
+        for number, (offset, length, row, count), data in self._fetch(requests):
+            decoded = pages[number].decode(data, count)
+            # Compressed strips may hold rows outside of the requested ones
+            low, high = max(row, start), min(row + count, stop)
+            out_rows = slice(low - start, high - start)
+            out[number, out_rows] = decoded[slice(low - row, high - row)]
+        if first.samples == 1:
+            out = out[..., 0]
+        out = out[:, np.atleast_1d(row_numbers) - start][:, :, columns]
+        if not np.ndim(row_numbers):
+            out = out[:, 0]
+        return out
+
+    def _fetch(self, requests):
+        """Read the byte ranges of requests, merging ranges that are close
+        together on disk into a single read
+        Handles with a readv method, e.g. those of a SFTPStore,
+        read all the merged ranges at once.
+        :param requests: list of (page number, (offset, length, row, rows))
+        :return: generator of (page number, range, data)
+        """
+        requests = sorted(requests, key=lambda request: request[1][0])
+        # (offset, length, first request, request after the last) of every run
+        runs = []
+        index = 0
+        while index < len(requests):
+            run_start = requests[index][1][0]
+            run_end = run_start + requests[index][1][1]
+            last = index + 1
+            while (
+                last < len(requests)
+                and requests[last][1][0] - run_end <= self.merge_gap
+            ):
+                run_end = max(run_end, requests[last][1][0] + requests[last][1][1])
+                last += 1
+            runs.append((run_start, run_end - run_start, index, last))
+            index = last
+        readv = getattr(self.fh, "readv", None)
+        if readv is not None:
+            datas = readv([(offset, length) for offset, length, _, _ in runs])
+        else:
+            datas = (self._read_run(offset, length) for offset, length, _, _ in runs)
+        for (run_start, _, first, last), data in zip(runs, datas):
+            for number, byte_range in requests[first:last]:
+                start = byte_range[0] - run_start
+                end = start + byte_range[1]
+                yield number, byte_range, data[start:end]
+
+    def _read_run(self, offset, length):
+        """
+        :return: memoryview of length bytes at offset
+        """
+        self.fh.seek(offset)
+        return memoryview(self.fh.read(length))
@@ -0,0 +1,210 @@
+import json
+import posixpath
+from ssh2.exceptions import SFTPProtocolError
+from ._io import _join_path
+
+try:
+    # zarr 2 only hands batched reads to stores that derive from its BaseStore
+    from zarr.storage import BaseStore as _MappingBase
+except ImportError:
+    try:
+        from collections.abc import MutableMapping as _MappingBase
+    except ImportError:
+        # Python 2
+        from collections import MutableMapping as _MappingBase
+
+# Keys of the zarr metadata documents
+_METADATA_NAMES = (".zarray", ".zgroup", ".zattrs")
+CONSOLIDATED_KEY = ".zmetadata"
+
+
+def _is_metadata_key(key):
+    return posixpath.basename(key) in _METADATA_NAMES
+
+
+class ShareChunkStore(_MappingBase):
+    def __init__(self, store, root=".", connections=4, consolidated=False):
+        """
+        A zarr compatible mapping of keys, e.g. "volume/.zarray" or
+        "volume/0.3.2", to the files below root on a share.
+        getitems and setitems read and write many chunks at once,
+        spread over several sessions of the store, see SFTPStore.read_files.
+        :param store: SFTPStore of the share, e.g. an ERDAShare
+        :param root: directory on the share that holds the arrays
+        :param connections: maximum number of sessions that chunks
+        are read and written over at once
+        :param consolidated: serve the metadata documents from the
+        .zmetadata document that consolidate_metadata writes,
+        so opening an array or group costs a single read
+        """
+        self.store = store
+        self.root = root
+        self.connections = connections
+        self.consolidated = consolidated
+        # Consolidated metadata documents, loaded on first use
+        self._metadata = None
+        # Directories that are known to exist
+        self._dirs = set()
+
+    def _path(self, key):
+        return _join_path(self.root, key.strip("/"))
+
+    def _consolidated(self):
+        """
+        :return: dict of key -> metadata document
+        """
+        if self._metadata is None:
+            data = self.store.read_files([self._path(CONSOLIDATED_KEY)])[0]
+            if data is None:
+                raise KeyError(CONSOLIDATED_KEY)
+            self._metadata = json.loads(data.decode("utf-8"))["metadata"]
+        return self._metadata
+
+    def _get_metadata(self, key):
+        """
+        :return: the encoded metadata document of key,
+        raises KeyError if it isn't in the consolidated metadata
+        """
+        document = self._consolidated()[key]
+        return json.dumps(document, indent=4, sort_keys=True).encode("utf-8")
+
+    def __getitem__(self, key):
+        found = self.getitems([key])
+        if key not in found:
+            raise KeyError(key)
+        return found[key]
+
+    def getitems(self, keys, contexts=None, **kwargs):
+        """Read many keys at once
+        :param keys: iterable of keys
+        :param contexts: ignored, part of the zarr store interface
+        :return: dict of key -> bytes of the keys that exist
+        """
+        found = {}
+        fetch = []
+        for key in keys:
+            if self.consolidated and _is_metadata_key(key):
+                try:
+                    found[key] = self._get_metadata(key)
+                except KeyError:
+                    pass
+            else:
+                fetch.append(key)
+        if fetch:
+            paths = [self._path(key) for key in fetch]
+            for key, data in zip(fetch, self.store.read_files(paths, self.connections)):
+                if data is not None:
+                    found[key] = data
+        return found
+
+    def __setitem__(self, key, value):
+        self.setitems({key: value})
+
+    def setitems(self, values):
+        """Write many keys at once
+        :param values: dict of key -> bytes-like value
+        :return: None
+        """
+        items = [(self._path(key), value) for key, value in values.items()]
+        for parent in sorted({posixpath.dirname(path) for path, _ in items}):
+            self._makedirs(parent)
+        self.store.write_files(items, self.connections)
+        if self._metadata is not None:
+            for key, value in values.items():
+                if _is_metadata_key(key):
+                    self._metadata[key] = json.loads(bytes(value).decode("utf-8"))
+
+    def _makedirs(self, path):
+        if path in ("", ".", "/") or path in self._dirs:
+            return
+        if not self.store.exists(path):
+            self._makedirs(posixpath.dirname(path))
+            self.store.mkdir(path)
+        self._dirs.add(path)
+
+    def __delitem__(self, key):
+        try:
+            self.store.remove(self._path(key))
+        except SFTPProtocolError:
+            raise KeyError(key)
+        if self._metadata is not None:
+            self._metadata.pop(key, None)
+
+    def __contains__(self, key):
+        if self.consolidated and _is_metadata_key(key):
+            try:
+                return key in self._consolidated()
+            except KeyError:
+                # The share has no consolidated metadata
+                return False
+        return self.store.exists(self._path(key))
+
+    def _walk(self, path=""):
+        """
+        :return: tuple of the lists of keys of the files and directories
+        below path
+        """
+        root = self._path(path)
+        if not self.store.exists(root):
+            return [], []
+        depth = 0 if self.root in ("", ".") else len(self.root.rstrip("/")) + 1
+        files, dirs = [], []
+        for dirpath, dirnames, filenames in self.store.walk(root):
+            rel = "" if dirpath in ("", ".") else dirpath[depth:]
+            files.extend(_join_path(rel, name) for name in filenames)
+            dirs.extend(_join_path(rel, name) for name in dirnames)
+        return files, dirs
+
+    def keys(self):
+        return self._walk()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def listdir(self, path=""):
+        """
+        :param path: key prefix of a group or array
+        :return: list of the names directly below path
+        """
+        try:
+            return sorted(self.store.list(self._path(path)))
+        except SFTPProtocolError:
+            return []
+
+    def rmdir(self, path=""):
+        """Remove everything below path
+        :param path: key prefix of a group or array
+        :return: None
+        """
+        files, dirs = self._walk(path)
+        for key in files:
+            self.store.remove(self._path(key))
+        for key in sorted(dirs, key=lambda key: -key.count("/")):
+            self.store.rmdir(self._path(key))
+        if path.strip("/"):
+            self.store.rmdir(self._path(path))
+        self._dirs = set()
+
+    def consolidate_metadata(self):
+        """Gather every metadata document into the .zmetadata document,
+        in the format of zarr.consolidate_metadata
+        :return: dict of key -> metadata document
+        """
+        keys = [key for key in self.keys() if _is_metadata_key(key)]
+        paths = [self._path(key) for key in keys]
+        metadata = {
+            key: json.loads(data.decode("utf-8"))
+            for key, data in zip(keys, self.store.read_files(paths, self.connections))
+            if data is not None
+        }
+        document = {"zarr_consolidated_format": 1, "metadata": metadata}
+        encoded = json.dumps(document, indent=4, sort_keys=True).encode("utf-8")
+        self.setitems({CONSOLIDATED_KEY: encoded})
+        self._metadata = metadata
+        return metadata
+
+    def close(self):
+        pass
@@ -1,11 +1,4 @@
-import sys
-from setuptools import find_packages
-
-# Python 2 install
-if sys.version_info[0] >= 3:
-    from distutils.core import setup
-else:
-    from setuptools import setup
+from setuptools import find_packages, setup
 
 with open("README.rst") as r_file:
     long_description = r_file.read()
@@ -26,4 +19,11 @@ setup(
         "six==1.15",
     ],
     include_package_data=True,
+    # fsspec imports the filesystems when the protocols are first used
+    entry_points={
+        "fsspec.specs": [
+            "erda = mig.io._fsspec:ERDAFileSystem",
+            "idmc = mig.io._fsspec:IDMCFileSystem",
+        ]
+    },
 )
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import unittest
+from random import random
+from mig.io import AsyncIDMCShare
+
+# Test input
+try:
+    with open("res/sharelinks.txt", "r") as file:
+        content = file.readlines()
+    assert content is not None
+    assert len(content) > 0
+    sharelinks = dict((tuple(line.rstrip().split("=") for line in content)))
+except IOError:
+    # Travis
+    assert "IDMC_TEST_SHARE" in os.environ
+
+    sharelinks = {"IDMC_TEST_SHARE": os.environ["IDMC_TEST_SHARE"]}
+
+
+class AsyncIDMCShareTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.share = AsyncIDMCShare(sharelinks["IDMC_TEST_SHARE"])
+        self.run_coroutine(self.share.connect())
+        self.seed = str(random())[2:10]
+        self.files = ["".join(["async_file", str(i), self.seed]) for i in range(20)]
+        self.dir_path = "".join(["async_directory", self.seed])
+        self.data = os.urandom(256 * 1024)
+
+    def tearDown(self):
+        async def cleanup():
+            for f in self.files:
+                if await self.share.exists(f):
+                    await self.share.remove(f)
+            if await self.share.exists(self.dir_path):
+                await self.share.rmdir(self.dir_path)
+            share_content = await self.share.list()
+            for f in self.files + [self.dir_path]:
+                self.assertNotIn(f, share_content)
+            await self.share.close()
+
+        self.run_coroutine(cleanup())
+        self.loop.close()
+        self.share = None
+
+    def run_coroutine(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_share(self):
+        async def share():
+            async with self.share.open(self.files[0], "w") as fh:
+                await fh.write("sddsfsf")
+            self.assertIn(self.files[0], await self.share.list())
+
+            async with self.share.open(self.files[0], "r") as fh:
+                self.assertEqual(await fh.read(), "sddsfsf")
+
+            fh = await self.share.open(self.files[0], "rb")
+            await fh.seek(3)
+            self.assertEqual(await fh.read(2), b"sf")
+            self.assertEqual(fh.tell(), 5)
+            await fh.close()
+
+        self.run_coroutine(share())
+
+    def test_concurrent(self):
+        async def concurrent():
+            # Many transfers are driven from the single loop thread
+            await asyncio.gather(
+                *[self.share.write(f, self.data, "wb") for f in self.files]
+            )
+            results = await asyncio.gather(
+                *[self.share.read_binary(f) for f in self.files],
+                *[self.share.exists(f) for f in self.files]
+            )
+            count = len(self.files)
+            for content in results[:count]:
+                self.assertEqual(content, self.data)
+            self.assertTrue(all(results[count:]))
+
+        self.run_coroutine(concurrent())
+
+    def test_mkdir(self):
+        async def mkdir():
+            self.assertFalse(await self.share.exists(self.dir_path))
+            await self.share.mkdir(self.dir_path)
+            self.assertIn(self.dir_path, await self.share.list())
+
+        self.run_coroutine(mkdir())
+
+    def test_missing(self):
+        async def missing():
+            channels = list(self.share._channels)
+            for f in self.files:
+                self.assertFalse(await self.share.exists(f))
+            # Errors that the server answers with keep the channels
+            self.assertEqual(self.share._channels, channels)
+
+        self.run_coroutine(missing())
+
+    def test_cancel(self):
+        async def cancel():
+            await self.share.write(self.files[0], os.urandom(8 * 1024 * 1024), "wb")
+            for delay in (0.01, 0.02, 0.05, 0.1):
+                task = asyncio.ensure_future(self.share.read_binary(self.files[0]))
+                await asyncio.sleep(delay)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                # The session is still usable once the channel is replaced
+                self.assertTrue(
+                    await asyncio.wait_for(self.share.exists(self.files[0]), 30)
+                )
+
+        self.run_coroutine(cancel())
@@ -0,0 +1,132 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from mig.io import BlockCache, MetadataCache
+
+
+class BlockCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = BlockCache(self.directory, block_size=1000, max_bytes=10000)
+        self.data = os.urandom(4500)
+        self.key = BlockCache.key("share", "file", len(self.data), 1)
+        self.fetches = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, offset, view):
+        self.fetches.append((offset, len(view)))
+        end = offset + len(view)
+        content = self.data[offset:end]
+        size = len(content)
+        view[:size] = content
+        return len(content)
+
+    def readinto(self, offset, length):
+        buffer = bytearray(length)
+        filled = self.cache.readinto(
+            self.key, len(self.data), offset, buffer, self.fetch
+        )
+        return bytes(buffer[:filled])
+
+    def test_read_through(self):
+        self.assertEqual(self.readinto(1500, 100), self.data[1500:1600])
+        # Only the block that covers the range is fetched
+        self.assertEqual(self.fetches, [(1000, 1000)])
+
+        # A reread is served from disk
+        self.assertEqual(self.readinto(1200, 500), self.data[1200:1700])
+        self.assertEqual(len(self.fetches), 1)
+
+        # The missing blocks around the cached one are fetched as runs
+        self.assertEqual(self.readinto(0, 10000), self.data)
+        self.assertEqual(self.fetches[1:], [(0, 1000), (2000, 2500)])
+
+        # Past the end of the file
+        self.assertEqual(self.readinto(4500, 10), b"")
+
+    def test_key(self):
+        # A changed file gets a new key
+        self.assertNotEqual(
+            self.key, BlockCache.key("share", "file", len(self.data), 2)
+        )
+        self.assertNotEqual(
+            self.key, BlockCache.key("other", "file", len(self.data), 1)
+        )
+
+    def test_evict(self):
+        self.cache.max_bytes = 2000
+        self.assertEqual(self.readinto(0, 4500), self.data)
+        self.assertLessEqual(self.cache._scan_usage(), 2000)
+
+        # The most recently written blocks are kept
+        self.assertIsNone(self.cache.get(self.key, 0))
+        self.assertEqual(self.cache.get(self.key, 4), self.data[4000:])
+
+        self.cache.clear()
+        self.assertEqual(self.cache._scan_usage(), 0)
+
+    def test_pickle(self):
+        self.assertEqual(self.readinto(0, 1000), self.data[:1000])
+        cache = pickle.loads(pickle.dumps(self.cache))
+        self.assertEqual(cache.directory, self.directory)
+        self.assertEqual(cache.get(self.key, 0), self.data[:1000])
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = MetadataCache(ttl=60)
+
+    def test_ttl(self):
+        self.cache.set("stat", "dir/file", 1)
+        self.assertEqual(self.cache.get("stat", "./dir//file"), 1)
+
+        # Each entry expires on its own
+        self.cache.ttl = -1
+        self.cache.set("stat", "dir/other", 2)
+        self.assertIs(self.cache.get("stat", "dir/other"), MetadataCache.MISSING)
+        self.assertEqual(self.cache.get("stat", "dir/file"), 1)
+
+    def test_exists(self):
+        self.assertIs(self.cache.exists("dir/file"), MetadataCache.MISSING)
+        # Missing paths are cached as None
+        self.cache.set("stat", "dir/missing", None)
+        self.assertFalse(self.cache.exists("dir/missing"))
+
+        # A listing of the parent answers for its entries
+        self.cache.set("list", "dir", ("file",))
+        self.assertTrue(self.cache.exists("dir/file"))
+        self.assertFalse(self.cache.exists("dir/other"))
+
+    def test_invalidate(self):
+        self.cache.set("list", ".", ("dir",))
+        self.cache.set("list", "dir", ("file",))
+        self.cache.set("stat", "dir/file", 1)
+        self.cache.set("stat", "dir/sub/file", 1)
+        self.cache.set("stat", "other", 1)
+
+        self.cache.invalidate("dir/file")
+        self.assertIs(self.cache.get("stat", "dir/file"), MetadataCache.MISSING)
+        self.assertIs(self.cache.get("list", "dir"), MetadataCache.MISSING)
+        self.assertEqual(self.cache.get("list", "."), ("dir",))
+
+        self.cache.invalidate("dir", recursive=True)
+        self.assertIs(self.cache.get("list", "."), MetadataCache.MISSING)
+        self.assertIs(self.cache.get("stat", "dir/sub/file"), MetadataCache.MISSING)
+        self.assertEqual(self.cache.get("stat", "other"), 1)
+
+    def test_max_entries(self):
+        self.cache.max_entries = 2
+        for index in range(3):
+            self.cache.set("stat", str(index), index)
+        self.assertIs(self.cache.get("stat", "0"), MetadataCache.MISSING)
+        self.assertEqual(self.cache.get("stat", "2"), 2)
+
+    def test_pickle(self):
+        self.cache.set("stat", "dir/file", 1)
+        cache = pickle.loads(pickle.dumps(self.cache))
+        self.assertEqual(cache.ttl, 60)
+        self.assertIs(cache.get("stat", "dir/file"), MetadataCache.MISSING)
@@ -2,16 +2,42 @@ import unittest
 import sys
 import os
 import six
+import shutil
+import tempfile
+import gc
+import io
+import json
+import multiprocessing
+import pickle
+import threading
 import _io
+import numpy as np
 from random import random
 from mig.io import (
+    IDMC,
+    BlockCache,
+    DirEntry,
     ERDASSHFSShare,
     ERDASftpShare,
     IDMCSSHFSShare,
     IDMCSftpShare,
+    IDMCShare,
+    MetadataCache,
     SFTPFileHandle,
+    ShareChunkStore,
+    SharePool,
+    SharePoolTimeout,
+    TransferStats,
+    sync_from_share,
+    sync_to_share,
 )
 
+try:
+    import fsspec
+    from mig.io import IDMCFileSystem
+except ImportError:
+    IDMCFileSystem = None
+
 # Test input
 try:
     with open("res/sharelinks.txt", "r") as file:
@@ -139,6 +165,9 @@ class IDMCSSHFSShareTest(unittest.TestCase):
         # List files/dirs in share
         self.share.write(self.tmp_file, six.text_type("sddsfsf"))
         self.assertIn(self.tmp_file, self.share.list())
+        entries = {entry.name: entry for entry in self.share.list_attr()}
+        self.assertIsInstance(entries[self.tmp_file], DirEntry)
+        self.assertEqual(entries[self.tmp_file].size, 7)
         # Read file directly as string
         self.assertEqual(self.share.read(self.tmp_file), "sddsfsf")
         # Read file directly as binary
@@ -517,6 +546,1006 @@ class ShareSFTPSeekOffsetTest(unittest.TestCase):
             self.assertEqual(end_content, six.ensure_binary(" World", encoding="utf-8"))
 
 
+class ShareSFTPPipelinedReadTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        self.seed = str(random())[2:10]
+        self.pipeline_file = "".join(["pipeline_file", self.seed])
+        # Spans several request windows
+        self.data = os.urandom(1024 * 1024 + 123)
+        with self.share.open(self.pipeline_file, "wb") as _file:
+            _file.write(self.data)
+
+        self.files = [self.pipeline_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+
+        share_content = self.share.list()
+        for f in self.files:
+            self.assertNotIn(f, share_content)
+        self.share = None
+
+    def test_pipelined_read(self):
+        with self.share.open(self.pipeline_file, "rb") as _file:
+            self.assertEqual(_file.read(), self.data)
+
+        # A small window forces many requests that must be reassembled in order
+        with self.share.open(
+            self.pipeline_file, "rb", chunk_size=1000, window=4
+        ) as _file:
+            self.assertEqual(_file.read(), self.data)
+
+    def test_pipelined_read_n(self):
+        with self.share.open(self.pipeline_file, "rb") as _file:
+            # Sized reads larger than a single SFTP packet
+            # should still return the full amount
+            first = _file.read(100000)
+            self.assertEqual(first, self.data[:100000])
+            second = _file.read(500000)
+            self.assertEqual(second, self.data[100000:600000])
+            self.assertEqual(_file.read(), self.data[600000:])
+            self.assertEqual(_file.read(10), b"")
+
+    def test_readinto(self):
+        buffer = bytearray(len(self.data))
+        with self.share.open(self.pipeline_file, "rb") as _file:
+            self.assertEqual(_file.readinto(buffer), len(self.data))
+        self.assertEqual(buffer, self.data)
+
+        # Fill a window into the middle of a larger buffer
+        buffer = bytearray(len(self.data) + 10)
+        with self.share.open(self.pipeline_file, "rb") as _file:
+            _file.seek(5)
+            self.assertEqual(
+                _file.readinto(memoryview(buffer)[10:]), len(self.data) - 5
+            )
+        self.assertEqual(buffer[10:-5], self.data[5:])
+
+        # Store level read directly into the buffer
+        buffer = bytearray(100)
+        self.assertEqual(self.share.readinto(self.pipeline_file, buffer), 100)
+        self.assertEqual(buffer, self.data[:100])
+
+    def test_read_ahead(self):
+        with self.share.open(self.pipeline_file, "rb") as _file:
+            chunks = [_file.read(1000) for _ in range(100)]
+            self.assertEqual(b"".join(chunks), self.data[:100000])
+            # The read-ahead buffer has grown past the reads
+            self.assertGreater(_file._ahead_size, 1000)
+            self.assertEqual(_file.tell(), 100000)
+
+            # A short seek back is served from the read-ahead data
+            _file.seek(-500, 1)
+            self.assertEqual(_file.read(1000), self.data[99500:100500])
+
+            # A seek elsewhere discards it
+            _file.seek(500000)
+            self.assertEqual(_file.read(1000), self.data[500000:501000])
+            self.assertEqual(_file.read(), self.data[501000:])
+
+    def test_readv(self):
+        ranges = [(500000, 100), (0, 10), (5, 10), (15, 5), (len(self.data) - 3, 10)]
+        views = self.share.readv(self.pipeline_file, ranges)
+        for view, (offset, length) in zip(views, ranges):
+            end = offset + length
+            self.assertEqual(view, self.data[offset:end])
+
+        # Through a handle into a preallocated buffer, the offset is kept
+        buffer = bytearray(200)
+        with self.share.open(self.pipeline_file, "rb") as _file:
+            _file.seek(42)
+            views = _file.readv(ranges, buffer=buffer)
+            self.assertEqual(_file.tell(), 42)
+        self.assertEqual(views[1], self.data[:10])
+        self.assertEqual(bytes(buffer[:20]), self.data[:20])
+
+
+class ShareSFTPRangeTransferTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        # Split even small test files across several connections
+        self.share.min_range_size = 64 * 1024
+        self.seed = str(random())[2:10]
+        self.range_file = "".join(["range_file", self.seed])
+        self.local_file = os.path.join(tempfile.gettempdir(), self.range_file)
+        self.data = os.urandom(1024 * 1024 + 123)
+        with self.share.open(self.range_file, "wb") as _file:
+            _file.write(self.data)
+
+        self.files = [self.range_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        if os.path.exists(self.local_file):
+            os.remove(self.local_file)
+
+        share_content = self.share.list()
+        for f in self.files:
+            self.assertNotIn(f, share_content)
+        self.share.close()
+        self.share = None
+
+    def test_parallel_read_binary(self):
+        self.assertEqual(self.share.read_binary(self.range_file), self.data)
+        self.assertIs(type(self.share.read_binary(self.range_file)), bytes)
+        self.assertEqual(
+            self.share.read_binary(self.range_file, connections=4), self.data
+        )
+
+    def test_handle_outlives_store(self):
+        link = sharelinks["IDMC_TEST_SHARE"]
+        share = IDMCSftpShare(link, link)
+        _file = share.open(self.range_file, "rb")
+        self.assertEqual(_file.read(100), self.data[:100])
+        _file.close()
+        share.close()
+        # Freeing the handle mustn't write to the socket of another session
+        other = IDMCSftpShare(link, link)
+        del _file
+        gc.collect()
+        self.assertEqual(other.read_binary(self.range_file), self.data)
+        other.close()
+
+    def test_parallel_download(self):
+        size = self.share.download(self.range_file, self.local_file, connections=4)
+        self.assertEqual(size, len(self.data))
+        with open(self.local_file, "rb") as _file:
+            self.assertEqual(_file.read(), self.data)
+
+        buffer = bytearray(len(self.data))
+        size = self.share.download(self.range_file, buffer, connections=3)
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(buffer, self.data)
+
+    def test_parallel_upload(self):
+        upload_file = "".join(["upload_file", self.seed])
+        self.files.append(upload_file)
+        size = self.share.upload(self.data, upload_file, connections=4)
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(self.share.read_binary(upload_file), self.data)
+
+        # Uploading a shorter local file truncates the remote one
+        with open(self.local_file, "wb") as _file:
+            _file.write(self.data[:1000])
+        size = self.share.upload(self.local_file, upload_file, connections=4)
+        self.assertEqual(size, 1000)
+        self.assertEqual(self.share.read_binary(upload_file), self.data[:1000])
+
+    def test_pipelined_write(self):
+        write_file = "".join(["write_file", self.seed])
+        self.files.append(write_file)
+        with self.share.open(write_file, "wb", chunk_size=1000, window=4) as _file:
+            _file.write(bytearray(self.data))
+            _file.write(memoryview(b"end"))
+        self.assertEqual(self.share.read_binary(write_file), self.data + b"end")
+
+
+class ShareSFTPPoolTest(unittest.TestCase):
+    pool = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share_link = sharelinks["IDMC_TEST_SHARE"]
+        self.pool = SharePool(
+            IDMC.url, self.share_link, self.share_link, min_size=1, max_size=2
+        )
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool = None
+
+    def test_reuse(self):
+        share = IDMCShare(self.share_link, pool=self.pool)
+        connection = share._connection
+        share.list()
+        share.close()
+
+        # The next store borrows the same session instead of opening a new one
+        share = IDMCShare(self.share_link, pool=self.pool)
+        self.assertIs(share._connection, connection)
+        share.list()
+        share.close()
+
+    def test_checkout(self):
+        with self.pool.checkout() as first:
+            self.assertTrue(first.is_alive())
+            with self.pool.checkout() as second:
+                self.assertIsNot(first, second)
+                # max_size connections are checked out
+                self.assertRaises(SharePoolTimeout, self.pool.acquire, 0.1)
+        with self.pool.checkout() as connection:
+            self.assertIn(connection, (first, second))
+        self.pool.close()
+        self.assertRaises(ValueError, self.pool.acquire)
+
+    def test_shared(self):
+        share = IDMCShare(self.share_link, pool=True)
+        other = IDMCShare(self.share_link, pool=True)
+        self.assertIs(share._pool, other._pool)
+        share.close()
+        other.close()
+        share._pool.close()
+
+
+class ShareSFTPBlockCacheTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = BlockCache(self.cache_dir, block_size=64 * 1024)
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"],
+            sharelinks["IDMC_TEST_SHARE"],
+            cache=self.cache,
+        )
+        self.seed = str(random())[2:10]
+        self.cache_file = "".join(["cache_file", self.seed])
+        self.data = os.urandom(256 * 1024 + 123)
+        with self.share.open(self.cache_file, "wb") as _file:
+            _file.write(self.data)
+
+        self.files = [self.cache_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        shutil.rmtree(self.cache_dir)
+        self.share = None
+
+    def test_cached_read(self):
+        with self.share.open(self.cache_file, "rb") as _file:
+            _file.seek(100000)
+            self.assertEqual(_file.read(1000), self.data[100000:101000])
+            self.assertEqual(_file.tell(), 101000)
+        self.assertGreater(self.cache._scan_usage(), 0)
+
+        # A reopened file is served from the cached blocks
+        with self.share.open(self.cache_file, "rb") as _file:
+            _file._fetch = None
+            _file.seek(70000)
+            self.assertEqual(_file.read(1000), self.data[70000:71000])
+
+        self.assertEqual(self.share.read_binary(self.cache_file), self.data)
+
+
+class ShareSSHFSBlockCacheTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = BlockCache(self.cache_dir, block_size=64 * 1024)
+        self.share = IDMCSSHFSShare(sharelinks["IDMC_TEST_SHARE"], cache=self.cache)
+        self.seed = str(random())[2:10]
+        self.cache_file = "".join(["cache_file", self.seed])
+        self.data = os.urandom(256 * 1024 + 123)
+        with self.share.open(self.cache_file, "wb") as _file:
+            _file.write(self.data)
+
+        self.files = [self.cache_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        shutil.rmtree(self.cache_dir)
+        self.share = None
+
+    def test_cached_read(self):
+        with self.share.open(self.cache_file, "rb") as _file:
+            _file.seek(100000)
+            self.assertEqual(_file.read(1000), self.data[100000:101000])
+            self.assertEqual(_file.tell(), 101000)
+        self.assertGreater(self.cache._scan_usage(), 0)
+
+        self.assertEqual(self.share.read_binary(self.cache_file), self.data)
+        with self.share.open(self.cache_file, "rb") as _file:
+            self.assertEqual(_file.read(), self.data)
+
+
+class ShareSFTPMetadataCacheTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.metadata = MetadataCache(ttl=60)
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"],
+            sharelinks["IDMC_TEST_SHARE"],
+            metadata=self.metadata,
+        )
+        self.seed = str(random())[2:10]
+        self.dir_path = "".join(["metadata_dir", self.seed])
+        self.file_path = "/".join([self.dir_path, "file"])
+        self.share.mkdir(self.dir_path)
+
+        self.files = [self.file_path]
+        self.dirs = [self.dir_path]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        for d in self.dirs:
+            if self.share.exists(d):
+                self.share.rmdir(d)
+        self.share = None
+
+    def test_cached_metadata(self):
+        self.assertFalse(self.share.exists(self.file_path))
+        self.assertNotIn("file", self.share.list(self.dir_path))
+        # Served from the cache
+        self.assertIsNone(self.metadata.get("stat", self.file_path))
+
+        # Writing through the store invalidates the cached entries
+        with self.share.open(self.file_path, "w") as _file:
+            _file.write("sharelogging")
+        self.assertTrue(self.share.exists(self.file_path))
+        self.assertIn("file", self.share.list(self.dir_path))
+
+        self.share.remove(self.file_path)
+        self.assertFalse(self.share.exists(self.file_path))
+        self.share.rmdir(self.dir_path)
+        self.assertFalse(self.share.exists(self.dir_path))
+
+
+class ShareSFTPIterdirTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        self.seed = str(random())[2:10]
+        self.dir_path = "".join(["iterdir_dir", self.seed])
+        self.sub_dir = "/".join([self.dir_path, "sub"])
+        self.share.mkdir(self.dir_path)
+        self.share.mkdir(self.sub_dir)
+        self.files = []
+        for index in range(10):
+            path = "/".join([self.dir_path, "file{}".format(index)])
+            with self.share.open(path, "wb") as _file:
+                _file.write(b"x" * index)
+            self.files.append(path)
+
+        self.dirs = [self.sub_dir, self.dir_path]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        for d in self.dirs:
+            if self.share.exists(d):
+                self.share.rmdir(d)
+        self.share = None
+
+    def test_iterdir(self):
+        entries = {entry.name: entry for entry in self.share.iterdir(self.dir_path)}
+        self.assertEqual(len(entries), 11)
+        self.assertNotIn(".", entries)
+        self.assertIsInstance(entries["sub"], DirEntry)
+        self.assertTrue(entries["sub"].is_dir)
+        self.assertFalse(entries["file3"].is_dir)
+        self.assertEqual(entries["file3"].size, 3)
+        self.assertGreater(entries["file3"].mtime, 0)
+
+        names = [entry.name for entry in self.share.list_attr(self.dir_path)]
+        self.assertEqual(sorted(names), sorted(entries))
+
+
+class ShareSFTPWalkTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        self.seed = str(random())[2:10]
+        self.root = "".join(["walk_dir", self.seed])
+        self.dirs = [self.root]
+        self.files = []
+        for first in ("a", "b"):
+            first_dir = "/".join([self.root, first])
+            self.dirs.append(first_dir)
+            for second in ("c", "d"):
+                second_dir = "/".join([first_dir, second])
+                self.dirs.append(second_dir)
+                for name in ("scan.tif", "notes.txt"):
+                    self.files.append("/".join([second_dir, name]))
+        for d in self.dirs:
+            self.share.mkdir(d)
+        for f in self.files:
+            with self.share.open(f, "w") as _file:
+                _file.write("sharelogging")
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        for d in reversed(self.dirs):
+            if self.share.exists(d):
+                self.share.rmdir(d)
+        self.share = None
+
+    def test_walk(self):
+        for workers in (1, 4):
+            walked = {
+                dirpath: (sorted(dirnames), sorted(filenames))
+                for dirpath, dirnames, filenames in self.share.walk(
+                    self.root, workers=workers
+                )
+            }
+            self.assertEqual(sorted(walked), sorted(self.dirs))
+            self.assertEqual(walked[self.root], (["a", "b"], []))
+            self.assertEqual(
+                walked["/".join([self.root, "a", "c"])], ([], ["notes.txt", "scan.tif"])
+            )
+
+        # Pruning dirnames in place skips the subtree
+        walked = []
+        for dirpath, dirnames, filenames in self.share.walk(self.root):
+            walked.append(dirpath)
+            if "a" in dirnames:
+                dirnames.remove("a")
+        self.assertEqual(len(walked), 4)
+
+    def test_sessions_kept(self):
+        # The share has no pool, the workers' sessions serve the next walk too
+        list(self.share.walk(self.root, workers=4))
+        idle = [connection for connection, _ in self.share._workers._idle]
+        self.assertTrue(idle)
+        list(self.share.walk(self.root, workers=4))
+        kept = [connection for connection, _ in self.share._workers._idle]
+        self.assertLessEqual(set(map(id, idle)), set(map(id, kept)))
+
+    def test_glob(self):
+        expected = [f for f in self.files if f.endswith(".tif")]
+        found = self.share.glob("/".join([self.root, "*", "*", "*.tif"]))
+        self.assertEqual(sorted(found), sorted(expected))
+        found = self.share.glob("/".join([self.root, "**", "scan.tif"]))
+        self.assertEqual(sorted(found), sorted(expected))
+        found = self.share.glob("/".join([self.root, "b", "?", "notes.txt"]))
+        self.assertEqual(len(list(found)), 2)
+
+
+class ShareSFTPStreamTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        self.seed = str(random())[2:10]
+        self.stream_file = "".join(["stream_file", self.seed])
+        self.lines = ["line {},\u00e6\n".format(i) for i in range(10000)]
+        with self.share.open(self.stream_file, "w", buffering=-1) as _file:
+            for line in self.lines:
+                _file.write(line)
+
+        self.files = [self.stream_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        self.share = None
+
+    def test_lines(self):
+        with self.share.open(self.stream_file, "r") as _file:
+            self.assertEqual(list(_file), self.lines)
+
+        # Reads continue right after the last line
+        with self.share.open(self.stream_file, "rb") as _file:
+            first = _file.readline()
+            self.assertEqual(first, self.lines[0].encode("utf-8"))
+            self.assertEqual(_file.tell(), len(first))
+            second = self.lines[1].encode("utf-8")
+            self.assertEqual(_file.read(len(second)), second)
+
+    def test_stream(self):
+        with self.share.open(self.stream_file, "r", buffering=-1) as _file:
+            self.assertIsInstance(_file, io.TextIOWrapper)
+            self.assertEqual(_file.readline(), self.lines[0])
+            self.assertEqual(_file.read(), "".join(self.lines[1:]))
+
+        with self.share.open(self.stream_file, "rb", buffering=0) as _file:
+            self.assertIsInstance(_file, io.RawIOBase)
+            size = _file.seek(0, io.SEEK_END)
+            self.assertEqual(size, len("".join(self.lines).encode("utf-8")))
+
+
+class ShareSFTPSyncTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        self.seed = str(random())[2:10]
+        self.remote_dir = "".join(["sync_dir", self.seed])
+        self.local_dir = tempfile.mkdtemp()
+        self.local_files = {
+            "scan.tif": b"sharelogging" * 1000,
+            "a/notes.txt": b"sharelogging",
+            "a/b/empty.txt": b"",
+        }
+        for rel, data in self.local_files.items():
+            path = os.path.join(self.local_dir, *rel.split("/"))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as _file:
+                _file.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.local_dir)
+        if self.share.exists(self.remote_dir):
+            dirs = []
+            for dirpath, dirnames, filenames in self.share.walk(self.remote_dir):
+                dirs.append(dirpath)
+                for name in filenames:
+                    self.share.remove("/".join([dirpath, name]))
+            for d in sorted(dirs, key=len, reverse=True):
+                self.share.rmdir(d)
+        self.share = None
+
+    def test_sync(self):
+        result = sync_to_share(
+            self.local_dir, self.share, self.remote_dir, dry_run=True
+        )
+        self.assertEqual(sorted(result.copied), sorted(self.local_files))
+        self.assertFalse(self.share.exists(self.remote_dir))
+
+        result = sync_to_share(self.local_dir, self.share, self.remote_dir)
+        self.assertEqual(sorted(result.copied), sorted(self.local_files))
+        for rel, data in self.local_files.items():
+            path = "/".join([self.remote_dir, rel])
+            self.assertEqual(self.share.read_binary(path), data)
+
+        # Only the changed file is transferred again
+        changed = os.path.join(self.local_dir, "a", "notes.txt")
+        with open(changed, "wb") as _file:
+            _file.write(b"changed")
+        result = sync_to_share(self.local_dir, self.share, self.remote_dir)
+        self.assertEqual(result.copied, ["a/notes.txt"])
+        self.assertEqual(result.unchanged, 2)
+
+        # The local copy is restored from the share
+        os.remove(changed)
+        result = sync_from_share(
+            self.share, self.remote_dir, self.local_dir, delete=True, checksum=True
+        )
+        self.assertEqual(result.copied, ["a/notes.txt"])
+        self.assertEqual(result.unchanged, 2)
+        with open(changed, "rb") as _file:
+            self.assertEqual(_file.read(), b"changed")
+
+        os.remove(os.path.join(self.local_dir, "scan.tif"))
+        result = sync_to_share(self.local_dir, self.share, self.remote_dir, delete=True)
+        self.assertEqual(result.deleted, ["scan.tif"])
+        self.assertFalse(self.share.exists("/".join([self.remote_dir, "scan.tif"])))
+
+
+class ShareSFTPArrayTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        self.seed = str(random())[2:10]
+        self.raw_file = "".join(["array_file", self.seed, ".raw"])
+        self.npy_file = "".join(["array_file", self.seed, ".npy"])
+        self.volume = (np.random.random((20, 64, 48)) * 60000).astype("uint16")
+        self.files = [self.raw_file, self.npy_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        self.share = None
+
+    def test_raw(self):
+        self.share.write_array(self.raw_file, self.volume)
+        array = self.share.read_array(self.raw_file, "uint16", self.volume.shape)
+        self.assertTrue((array == self.volume).all())
+
+        # A slab from the middle of the volume
+        offset = self.volume[0].nbytes * 5
+        array = self.share.read_array(
+            self.raw_file, "uint16", (3,) + self.volume.shape[1:], offset=offset
+        )
+        self.assertTrue((array == self.volume[5:8]).all())
+        self.assertEqual(
+            self.share.read_array(self.raw_file, "uint16").size, self.volume.size
+        )
+        self.assertRaises(
+            IOError,
+            self.share.read_array,
+            self.raw_file,
+            "uint16",
+            self.volume.size + 1,
+        )
+
+    def test_npy(self):
+        for array in (self.volume, np.asfortranarray(self.volume), self.volume[::2]):
+            self.share.write_npy(self.npy_file, array)
+            expected = io.BytesIO()
+            np.save(expected, array)
+            data = self.share.read_binary(self.npy_file)
+            self.assertEqual(bytes(data), expected.getvalue())
+
+            loaded = self.share.read_npy(self.npy_file)
+            self.assertEqual(loaded.shape, array.shape)
+            self.assertTrue((loaded == array).all())
+
+
+@unittest.skipIf(IDMCFileSystem is None, "fsspec is not installed")
+class ShareFsspecTest(unittest.TestCase):
+    fs = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.fs = IDMCFileSystem(sharelinks["IDMC_TEST_SHARE"])
+        self.seed = str(random())[2:10]
+        self.root = "".join(["fsspec_dir", self.seed])
+        self.data = bytes(bytearray(range(256))) * 4000
+        self.fs.makedirs("/".join([self.root, "sub"]))
+        self.fs.pipe("/".join([self.root, "data.bin"]), self.data)
+        self.fs.pipe("/".join([self.root, "sub", "notes.txt"]), b"sharelogging")
+
+    def tearDown(self):
+        if self.fs.exists(self.root):
+            self.fs.rm(self.root, recursive=True)
+        self.fs = None
+
+    def test_url(self):
+        url = "idmc://{}/{}/data.bin".format(sharelinks["IDMC_TEST_SHARE"], self.root)
+        fs, path = fsspec.core.url_to_fs(url)
+        self.assertIsInstance(fs, IDMCFileSystem)
+        self.assertEqual(path, "/".join([self.root, "data.bin"]))
+
+    def test_listing(self):
+        listing = self.fs.ls(self.root, detail=True)
+        self.assertEqual(
+            sorted((entry["name"], entry["type"]) for entry in listing),
+            [
+                ("/".join([self.root, "data.bin"]), "file"),
+                ("/".join([self.root, "sub"]), "directory"),
+            ],
+        )
+        self.assertEqual(
+            self.fs.find(self.root),
+            [
+                "/".join([self.root, "data.bin"]),
+                "/".join([self.root, "sub", "notes.txt"]),
+            ],
+        )
+        self.assertEqual(len(self.fs.find(self.root, maxdepth=1)), 1)
+        self.assertEqual(
+            self.fs.size("/".join([self.root, "data.bin"])), len(self.data)
+        )
+
+    def test_read(self):
+        path = "/".join([self.root, "data.bin"])
+        self.assertEqual(self.fs.cat_file(path, 100, 300), self.data[100:300])
+        ranges = self.fs.cat_ranges(
+            [path, path, "/".join([self.root, "missing"])], [0, -10, 0], [10, None, 10]
+        )
+        self.assertEqual(ranges[:2], [self.data[:10], self.data[-10:]])
+        self.assertIsInstance(ranges[2], FileNotFoundError)
+        missing = "/".join([self.root, "missing"])
+        self.assertRaises(FileNotFoundError, self.fs.cat_file, missing)
+        self.assertRaises(
+            FileNotFoundError, self.fs.cat_ranges, [missing], 0, 10, on_error="raise"
+        )
+        with self.fs.open(path, "rb", cache_type="readahead") as _file:
+            _file.seek(5000)
+            self.assertEqual(_file.read(100), self.data[5000:5100])
+            self.assertEqual(_file.read(), self.data[5100:])
+
+    def test_write(self):
+        path = "/".join([self.root, "sub", "notes.txt"])
+        with self.fs.open(path, "wb") as _file:
+            _file.write(b"short")
+        with self.fs.open(path, "ab") as _file:
+            _file.write(b"er")
+        self.assertEqual(self.fs.cat(path), b"shorter")
+
+
+class ShareChunkStoreTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        self.seed = str(random())[2:10]
+        self.root = "".join(["chunk_dir", self.seed])
+        self.store = ShareChunkStore(self.share, self.root)
+        self.chunks = {
+            "volume/{}.{}.0".format(z, y): bytes(bytearray([z, y])) * 1000
+            for z in range(3)
+            for y in range(4)
+        }
+        self.store.setitems(self.chunks)
+        self.store[".zgroup"] = b'{"zarr_format": 2}'
+        self.store["volume/.zarray"] = b'{"zarr_format": 2, "shape": [3]}'
+
+    def tearDown(self):
+        self.store.rmdir("")
+        if self.share.exists(self.root):
+            self.share.rmdir(self.root)
+        self.share = None
+
+    def test_mapping(self):
+        self.assertEqual(self.store["volume/1.2.0"], self.chunks["volume/1.2.0"])
+        self.assertIn("volume/.zarray", self.store)
+        self.assertNotIn("volume/9.9.9", self.store)
+        self.assertRaises(KeyError, self.store.__getitem__, "volume/9.9.9")
+        self.assertEqual(len(self.store), len(self.chunks) + 2)
+        self.assertIn("0.0.0", self.store.listdir("volume"))
+
+        del self.store["volume/0.0.0"]
+        self.assertNotIn("volume/0.0.0", self.store)
+        self.assertRaises(KeyError, self.store.__delitem__, "volume/0.0.0")
+
+    def test_getitems(self):
+        keys = sorted(self.chunks) + ["volume/9.9.9"]
+        found = self.store.getitems(keys)
+        self.assertEqual(found, self.chunks)
+
+    def test_sessions_kept(self):
+        # The share has no pool, the extra sessions serve the next batch too
+        self.store.getitems(sorted(self.chunks))
+        idle = [connection for connection, _ in self.share._workers._idle]
+        self.assertEqual(len(idle), self.store.connections - 1)
+        self.store.getitems(sorted(self.chunks))
+        kept = [connection for connection, _ in self.share._workers._idle]
+        self.assertEqual(sorted(map(id, kept)), sorted(map(id, idle)))
+
+    def test_consolidated(self):
+        # Before the metadata is consolidated
+        store = ShareChunkStore(self.share, self.root, consolidated=True)
+        self.assertNotIn("volume/.zarray", store)
+
+        metadata = self.store.consolidate_metadata()
+        self.assertEqual(sorted(metadata), [".zgroup", "volume/.zarray"])
+
+        store = ShareChunkStore(self.share, self.root, consolidated=True)
+        self.assertEqual(json.loads(store["volume/.zarray"].decode())["shape"], [3])
+        # Metadata that isn't consolidated is missing without a lookup
+        self.assertNotIn("missing/.zarray", store)
+        self.assertEqual(store["volume/2.3.0"], self.chunks["volume/2.3.0"])
+
+
+class ShareSFTPProcessTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"]
+        )
+        self.seed = str(random())[2:10]
+        self.process_file = "".join(["process_file", self.seed])
+        self.data = os.urandom(100000)
+        self.share.upload(self.data, self.process_file)
+        self.files = [self.process_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        self.share = None
+
+    def test_pickle(self):
+        share = pickle.loads(pickle.dumps(self.share))
+        self.assertIsNot(share._connection, self.share._connection)
+        self.assertEqual(bytes(share.read_binary(self.process_file)), self.data)
+        share.close()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    def test_fork(self):
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+
+        def read():
+            data = self.share.read_binary(self.process_file)
+            results.put(bytes(data) == self.data)
+            self.share.close()
+
+        processes = [context.Process(target=read) for _ in range(2)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual([results.get() for _ in processes], [True, True])
+        # The parent's session is untouched by the children
+        self.assertEqual(bytes(self.share.read_binary(self.process_file)), self.data)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    def test_fork_idle_pool(self):
+        share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"], pool=True
+        )
+        share.list(".")
+        # Only the shared pool refers to the idle session now
+        share.close()
+        del share
+        gc.collect()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"], sharelinks["IDMC_TEST_SHARE"], pool=True
+        )
+        self.assertTrue(share.exists(self.process_file))
+        share.close()
+
+
+class ShareSFTPThreadSafeTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"],
+            sharelinks["IDMC_TEST_SHARE"],
+            thread_safe=True,
+        )
+        self.seed = str(random())[2:10]
+        self.files = []
+        self.data = {}
+        for index in range(8):
+            path = "".join(["thread_file", self.seed, "_", str(index)])
+            self.data[path] = os.urandom(100000 + index)
+            self.files.append(path)
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        self.share.close()
+        self.share = None
+
+    def test_threads(self):
+        def work(path):
+            with self.share.open(path, "wb") as _file:
+                _file.write(self.data[path])
+            with self.share.open(path, "rb") as _file:
+                read = _file.read()
+            ranges = self.share.readv(path, [(0, 10), (50000, 20000)])
+            return (
+                read == self.data[path]
+                and bytes(ranges[1]) == self.data[path][50000:70000]
+                and path in self.share.list(".")
+            )
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda path=path: results.append(work(path)))
+            for path in self.files
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * len(self.files))
+        # The threads shared the store's session
+        self.assertIs(self.share._shared.connection, self.share._connection)
+
+    def test_closed_store(self):
+        link = sharelinks["IDMC_TEST_SHARE"]
+        share = IDMCSftpShare(link, link, thread_safe=True)
+        self.assertFalse(share.exists(self.files[0]))
+        share.close()
+        self.assertIsNone(share._shared.connection)
+        # Freeing the closed store leaves the sessions opened since alone
+        other = IDMCSftpShare(link, link)
+        del share
+        gc.collect()
+        self.assertFalse(other.exists(self.files[0]))
+        other.close()
+
+
+class ShareSFTPStatsTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.stats = TransferStats()
+        self.share = IDMCSftpShare(
+            sharelinks["IDMC_TEST_SHARE"],
+            sharelinks["IDMC_TEST_SHARE"],
+            stats=self.stats,
+        )
+        self.seed = str(random())[2:10]
+        self.stats_file = "".join(["stats_file", self.seed])
+        self.data = os.urandom(1000000)
+        self.files = [self.stats_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        self.share.close()
+        self.share = None
+
+    def test_stats(self):
+        self.share.upload(self.data, self.stats_file)
+        self.share.readv(self.stats_file, [(0, 100), (500000, 100)])
+        with self.share.open(self.stats_file, "rb") as _file:
+            self.assertEqual(_file.read(), self.data)
+
+        snapshot = self.stats.snapshot()
+        operations = snapshot["operations"]
+        # The setup of the store's session
+        self.assertEqual(operations["connect.handshake"]["count"], 1)
+        self.assertEqual(operations["upload"]["bytes"], len(self.data))
+        self.assertEqual(operations["readv"]["bytes"], 200)
+        self.assertEqual(operations["file.read"]["bytes"], len(self.data))
+        self.assertGreater(operations["file.read"]["p50"], 0)
+        self.assertGreaterEqual(snapshot["depths"]["readv"]["max"], 1)
+        self.assertEqual(snapshot["in_flight"], 0)
+        self.assertIn(
+            'mig_io_operations_total{op="upload"} 1', self.stats.prometheus_text()
+        )
+
+
+class ShareSSHFSStatsTest(unittest.TestCase):
+    share = None
+
+    def setUp(self):
+        assert "IDMC_TEST_SHARE" in sharelinks
+        self.stats = TransferStats()
+        self.share = IDMCSSHFSShare(sharelinks["IDMC_TEST_SHARE"], stats=self.stats)
+        self.seed = str(random())[2:10]
+        self.stats_file = "".join(["stats_file", self.seed])
+        self.data = os.urandom(100000)
+        self.files = [self.stats_file]
+
+    def tearDown(self):
+        for f in self.files:
+            if self.share.exists(f):
+                self.share.remove(f)
+        self.share.close()
+        self.share = None
+
+    def test_stats(self):
+        with self.share.open(self.stats_file, "wb") as _file:
+            _file.write(self.data)
+        self.assertEqual(self.share.read_binary(self.stats_file), self.data)
+
+        operations = self.stats.snapshot()["operations"]
+        self.assertEqual(operations["connect"]["count"], 1)
+        self.assertEqual(operations["open"]["count"], 1)
+        self.assertEqual(operations["read_binary"]["bytes"], len(self.data))
+
+
 class ShareSSHFSSeekOffsetTest(unittest.TestCase):
     share = None
 
@@ -0,0 +1,108 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from mig.io import TransferStats
+from mig.io._stats import _result_size, _timed
+
+
+class _Store:
+    _stats = None
+
+    @_timed("read", _result_size)
+    def read(self, size):
+        return bytearray(size)
+
+    @_timed("read_twice", _result_size)
+    def read_twice(self, size):
+        return [self.read(size), self.read(size)]
+
+    @_timed("fail")
+    def fail(self):
+        raise IOError("failed")
+
+
+class TransferStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.stats = TransferStats(buckets=(0.1, 1.0))
+        self.store = _Store()
+        self.store._stats = self.stats
+
+    def test_disabled(self):
+        store = _Store()
+        self.assertEqual(len(store.read(10)), 10)
+        self.assertEqual(self.stats.snapshot()["operations"], {})
+
+    def test_record(self):
+        self.store.read(10)
+        self.store.read_twice(5)
+        self.assertRaises(IOError, self.store.fail)
+        operations = self.stats.snapshot()["operations"]
+        self.assertEqual(operations["read"]["count"], 3)
+        self.assertEqual(operations["read"]["bytes"], 20)
+        self.assertEqual(operations["read_twice"]["bytes"], 10)
+        self.assertEqual(operations["fail"]["count"], 1)
+        self.assertEqual(operations["fail"]["errors"], 1)
+        self.assertEqual(operations["fail"]["bytes"], 0)
+        # Nested calls only count once as in flight
+        snapshot = self.stats.snapshot()
+        self.assertEqual(snapshot["in_flight"], 0)
+        self.assertEqual(snapshot["max_in_flight"], 1)
+
+    def test_histogram(self):
+        for seconds in (0.05, 0.05, 0.5, 5.0):
+            self.stats.record("op", seconds)
+        operations = self.stats.snapshot()["operations"]
+        self.assertEqual(
+            operations["op"]["buckets"], [(0.1, 2), (1.0, 1), (float("inf"), 1)]
+        )
+        self.assertAlmostEqual(operations["op"]["p50"], 0.1)
+        # Beyond the last bound
+        self.assertEqual(operations["op"]["p99"], 1.0)
+        self.assertAlmostEqual(operations["op"]["seconds"], 5.6)
+
+    def test_depth(self):
+        self.stats.record_depth("readv", 2)
+        self.stats.record_depth("readv", 6)
+        depths = self.stats.snapshot()["depths"]
+        self.assertEqual(depths["readv"], {"samples": 2, "mean": 4.0, "max": 6})
+
+    def test_sink(self):
+        events = []
+        self.stats.add_sink(lambda *event: events.append(event))
+        self.store.read(3)
+        self.assertEqual(len(events), 1)
+        op, seconds, nbytes, error = events[0]
+        self.assertEqual((op, nbytes, error), ("read", 3, False))
+
+    def test_prometheus(self):
+        self.stats.record("read", 0.5, nbytes=100)
+        self.stats.record("read", 0.05, nbytes=50)
+        text = self.stats.prometheus_text()
+        self.assertIn('mig_io_operations_total{op="read"} 2', text)
+        self.assertIn('mig_io_bytes_total{op="read"} 150', text)
+        self.assertIn('mig_io_duration_seconds_bucket{op="read",le="0.1"} 1', text)
+        self.assertIn('mig_io_duration_seconds_bucket{op="read",le="+Inf"} 2', text)
+        self.assertIn("mig_io_in_flight 0", text)
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "mig_io.prom")
+            self.stats.write_prometheus(path)
+            with open(path) as prom_file:
+                self.assertEqual(prom_file.read(), text)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_reset(self):
+        self.store.read(1)
+        self.stats.reset()
+        self.assertEqual(self.stats.snapshot()["operations"], {})
+
+    def test_pickle(self):
+        self.store.read(1)
+        stats = pickle.loads(pickle.dumps(self.stats))
+        # The copy starts out empty
+        self.assertEqual(stats.bounds, self.stats.bounds)
+        self.assertEqual(stats.snapshot()["operations"], {})
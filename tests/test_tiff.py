@@ -0,0 +1,79 @@
+import io
+import unittest
+import numpy as np
+from PIL import Image
+from mig.io import TIFFPage, TIFFStack
+
+
+class VectoredBytesIO(io.BytesIO):
+    def __init__(self, data):
+        super(VectoredBytesIO, self).__init__(data)
+        self.calls = []
+
+    def readv(self, ranges):
+        self.calls.append(ranges)
+        view = memoryview(self.getvalue())
+        return [view[offset:][:length] for offset, length in ranges]
+
+
+class TIFFStackTest(unittest.TestCase):
+    def setUp(self):
+        self.volume = (np.random.random((7, 33, 21)) * 60000).astype("uint16")
+
+    def save(self, compression=None):
+        pages = [Image.fromarray(page) for page in self.volume]
+        data = io.BytesIO()
+        pages[0].save(
+            data,
+            format="TIFF",
+            save_all=True,
+            append_images=pages[1:],
+            compression=compression,
+        )
+        data.seek(0)
+        return TIFFStack(data)
+
+    def test_image(self):
+        with open("res/test_image.tiff", "rb") as _file:
+            stack = TIFFStack(_file)
+            expected = np.array(Image.open("res/test_image.tiff"))
+            self.assertEqual(stack.shape, (1,) + expected.shape)
+            self.assertTrue((stack[0] == expected).all())
+            self.assertTrue((stack[0, 10:20, 5] == expected[10:20, 5]).all())
+
+    def test_slab(self):
+        for compression in (None, "tiff_deflate", "packbits"):
+            stack = self.save(compression)
+            self.assertEqual(stack.shape, self.volume.shape)
+            self.assertTrue((stack[:] == self.volume).all())
+            self.assertTrue(
+                (stack[2:5, 3:30:2, 4:9] == self.volume[2:5, 3:30:2, 4:9]).all()
+            )
+            self.assertTrue((stack[-1, 5] == self.volume[-1, 5]).all())
+            for pages in (slice(None, 2, -1), slice(5, None, -2), slice(-3, None)):
+                self.assertTrue((stack[pages] == self.volume[pages]).all())
+
+    def test_lazy_pages(self):
+        stack = self.save()
+        self.assertTrue((stack[1:3] == self.volume[1:3]).all())
+        # Only the IFDs up to the requested pages have been parsed
+        self.assertEqual(len(stack._pages), 3)
+        self.assertEqual(len(stack), len(self.volume))
+        self.assertRaises(IndexError, stack.page, len(self.volume))
+
+    def test_readv(self):
+        data = self.save().fh.getvalue()
+        stack = TIFFStack(VectoredBytesIO(data))
+        stack.merge_gap = 0
+        self.assertTrue((stack[1:4, 2:6] == self.volume[1:4, 2:6]).all())
+        # The runs of all the pages are read at once
+        self.assertEqual(len(stack.fh.calls), 1)
+        self.assertEqual(len(stack.fh.calls[0]), 3)
+
+    def test_predictor(self):
+        tags = {256: (4,), 257: (4,), 258: (32,), 339: (3,), 259: (8,)}
+        tags.update({273: (8,), 279: (64,), 317: (2,)})
+        self.assertEqual(TIFFPage(tags, "<").predictor, 2)
+        # Floating point prediction isn't decoded
+        tags[317] = (3,)
+        self.assertRaises(ValueError, TIFFPage, tags, "<")